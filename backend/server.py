@@ -1,11 +1,12 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 # MongoDB removed
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, AsyncIterator, Callable
 from pathlib import Path
-from datetime import datetime
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
 import os
 import uuid
 import asyncio
@@ -16,12 +17,24 @@ import socket
 import re
 import platform
 import subprocess
-import concurrent.futures
 import io
 import time
+import contextlib
+import bisect
+import fnmatch
+import posixpath
+import hashlib
+import hmac
+import secrets
+import mmap
+import ssl
+import contextvars
+import zlib
+import mimetypes
+import urllib.parse
 from starlette.staticfiles import StaticFiles
-from starlette.responses import FileResponse, HTMLResponse
-from ftplib import FTP, error_perm
+from starlette.responses import FileResponse, HTMLResponse, StreamingResponse
+from ftplib import error_perm, error_temp, error_reply, error_proto
 
 ROOT_DIR = Path(__file__).parent
 PROJECT_ROOT = ROOT_DIR.parent
@@ -84,24 +97,285 @@ def get_frontend_build_dir() -> Optional[Path]:
 # -----------------------------
 # WebSocket Signaling for WebRTC
 # -----------------------------
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", 5))  # A client that cannot take a frame this fast is dropped
+WS_SNAPSHOT_EVERY = 32  # Membership events between full "peers" snapshots
+WS_OUTBOX_FRAMES = int(os.environ.get("WS_OUTBOX_FRAMES", 256))
+WS_ICE_BATCH_WINDOW = float(os.environ.get("WS_ICE_BATCH_WINDOW", 0.025))  # 0 disables ICE batching
+WS_ICE_BATCH_MAX = 32
+WS_JOIN_TIMEOUT = float(os.environ.get("WS_JOIN_TIMEOUT", 10))  # A socket must send "join" within this
+WS_PING_INTERVAL = float(os.environ.get("WS_PING_INTERVAL", 20))
+WS_LIVENESS_TIMEOUT = float(os.environ.get("WS_LIVENESS_TIMEOUT", 60))  # Silent this long (no frames, no pongs) = dead
+WS_MAX_SESSIONS = int(os.environ.get("WS_MAX_SESSIONS", 1000))
+WS_MAX_PEERS = int(os.environ.get("WS_MAX_PEERS", 256))  # Per session, per worker
+
+# Outbound frame kinds. ICE candidates may be shed under pressure (trickle ICE
+# tolerates gaps); a snapshot supersedes any membership frame queued before it;
+# everything else (SDP, chat, pong) is kept or the consumer is disconnected.
+FRAME_SIGNAL = "signal"
+FRAME_ICE = "ice"
+FRAME_MEMBERSHIP = "membership"
+FRAME_SNAPSHOT = "snapshot"
+
+# Relayed frames are forwarded as sent with "from" spliced in, so a several-KB
+# SDP body is never decoded or re-encoded. Only the envelope is read: the
+# frontend always puts "type" then "to" first, and scan_envelope stops at the
+# first other key. Frames whose envelope is not in that shape (a list "to",
+# keys in another order) fall back to a full parse. Set WS_VALIDATE_ENVELOPE=1
+# to parse every frame, refuse anything that is not a JSON object and check
+# the envelope types.
+RELAYED_TYPES = frozenset(("sdp-offer", "sdp-answer", "ice-candidate", "text"))
+WS_VALIDATE_ENVELOPE = os.environ.get("WS_VALIDATE_ENVELOPE", "0") == "1"
+_ENVELOPE_KEYS = ("type", "to")
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def scan_envelope(frame: str) -> Optional[Dict[str, str]]:
+    """Read the leading string members "type" and "to" of an object frame.
+
+    Stops at the first other key or non-string value, so the body is never
+    scanned. Returns None if the frame does not start like a JSON object.
+    """
+    skip = _WHITESPACE.match
+    i = skip(frame).end()
+    if frame[i:i + 1] != "{":
+        return None
+    fields: Dict[str, str] = {}
+    while len(fields) < len(_ENVELOPE_KEYS):
+        i = skip(frame, i + 1).end()
+        if frame[i:i + 1] != '"':
+            break
+        try:
+            key, i = json.decoder.scanstring(frame, i + 1)
+            i = skip(frame, i).end()
+            if key not in _ENVELOPE_KEYS or key in fields or frame[i:i + 1] != ":":
+                break
+            i = skip(frame, i + 1).end()
+            if frame[i:i + 1] != '"':
+                break
+            fields[key], i = json.decoder.scanstring(frame, i + 1)
+        except ValueError:
+            return None
+        i = skip(frame, i).end()
+        if frame[i:i + 1] != ",":
+            break
+    return fields
+
+
+def read_envelope(frame: str, validate: bool = WS_VALIDATE_ENVELOPE) -> tuple:
+    """Return ``(type, to, msg)`` for a client frame.
+
+    ``msg`` is the decoded object when the frame had to be parsed, else None.
+    Raises ValueError for frames that are not JSON objects or, when validating,
+    whose envelope fields have the wrong types.
+    """
+    if not validate:
+        fields = scan_envelope(frame)
+        if fields and "type" in fields and ("to" in fields or fields["type"] not in RELAYED_TYPES):
+            return fields["type"], fields.get("to"), None
+    msg = json.loads(frame)
+    if not isinstance(msg, dict):
+        raise ValueError("signaling frame is not an object")
+    mtype, target = msg.get("type"), msg.get("to")
+    if validate and mtype in RELAYED_TYPES and not (
+            isinstance(target, str) or (isinstance(target, list) and all(isinstance(t, str) for t in target))):
+        raise ValueError(f"{mtype} needs a 'to' id, list of ids or \"*\"")
+    return mtype, target, msg
+
+
+def splice_from(frame: str, from_field: str) -> str:
+    """Append a pre-encoded ``,"from":...`` member to a JSON object frame.
+
+    It goes last so it wins over any "from" the sender put in the body.
+    """
+    body = frame.rstrip()
+    if not body.endswith("}"):
+        raise ValueError("signaling frame is not an object")
+    return body[:-1] + from_field + "}"
+
+
 class WSClient:
-    def __init__(self, websocket: WebSocket, client_id: str, role: str):
+    """One signaling socket with its own writer task and bounded outbox.
+
+    ``send`` only enqueues, so a relay to a congested peer never stalls the
+    sender's receive loop.
+    """
+
+    def __init__(self, websocket: WebSocket, client_id: str, role: str, ice_batch: bool = False):
         self.websocket = websocket
         self.client_id = client_id
         self.role = role
+        self.from_field = ',"from":' + json.dumps(client_id)
+        self.ice_batch = ice_batch and WS_ICE_BATCH_WINDOW > 0  # Client understands "ice-batch" frames
+        self.ice_pending: Dict[str, List[str]] = {}  # sender -> relayed ice-candidate frames
+        self.ice_timer: Optional[asyncio.TimerHandle] = None
+        self.last_seen = time.monotonic()  # Any inbound frame, including pongs to the server's pings
+        self.outbox: deque = deque()  # (kind, text)
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.writer: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped_ice = 0
+        self.superseded = 0
+        self.batched_ice = 0
+        self.max_depth = 0
+
+    def start(self, session: "Session"):
+        self.writer = asyncio.create_task(self._write(session))
+
+    def stop(self):
+        self.closed = True
+        self.outbox.clear()
+        self.ice_pending.clear()
+        if self.ice_timer is not None:
+            self.ice_timer.cancel()
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+    def send(self, text: str, kind: str = FRAME_SIGNAL, sender: Optional[str] = None) -> bool:
+        """Queue a frame; False means the client overflowed and must be dropped.
+
+        Candidates relayed from ``sender`` are held for WS_ICE_BATCH_WINDOW and
+        go out together as one "ice-batch" frame. Any other frame from the same
+        sender flushes its held candidates first, so ordering is preserved.
+        """
+        if self.closed:
+            return True
+        if sender is not None and self.ice_batch:
+            if kind == FRAME_ICE:
+                pending = self.ice_pending.setdefault(sender, [])
+                pending.append(text)
+                if len(pending) >= WS_ICE_BATCH_MAX:
+                    self._flush_ice(sender)
+                elif self.ice_timer is None:
+                    self.ice_timer = asyncio.get_running_loop().call_later(WS_ICE_BATCH_WINDOW, self._flush_ice)
+                return True
+            if sender in self.ice_pending:
+                self._flush_ice(sender)
+        return self._enqueue(text, kind)
+
+    def _flush_ice(self, sender: Optional[str] = None):
+        if sender is None:
+            self.ice_timer = None
+            senders = list(self.ice_pending)
+        else:
+            senders = [sender]
+        for s in senders:
+            frames = self.ice_pending.pop(s, None)
+            if not frames:
+                continue
+            if len(frames) == 1:
+                self._enqueue(frames[0], FRAME_ICE)
+            else:
+                # Items are the relayed frames verbatim, so nothing is re-encoded
+                self.batched_ice += len(frames)
+                text = '{"type":"ice-batch","from":%s,"candidates":[%s]}' % (json.dumps(s), ",".join(frames))
+                self._enqueue(text, FRAME_ICE)
+
+    def _enqueue(self, text: str, kind: str) -> bool:
+        if kind == FRAME_SNAPSHOT and self.outbox:
+            kept = deque(f for f in self.outbox if f[0] not in (FRAME_MEMBERSHIP, FRAME_SNAPSHOT))
+            self.superseded += len(self.outbox) - len(kept)
+            self.outbox = kept
+        if len(self.outbox) >= WS_OUTBOX_FRAMES:
+            # Shed the oldest queued candidate; failing that, an incoming one
+            for i, (queued_kind, _) in enumerate(self.outbox):
+                if queued_kind == FRAME_ICE:
+                    del self.outbox[i]
+                    self.dropped_ice += 1
+                    break
+            else:
+                if kind != FRAME_ICE:
+                    return False
+                self.dropped_ice += 1
+                return True
+        self.outbox.append((kind, text))
+        self.max_depth = max(self.max_depth, len(self.outbox))
+        self.ready.set()
+        return True
+
+    async def _write(self, session: "Session"):
+        try:
+            while True:
+                while not self.outbox:
+                    self.ready.clear()
+                    await self.ready.wait()
+                _, text = self.outbox.popleft()
+                await asyncio.wait_for(self.websocket.send_text(text), WS_SEND_TIMEOUT)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.info("Dropping WebSocket client %s in session %s: %r", self.client_id, session.session_id, e)
+            await remove_client(session, self, close=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "role": self.role,
+            "depth": len(self.outbox),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped_ice": self.dropped_ice,
+            "superseded": self.superseded,
+            "batched_ice": self.batched_ice,
+        }
 
 
 class Session:
+    """The signaling sockets of one session that live in this process."""
+
     def __init__(self, session_id: str):
         self.session_id = session_id
         self.clients: Dict[str, WSClient] = {}
-        self.lock = asyncio.Lock()
 
-    def peers(self) -> List[str]:
-        return list(self.clients.keys())
+    def attach(self, client: WSClient) -> Optional[WSClient]:
+        replaced = self.clients.get(client.client_id)
+        self.clients[client.client_id] = client
+        return replaced
+
+    def detach(self, client: WSClient) -> bool:
+        if self.clients.get(client.client_id) is not client:
+            return False  # Already removed, or replaced by a newer connection
+        del self.clients[client.client_id]
+        if not self.clients and sessions.get(self.session_id) is self:
+            sessions.pop(self.session_id, None)
+        return True
+
+
+class Roster:
+    """Session membership as every peer sees it, across all workers."""
+
+    def __init__(self):
+        self.members: Dict[str, str] = {}  # client_id -> role
+        self.version = 0  # Bumped on every join/leave; lets clients drop stale deltas
+
+    def snapshot(self) -> str:
+        return json.dumps({"type": "peers", "peers": list(self.members), "version": self.version})
 
+    def join(self, client_id: str, role: str) -> tuple:
+        self.members[client_id] = role
+        return self._event("peer-joined", client_id, role)
 
-sessions: Dict[str, Session] = {}
+    def leave(self, client_id: str) -> Optional[tuple]:
+        role = self.members.pop(client_id, None)
+        if role is None:
+            return None
+        return self._event("peer-left", client_id, role)
+
+    def _event(self, kind: str, client_id: str, role: str) -> tuple:
+        """Serialize the one frame every member gets for a join/leave.
+
+        Most events go out as a small delta; every WS_SNAPSHOT_EVERY-th is a
+        full snapshot so clients that missed a delta (or applied two out of
+        order) converge again. Returns ``(frame_kind, text)``.
+        """
+        self.version += 1
+        if self.version % WS_SNAPSHOT_EVERY == 0:
+            return FRAME_SNAPSHOT, self.snapshot()
+        text = json.dumps({"type": kind, "peer": client_id, "role": role, "version": self.version})
+        return FRAME_MEMBERSHIP, text
+
+
+sessions: Dict[str, Session] = {}  # Local sockets only; membership lives on the bus
 
 
 def get_or_create_session(session_id: str) -> Session:
@@ -110,53 +384,503 @@ def get_or_create_session(session_id: str) -> Session:
     return sessions[session_id]
 
 
-async def broadcast_peers(session: Session):
-    payload = {"type": "peers", "peers": session.peers()}
-    for c in list(session.clients.values()):
+def send_to_client(session: Session, client: WSClient, text: str, kind: str = FRAME_SIGNAL,
+                   sender: Optional[str] = None) -> bool:
+    """Queue one frame for a client without waiting on its socket.
+
+    A client whose outbox overflows with frames that cannot be shed is a
+    persistently slow consumer: it is removed from the session and closed in
+    the background, and its departure is announced like any other leave.
+    """
+    if client.send(text, kind, sender):
+        return True
+    logging.info("Dropping WebSocket client %s in session %s: outbox full", client.client_id, session.session_id)
+    client.stop()
+    asyncio.create_task(remove_client(session, client, close=True))
+    return False
+
+
+def deliver_local(session_id: str, text: str, kind: str = FRAME_SIGNAL, to: Any = None,
+                  exclude: Optional[str] = None, sender: Optional[str] = None):
+    """Queue an already-serialized frame for local clients.
+
+    ``to`` is one client id, a list of them, or None for everyone but ``exclude``.
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        return
+    if to is None:
+        targets = [c for c in session.clients.values() if c.client_id != exclude]
+    else:
+        ids = [to] if isinstance(to, str) else to
+        targets = [session.clients[i] for i in ids if i in session.clients]
+    for c in targets:
+        send_to_client(session, c, text, kind, sender)
+
+
+def evict_local(session_id: str, client_id: str):
+    """Retire a local socket whose clientId reconnected elsewhere, without announcing a leave."""
+    session = sessions.get(session_id)
+    client = session.clients.get(client_id) if session else None
+    if client is not None and session.detach(client):
+        client.stop()
+        asyncio.create_task(_close_quietly(client.websocket))
+
+
+# -----------------------------
+# Session bus: membership and routing between workers
+# -----------------------------
+SIGNALING_BUS = os.environ.get("SIGNALING_BUS", "local")  # "local" or "broker"
+SIGNALING_BROKER = os.environ.get("SIGNALING_BROKER", "127.0.0.1:8790")
+SIGNALING_BROKER_CONNECT_ATTEMPTS = 20
+
+
+class LocalSessionBus:
+    """Everything in this process; the default for a single uvicorn worker."""
+
+    def __init__(self):
+        self.rosters: Dict[str, Roster] = {}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def join(self, session_id: str, client_id: str, role: str):
+        roster = self.rosters.setdefault(session_id, Roster())
+        kind, event = roster.join(client_id, role)
+        deliver_local(session_id, roster.snapshot(), FRAME_SNAPSHOT, to=client_id)
+        deliver_local(session_id, event, kind, exclude=client_id)
+
+    async def leave(self, session_id: str, client_id: str):
+        roster = self.rosters.get(session_id)
+        if roster is None:
+            return
+        event = roster.leave(client_id)
+        if not roster.members:
+            self.rosters.pop(session_id, None)
+        if event is not None:
+            deliver_local(session_id, event[1], event[0])
+
+    def relay(self, session_id: str, to: Any, text: str, kind: str = FRAME_SIGNAL, sender: Optional[str] = None):
+        """Deliver to one id, a list of ids, or (``to=None``) everyone but the sender."""
+        deliver_local(session_id, text, kind, to=to, exclude=sender, sender=sender)
+
+    async def reap(self) -> int:
+        """Drop roster members that no longer have a socket; returns how many."""
+        stale = 0
+        for sid, roster in list(self.rosters.items()):
+            session = sessions.get(sid)
+            for cid in [c for c in roster.members if session is None or c not in session.clients]:
+                stale += 1
+                await self.leave(sid, cid)
+        return stale
+
+
+class SignalingBroker:
+    """Owns every session's roster and routes frames between worker processes.
+
+    Workers speak newline-delimited JSON over a local TCP socket. Broadcasts
+    are written once per worker that has members in the session, and each
+    worker fans out to its own sockets.
+    """
+
+    def __init__(self):
+        self.rosters: Dict[str, Roster] = {}
+        self.owners: Dict[str, Dict[str, asyncio.StreamWriter]] = {}  # session -> client -> worker
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.links: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    async def start(self, host: str, port: int):
+        self.server = await asyncio.start_server(self._serve, host, port)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.links):
+            writer.close()
+        if self.links:
+            await asyncio.wait(list(self.links.values()), timeout=1.0)
+
+    @staticmethod
+    def _line(op: Dict[str, Any]) -> bytes:
+        return json.dumps(op).encode() + b"\n"
+
+    def _broadcast(self, session_id: str, kind: str, text: str, exclude: Optional[str] = None):
+        line = self._line({"op": "deliver", "s": session_id, "kind": kind, "text": text, "exclude": exclude})
+        for worker in set(self.owners.get(session_id, {}).values()):
+            worker.write(line)
+
+    def _leave(self, session_id: str, client_id: str, worker: asyncio.StreamWriter):
+        owners = self.owners.get(session_id, {})
+        if owners.get(client_id) is not worker:
+            return
+        del owners[client_id]
+        roster = self.rosters[session_id]
+        event = roster.leave(client_id)
+        if not roster.members:
+            self.rosters.pop(session_id, None)
+            self.owners.pop(session_id, None)
+        elif event is not None:
+            self._broadcast(session_id, *event)
+
+    def _handle(self, op: Dict[str, Any], worker: asyncio.StreamWriter):
+        sid = op["s"]
+        if op["op"] == "join":
+            cid = op["c"]
+            owners = self.owners.setdefault(sid, {})
+            previous = owners.get(cid)
+            if previous is not None and previous is not worker:
+                previous.write(self._line({"op": "evict", "s": sid, "c": cid}))
+            owners[cid] = worker
+            roster = self.rosters.setdefault(sid, Roster())
+            kind, event = roster.join(cid, op.get("role", "unknown"))
+            worker.write(self._line({"op": "deliver", "s": sid, "to": cid,
+                                     "kind": FRAME_SNAPSHOT, "text": roster.snapshot()}))
+            self._broadcast(sid, kind, event, exclude=cid)
+        elif op["op"] == "leave":
+            self._leave(sid, op["c"], worker)
+        elif op["op"] == "relay":
+            owners = self.owners.get(sid, {})
+            sender, kind = op.get("from"), op.get("kind", FRAME_SIGNAL)
+            if op.get("to") is None:
+                # Room-wide; the origin worker has already delivered to its own clients
+                line = self._line({"op": "deliver", "s": sid, "kind": kind, "text": op["text"],
+                                   "exclude": sender, "from": sender})
+                for target in set(owners.values()):
+                    if target is not worker:
+                        target.write(line)
+                return
+            by_worker: Dict[asyncio.StreamWriter, List[str]] = {}
+            for cid in op["to"]:
+                target = owners.get(cid)
+                if target is not None:
+                    by_worker.setdefault(target, []).append(cid)
+            for target, ids in by_worker.items():
+                target.write(self._line({"op": "deliver", "s": sid, "to": ids, "kind": kind,
+                                         "text": op["text"], "from": sender}))
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.links[writer] = asyncio.current_task()
         try:
-            await c.websocket.send_text(json.dumps(payload))
-        except Exception:
+            async for line in reader:
+                try:
+                    self._handle(json.loads(line), writer)
+                except (ValueError, KeyError) as e:
+                    logging.warning("Signaling broker: bad message %r: %s", line[:200], e)
+        except (ConnectionError, asyncio.IncompleteReadError):
             pass
+        finally:
+            # The worker went away; its clients leave every session they were in
+            for sid, owners in list(self.owners.items()):
+                for cid in [c for c, w in owners.items() if w is writer]:
+                    self._leave(sid, cid, writer)
+            self.links.pop(writer, None)
+            writer.close()
+
+
+class BrokerSessionBus:
+    """Membership and cross-worker relays via a SignalingBroker.
+
+    The first worker to find no broker listening hosts one itself; the others
+    connect to it. Relays to a client on this worker skip the broker. If the
+    broker link drops, local sockets are closed so their clients rejoin
+    against a fresh roster.
+    """
+
+    def __init__(self, address: str = SIGNALING_BROKER):
+        host, _, port = address.rpartition(":")
+        self.host, self.port = host or "127.0.0.1", int(port)
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.hosted: Optional[SignalingBroker] = None
+        self.reader_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        reader = await self._connect()
+        self.reader_task = asyncio.create_task(self._read(reader))
+
+    async def close(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+        if self.hosted is not None:
+            await self.hosted.close()
+
+    async def _connect(self) -> asyncio.StreamReader:
+        for attempt in range(SIGNALING_BROKER_CONNECT_ATTEMPTS):
+            try:
+                reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                return reader
+            except OSError:
+                pass
+            if self.hosted is None:
+                broker = SignalingBroker()
+                try:
+                    await broker.start(self.host, self.port)
+                    self.hosted = broker
+                    logging.info("Hosting signaling broker on %s:%s", self.host, self.port)
+                    continue
+                except OSError:
+                    pass  # Another worker won the race; connect to it
+            await asyncio.sleep(min(0.05 * 2 ** attempt, 2.0))
+        raise ConnectionError(f"Signaling broker at {self.host}:{self.port} is unreachable")
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                async for line in reader:
+                    op = json.loads(line)
+                    if op["op"] == "deliver":
+                        deliver_local(op["s"], op["text"], op.get("kind", FRAME_SIGNAL), to=op.get("to"),
+                                      exclude=op.get("exclude"), sender=op.get("from"))
+                    elif op["op"] == "evict":
+                        evict_local(op["s"], op["c"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Signaling broker link failed: %s", e)
+            self.writer = None
+            for session in list(sessions.values()):
+                for client in list(session.clients.values()):
+                    evict_local(session.session_id, client.client_id)
+            try:
+                reader = await self._connect()
+            except ConnectionError as e:
+                logging.error("%s", e)
+                await asyncio.sleep(2.0)
+
+    def _send(self, op: Dict[str, Any]):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(json.dumps(op).encode() + b"\n")
+
+    async def join(self, session_id: str, client_id: str, role: str):
+        self._send({"op": "join", "s": session_id, "c": client_id, "role": role})
+
+    async def leave(self, session_id: str, client_id: str):
+        self._send({"op": "leave", "s": session_id, "c": client_id})
+
+    def relay(self, session_id: str, to: Any, text: str, kind: str = FRAME_SIGNAL, sender: Optional[str] = None):
+        session = sessions.get(session_id)
+        local = session.clients if session is not None else {}
+        if to is None:
+            deliver_local(session_id, text, kind, exclude=sender, sender=sender)
+            self._send({"op": "relay", "s": session_id, "to": None, "kind": kind, "text": text, "from": sender})
+            return
+        ids = [to] if isinstance(to, str) else to
+        here = [i for i in ids if i in local]
+        if here:
+            deliver_local(session_id, text, kind, to=here, sender=sender)
+        if len(here) < len(ids):
+            remote = [i for i in ids if i not in local]
+            self._send({"op": "relay", "s": session_id, "to": remote, "kind": kind, "text": text, "from": sender})
+
+    async def reap(self) -> int:
+        return 0  # The broker drops a worker's members itself when that worker's link closes
+
+
+def make_session_bus(name: str = SIGNALING_BUS):
+    if name == "broker":
+        return BrokerSessionBus()
+    if name != "local":
+        logging.warning("Unknown SIGNALING_BUS %r, using the in-process bus", name)
+    return LocalSessionBus()
+
+
+session_bus = make_session_bus()
+
+
+@app.on_event("startup")
+async def _start_session_bus():
+    await session_bus.start()
+
+
+@app.on_event("shutdown")
+async def _stop_session_bus():
+    await session_bus.close()
+
+
+async def add_client(session: Session, client: WSClient):
+    replaced = session.attach(client)
+    client.start(session)
+    if replaced is not None:
+        # Same clientId reconnected before the old socket noticed; retire the old one quietly
+        replaced.stop()
+        asyncio.create_task(_close_quietly(replaced.websocket))
+    await session_bus.join(session.session_id, client.client_id, client.role)
+
+
+async def remove_client(session: Session, client: WSClient, close: bool = False):
+    client.stop()
+    if session.detach(client):
+        await session_bus.leave(session.session_id, client.client_id)
+    if close:
+        await _close_quietly(client.websocket)
+
+
+async def _close_quietly(websocket: WebSocket, code: int = 1001):
+    try:
+        await asyncio.wait_for(websocket.close(code=code), WS_SEND_TIMEOUT)
+    except Exception:
+        pass
+
+
+ws_reaped = {
+    "dead_clients": 0,
+    "join_timeouts": 0,
+    "empty_sessions": 0,
+    "stale_members": 0,
+    "rejected_sessions": 0,
+    "rejected_peers": 0,
+    "rejected_relays": 0,
+    "unpaired_relays": 0,
+}
+
+
+async def reap_signaling(ping: str):
+    """Evict silent clients, ping the rest, and drop sessions nobody is in."""
+    deadline = time.monotonic() - WS_LIVENESS_TIMEOUT
+    for session in list(sessions.values()):
+        if not session.clients:
+            if sessions.get(session.session_id) is session:
+                sessions.pop(session.session_id, None)
+                ws_reaped["empty_sessions"] += 1
+            continue
+        for client in list(session.clients.values()):
+            if client.last_seen < deadline:
+                logging.info("Evicting silent WebSocket client %s in session %s", client.client_id, session.session_id)
+                ws_reaped["dead_clients"] += 1
+                asyncio.create_task(remove_client(session, client, close=True))
+            else:
+                send_to_client(session, client, ping)
+    ws_reaped["stale_members"] += await session_bus.reap()
+
+
+async def _ws_reaper():
+    ping = json.dumps({"type": "ping"})
+    while True:
+        await asyncio.sleep(WS_PING_INTERVAL)
+        try:
+            await reap_signaling(ping)
+        except Exception as e:
+            logging.warning(f"Signaling reaper failed: {e}")
+
+
+@app.on_event("startup")
+async def _start_ws_reaper():
+    app.state.ws_reaper = asyncio.create_task(_ws_reaper())
+
+
+@app.on_event("shutdown")
+async def _stop_ws_reaper():
+    reaper = getattr(app.state, "ws_reaper", None)
+    if reaper:
+        reaper.cancel()
+
+
+def admission_error(session_id: str, client_id: str) -> Optional[str]:
+    """Why a join would exceed WS_MAX_SESSIONS / WS_MAX_PEERS, or None."""
+    session = sessions.get(session_id)
+    if session is None:
+        if len(sessions) >= WS_MAX_SESSIONS:
+            ws_reaped["rejected_sessions"] += 1
+            return "too many sessions"
+    elif client_id not in session.clients and len(session.clients) >= WS_MAX_PEERS:
+        ws_reaped["rejected_peers"] += 1
+        return "session is full"
+    return None
+
+
+@api_router.get("/ws/liveness")
+async def get_ws_liveness():
+    """Live signaling state, its limits, and how much the reaper has cleaned up"""
+    return {
+        "sessions": len(sessions),
+        "clients": sum(len(s.clients) for s in list(sessions.values())),
+        "limits": {
+            "max_sessions": WS_MAX_SESSIONS,
+            "max_peers": WS_MAX_PEERS,
+            "max_relays_per_session": WS_RELAY_MAX_PER_SESSION,
+            "max_relays_per_ip": WS_RELAY_MAX_PER_IP,
+            "join_timeout": WS_JOIN_TIMEOUT,
+            "ping_interval": WS_PING_INTERVAL,
+            "liveness_timeout": WS_LIVENESS_TIMEOUT,
+        },
+        "reaped": dict(ws_reaped),
+    }
+
+
+@api_router.get("/ws/stats")
+async def get_ws_stats():
+    """Outbound queue depth and shed frames per signaling client on this worker"""
+    return {
+        sid: {cid: c.stats() for cid, c in s.clients.items()}
+        for sid, s in list(sessions.items())
+    }
 
 
 @api_router.websocket("/ws/session/{session_id}")
 async def ws_session(websocket: WebSocket, session_id: str):
     await websocket.accept()
-    client_id: Optional[str] = None
-    role = "unknown"
-    session = get_or_create_session(session_id)
+    client: Optional[WSClient] = None
+    session: Optional[Session] = None
     try:
         # Expect a join message
-        join_raw = await websocket.receive_text()
+        try:
+            join_raw = await asyncio.wait_for(websocket.receive_text(), WS_JOIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            ws_reaped["join_timeouts"] += 1
+            await websocket.close(code=1008)
+            return
         join = json.loads(join_raw)
         if join.get("type") != "join":
             await websocket.close(code=1002)
             return
         client_id = join.get("clientId") or str(uuid.uuid4())
-        role = join.get("role", "unknown")
-        async with session.lock:
-            session.clients[client_id] = WSClient(websocket, client_id, role)
-        await broadcast_peers(session)
+        refused = admission_error(session_id, client_id)
+        if refused:
+            await websocket.send_text(json.dumps({"type": "error", "error": refused}))
+            await websocket.close(code=1013)
+            return
+        features = join.get("features")
+        ice_batch = isinstance(features, list) and "ice-batch" in features
+        client = WSClient(websocket, client_id, join.get("role", "unknown"), ice_batch=ice_batch)
+        session = get_or_create_session(session_id)
+        await add_client(session, client)
 
         while True:
             data = await websocket.receive_text()
-            msg = json.loads(data)
-            mtype = msg.get("type")
+            client.last_seen = time.monotonic()
+            try:
+                mtype, target, _ = read_envelope(data, WS_VALIDATE_ENVELOPE)
+            except ValueError as e:
+                if not WS_VALIDATE_ENVELOPE:
+                    raise
+                logging.info("Ignoring frame from %s: %s", client_id, e)
+                continue
 
-            if mtype in ("sdp-offer", "sdp-answer", "ice-candidate", "text"):
-                target = msg.get("to")
-                if not target:
+            if mtype in RELAYED_TYPES:
+                # "to" is one id, a list of ids, or "*" for everyone else in the session
+                if target == "*":
+                    target = None
+                elif isinstance(target, list):
+                    target = [t for t in dict.fromkeys(target) if isinstance(t, str) and t != client_id]
+                    if not target:
+                        continue
+                elif not target or not isinstance(target, str):
                     continue
-                target_client = session.clients.get(target)
-                if target_client:
-                    try:
-                        await target_client.websocket.send_text(json.dumps({**msg, "from": client_id}))
-                    except Exception:
-                        pass
+                kind = FRAME_ICE if mtype == "ice-candidate" else FRAME_SIGNAL
+                session_bus.relay(session_id, target, splice_from(data, client.from_field), kind, sender=client_id)
+            elif mtype == "relay-request":
+                # The data channel failed; give both ends of the pair a relay token
+                if isinstance(target, str) and target:
+                    offer_relay(session, client, target)
             elif mtype == "leave":
                 break
             elif mtype == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
+                send_to_client(session, client, json.dumps({"type": "pong"}))
             else:
                 # ignore
                 pass
@@ -165,15 +889,327 @@ async def ws_session(websocket: WebSocket, session_id: str):
     except Exception as e:
         logging.exception("WebSocket error: %s", e)
     finally:
-        if client_id:
-            async with session.lock:
-                session.clients.pop(client_id, None)
-            if len(session.clients) == 0:
-                sessions.pop(session.session_id, None)
+        if session is not None:
+            await remove_client(session, client)
+
+
+# -----------------------------
+# Binary WebSocket relay: server-side fallback when the data channel fails
+# -----------------------------
+WS_RELAY_WINDOW = int(os.environ.get("WS_RELAY_WINDOW", 16))  # Frames of credit per direction
+WS_RELAY_MAX_FRAME = int(os.environ.get("WS_RELAY_MAX_FRAME", 256 * 1024))
+WS_RELAY_PAIR_TIMEOUT = float(os.environ.get("WS_RELAY_PAIR_TIMEOUT", 30))  # An unpaired end is closed after this
+WS_RELAY_TOKEN_TTL = 120
+WS_RELAY_MAX_PER_SESSION = int(os.environ.get("WS_RELAY_MAX_PER_SESSION", 32))  # Open and pending
+WS_RELAY_MAX_PER_IP = int(os.environ.get("WS_RELAY_MAX_PER_IP", 8))
+# Signs relay tokens; set it to the same value on every worker that issues them
+RELAY_SECRET = os.environ.get("RELAY_SECRET", "").encode() or secrets.token_bytes(32)
+RELAY_CONTROL_PREFIX = "RELAY:"  # Text frames from the server; peers' own text frames are forwarded as-is
+
+
+def relay_control(msg: Dict[str, Any]) -> str:
+    return RELAY_CONTROL_PREFIX + json.dumps(msg)
+
+
+def relay_pair_id(a: str, b: str) -> str:
+    return "~".join(sorted((a, b)))
+
+
+def relay_token(session_id: str, a: str, b: str, expires: Optional[int] = None) -> str:
+    """Token that lets exactly the pair (a, b) of this session open their relay."""
+    expires = int(expires or time.time() + WS_RELAY_TOKEN_TTL)
+    signed = json.dumps([session_id, sorted((a, b)), expires]).encode()
+    return f"{expires}.{hmac.new(RELAY_SECRET, signed, hashlib.sha256).hexdigest()}"
+
+
+def check_relay_token(session_id: str, a: str, b: str, token: str) -> bool:
+    expires, _, _ = token.partition(".")
+    try:
+        expires_at = int(expires)
+    except ValueError:
+        return False
+    return expires_at >= time.time() and hmac.compare_digest(token, relay_token(session_id, a, b, expires_at))
+
+
+def offer_relay(session: Session, client: WSClient, peer: str):
+    """Hand both ends of a pair the token for /ws/relay, over signaling only."""
+    if peer == client.client_id or peer not in session.clients:
+        return  # Relays pair within one worker, so the peer has to be connected here
+    relay_id = relay_pair_id(client.client_id, peer)
+    token = relay_token(session.session_id, client.client_id, peer)
+    send_to_client(session, client, json.dumps({"type": "relay-offer", "peer": peer, "relay": relay_id, "token": token}))
+    offer = json.dumps({"type": "relay-offer", "peer": client.client_id, "relay": relay_id, "token": token})
+    session_bus.relay(session.session_id, peer, offer, sender=client.client_id)
+
+
+class RelayPipe:
+    """One direction of a relay: frames from ``src`` buffered on their way to ``dst``.
+
+    The sender may only have as many frames in flight as it holds credit for.
+    Each frame delivered to ``dst`` earns one credit back, returned in batches
+    of half the window, so the buffer never grows past WS_RELAY_WINDOW frames
+    and a slow receiver throttles the sender instead of the server's memory.
+    """
+
+    def __init__(self, src: WebSocket, dst: WebSocket, src_lock: asyncio.Lock, dst_lock: asyncio.Lock):
+        self.src = src
+        self.dst = dst
+        self.src_lock = src_lock  # Each socket is written by both pipes: data one way, credit the other
+        self.dst_lock = dst_lock
+        self.frames: deque = deque()  # bytes or str, in order
+        self.ready = asyncio.Event()
+        self.credit = WS_RELAY_WINDOW  # What src may still send
+        self.owed = 0  # Credit earned but not yet returned to src
+        self.buffered = 0
+        self.peak_buffered = 0
+        self.bytes = 0
+        self.frames_sent = 0
+        self.started = time.monotonic()
+        self.last_sample = (self.started, 0)
+        self.rate = 0.0
+
+    def push(self, data) -> Optional[str]:
+        """Buffer one frame from src; returns a protocol error instead, if any."""
+        if self.credit <= 0:
+            return "sent without credit"
+        size = len(data)
+        if size > WS_RELAY_MAX_FRAME:
+            return f"frame of {size} bytes exceeds {WS_RELAY_MAX_FRAME}"
+        self.credit -= 1
+        self.frames.append(data)
+        self.buffered += size
+        self.peak_buffered = max(self.peak_buffered, self.buffered)
+        self.ready.set()
+        return None
+
+    async def pump(self):
+        while True:
+            while not self.frames:
+                self.ready.clear()
+                await self.ready.wait()
+            data = self.frames.popleft()
+            async with self.dst_lock:
+                if isinstance(data, bytes):
+                    await asyncio.wait_for(self.dst.send_bytes(data), WS_LIVENESS_TIMEOUT)
+                else:
+                    await asyncio.wait_for(self.dst.send_text(data), WS_LIVENESS_TIMEOUT)
+            self.buffered -= len(data)
+            self.bytes += len(data)
+            self.frames_sent += 1
+            self.owed += 1
+            if self.owed >= max(1, WS_RELAY_WINDOW // 2) or not self.frames:
+                self.credit += self.owed
+                grant = relay_control({"type": "credit", "n": self.owed})
+                self.owed = 0
+                async with self.src_lock:
+                    await self.src.send_text(grant)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        then, sent = self.last_sample
+        if now - then >= 1.0:
+            self.rate = (self.bytes - sent) / (now - then)
+            self.last_sample = (now, self.bytes)
+        elapsed = now - self.started
+        return {
+            "bytes": self.bytes,
+            "frames": self.frames_sent,
+            "throughput": round(self.bytes / elapsed) if elapsed > 0 else 0,
+            "rate": round(self.rate),
+            "buffered_bytes": self.buffered,
+            "buffered_frames": len(self.frames),
+            "peak_buffered_bytes": self.peak_buffered,
+        }
+
+
+class Relay:
+    """The two members of a pair, each on its own socket, piped to each other."""
+
+    def __init__(self, session_id: str, relay_id: str, client_id: str, peer: str):
+        self.session_id = session_id
+        self.relay_id = relay_id
+        self.pair_ids = frozenset((client_id, peer))
+        self.reserved: set = set()  # Members admitted to an end, attached or still being accepted
+        self.ends: List[WebSocket] = []
+        self.members: set = set()  # Members whose socket is attached
+        self.paired = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.pipes: Dict[int, RelayPipe] = {}  # keyed by id() of the sending socket
+        self.locks: Dict[int, asyncio.Lock] = {}
+        self.pumps: List[asyncio.Task] = []
+        self.created = time.monotonic()
+
+    def reserve(self, client_id: str) -> bool:
+        """Claim `client_id`'s end; False if it is not in the pair or already claimed."""
+        if client_id not in self.pair_ids or client_id in self.reserved:
+            return False
+        self.reserved.add(client_id)
+        return True
+
+    def attach(self, websocket: WebSocket, client_id: str):
+        """Plug an accepted socket into its reserved end; the second one starts the pumps."""
+        if client_id not in self.reserved or client_id in self.members or len(self.ends) >= 2:
+            raise ValueError(f"{client_id!r} may not take an end of relay {self.relay_id}")
+        self.ends.append(websocket)
+        self.members.add(client_id)
+        self.locks[id(websocket)] = asyncio.Lock()
+        if len(self.ends) < 2:
+            return
+        first, second = self.ends
+        a, b = self.locks[id(first)], self.locks[id(second)]
+        self.pipes[id(first)] = RelayPipe(first, second, a, b)
+        self.pipes[id(second)] = RelayPipe(second, first, b, a)
+        self.pumps = [asyncio.create_task(self._pump(p)) for p in self.pipes.values()]
+        self.paired.set()
+
+    async def _pump(self, pipe: RelayPipe):
         try:
-            await broadcast_peers(session)
-        except Exception:
-            pass
+            await pipe.pump()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.info("Relay %s/%s stopped: %r", self.session_id, self.relay_id, e)
+            self.closed.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "session": self.session_id,
+            "relay": self.relay_id,
+            "paired": self.paired.is_set(),
+            "age": round(time.monotonic() - self.created, 1),
+            "directions": [p.stats() for p in self.pipes.values()],
+        }
+
+
+relays: Dict[tuple, Relay] = {}
+relay_ips: Dict[str, int] = {}  # Open relay sockets per client address
+
+
+def relay_admission_error(session_id: str, relay_id: str, client_id: str, peer: str, token: str,
+                          ip: str) -> Optional[str]:
+    """Why this socket may not take an end of the relay, or None."""
+    if not check_relay_token(session_id, client_id, peer, token):
+        return "bad or expired token"
+    if relay_id != relay_pair_id(client_id, peer):
+        return "relay id does not belong to this pair"
+    session = sessions.get(session_id)
+    if session is None or client_id not in session.clients or peer not in session.clients:
+        return "both ends must be current members of the session"
+    relay = relays.get((session_id, relay_id))
+    if relay is not None:
+        if relay.pair_ids != {client_id, peer} or client_id in relay.reserved:
+            return "this end of the relay is taken"
+    elif sum(1 for r in list(relays.values()) if r.session_id == session_id) >= WS_RELAY_MAX_PER_SESSION:
+        return "too many relays in this session"
+    if relay_ips.get(ip, 0) >= WS_RELAY_MAX_PER_IP:
+        return "too many relays from this address"
+    return None
+
+
+async def _relay_frames(websocket: WebSocket, relay: Relay):
+    """Feed one end's frames into its pipe until it disconnects or misbehaves."""
+    pipe = relay.pipes[id(websocket)]
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        data = message.get("bytes")
+        if data is None:
+            data = message.get("text") or ""
+            if data.startswith(RELAY_CONTROL_PREFIX):
+                continue  # Nothing for clients to ask the relay yet
+        error = pipe.push(data)
+        if error:
+            logging.info("Closing relay %s/%s: %s", relay.session_id, relay.relay_id, error)
+            await _close_quietly(websocket, code=1009 if "exceeds" in error else 1008)
+            return
+
+
+@api_router.get("/ws/relays")
+async def get_ws_relays():
+    """Throughput and buffer occupancy per direction of every active relay"""
+    return [r.stats() for r in list(relays.values())]
+
+
+@api_router.websocket("/ws/relay/{session_id}/{relay_id}")
+async def ws_relay(websocket: WebSocket, session_id: str, relay_id: str,
+                   client: str = "", peer: str = "", token: str = ""):
+    """Binary fallback path: frames from one end are forwarded verbatim to the other.
+
+    A member asks for a relay with a "relay-request" signaling message; both
+    members of the pair then get a "relay-offer" with the relay id and a token,
+    and connect here with ``?client=<own id>&peer=<other id>&token=...``. Only
+    those two current members can take the two ends. Once the second arrives
+    each end gets ``RELAY:{"type":"ready","credit":N}`` and may send N frames;
+    every ``RELAY:{"type":"credit","n":k}`` allows k more. When either end
+    leaves, the other is told ``RELAY:{"type":"peer-closed"}`` and closed.
+    Relays are paired within one worker, so multi-worker deployments need
+    sessions routed stickily.
+    """
+    ip = websocket.client.host if websocket.client else ""
+    refused = relay_admission_error(session_id, relay_id, client, peer, token, ip)
+    if refused:
+        logging.info("Refusing relay %s/%s for %r: %s", session_id, relay_id, client, refused)
+        ws_reaped["rejected_relays"] += 1
+        await websocket.close(code=1008)
+        return
+    # Claim the end and the address slot before the first await, so two sockets
+    # racing with one token cannot both get past the check above
+    key = (session_id, relay_id)
+    relay = relays.get(key)
+    if relay is None:
+        relay = relays[key] = Relay(session_id, relay_id, client, peer)
+    relay.reserve(client)
+    relay_ips[ip] = relay_ips.get(ip, 0) + 1
+    try:
+        await websocket.accept()
+        relay.attach(websocket, client)
+        if not relay.paired.is_set():
+            # Watch for the socket going away while we wait for the other end
+            waiting = asyncio.create_task(relay.paired.wait())
+            early = asyncio.create_task(websocket.receive())
+            done, _ = await asyncio.wait({waiting, early}, timeout=WS_RELAY_PAIR_TIMEOUT,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            waiting.cancel()
+            if waiting not in done:
+                early.cancel()
+                if early not in done:
+                    ws_reaped["unpaired_relays"] += 1
+                    await _close_quietly(websocket, code=1013)
+                return
+            if early in done:
+                return  # Sent or closed before the relay was ready
+            early.cancel()
+        async with relay.locks[id(websocket)]:
+            await websocket.send_text(relay_control({"type": "ready", "credit": WS_RELAY_WINDOW}))
+        feeding = asyncio.create_task(_relay_frames(websocket, relay))
+        stopped = asyncio.create_task(relay.closed.wait())
+        try:
+            await asyncio.wait({feeding, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            feeding.cancel()
+            stopped.cancel()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logging.exception("Relay error: %s", e)
+    finally:
+        relay.closed.set()
+        if relay_ips.get(ip, 0) <= 1:
+            relay_ips.pop(ip, None)
+        else:
+            relay_ips[ip] -= 1
+        if relays.get(key) is relay:
+            relays.pop(key, None)
+            for task in relay.pumps:
+                task.cancel()
+            for other in relay.ends:
+                if other is not websocket:
+                    try:
+                        await asyncio.wait_for(other.send_text(relay_control({"type": "peer-closed"})), WS_SEND_TIMEOUT)
+                    except Exception:
+                        pass
+                    await _close_quietly(other)
 
 
 # -----------------------------
@@ -185,135 +1221,3008 @@ class FTPConfig(BaseModel):
     user: str
     password: str
     passive: bool = True
-    max_connections: int = 3  # Default to 3 parallel connections
     cwd: str = "/"
-    max_connections: int = 3  # Maximum number of parallel connections
+    max_connections: int = Field(3, ge=1, le=32)  # Parallel connections for large uploads, up to a job's pool share
+    auto_tune: bool = False  # Adapt connections and piece size to measured throughput (max_connections is then ignored)
+    verify: bool = False  # Hash uploads while sending (no sendfile) and check them with the server's HASH/XCRC/XMD5
+    tls: bool = False  # Explicit FTPS: AUTH TLS on the control connection, PROT P for data connections
+    tls_verify: bool = True  # Check the server certificate; turn off for self-signed LAN servers
 
 
 class FTPPath(BaseModel):
     config: FTPConfig
     path: str = "."
+    refresh: bool = False  # Bypass the listing cache
+
+
+FTP_SPEED_WINDOW = 5.0  # Seconds of samples behind "current speed"
+FTP_SPEED_SAMPLE_INTERVAL = 0.1
+FTP_STALL_SECONDS = float(os.environ.get("FTP_STALL_SECONDS", 15))
+FTP_TRANSFER_HISTORY = int(os.environ.get("FTP_TRANSFER_HISTORY", 500))
+FTP_TRANSFER_HISTORY_TTL = float(os.environ.get("FTP_TRANSFER_HISTORY_TTL", 3600))
+FTP_HOST_STATS_SAMPLES = 200
 
 
 class TransferProgress:
-    def __init__(self, file_size: int, transfer_id: str):
+    """Progress of one transfer, with a short window of samples for current speed and stalls."""
+    __slots__ = ("transfer_id", "host", "file_size", "bytes_transferred", "start_bytes", "start_time",
+                 "finished_at", "last_progress", "status", "error", "verification", "_window")
+
+    def __init__(self, file_size: int, transfer_id: str, host: Optional[str] = None, offset: int = 0):
+        self.transfer_id = transfer_id
+        self.host = host
         self.file_size = file_size
-        self.bytes_transferred = 0
+        self.bytes_transferred = offset
+        self.start_bytes = offset
         self.start_time = time.time()
-        self.transfer_id = transfer_id
+        self.finished_at: Optional[float] = None
+        self.last_progress = time.monotonic()
         self.status = "in_progress"
         self.error = None
-        
+        self.verification: Optional[Dict[str, Any]] = None
+        self._window: deque = deque([(self.last_progress, offset)], maxlen=int(FTP_SPEED_WINDOW / FTP_SPEED_SAMPLE_INTERVAL) + 2)
+
+    def start(self):
+        """A queued transfer begins; speed is measured from here."""
+        self.status = "in_progress"
+        self.start_time = time.time()
+        self.start_bytes = self.bytes_transferred
+        self.last_progress = time.monotonic()
+
     def update(self, bytes_count: int):
         self.bytes_transferred += bytes_count
-        
+        now = time.monotonic()
+        if bytes_count > 0:
+            self.last_progress = now
+        window = self._window
+        if now - window[-1][0] >= FTP_SPEED_SAMPLE_INTERVAL:
+            window.append((now, self.bytes_transferred))
+        else:
+            window[-1] = (window[-1][0], self.bytes_transferred)
+
     def complete(self):
         self.status = "completed"
-        
+        self.finished_at = time.time()
+
     def fail(self, error: str):
         self.status = "failed"
         self.error = error
-        
-    def get_progress(self) -> Dict[str, Any]:
-        elapsed = time.time() - self.start_time
-        percent = (self.bytes_transferred / self.file_size * 100) if self.file_size > 0 else 0
-        speed = self.bytes_transferred / elapsed if elapsed > 0 else 0
-        
-        return {
-            "transfer_id": self.transfer_id,
-            "status": self.status,
-            "bytes_transferred": self.bytes_transferred,
-            "file_size": self.file_size,
-            "percent_complete": round(percent, 2),
-            "speed_bytes_per_sec": round(speed, 2),
-            "elapsed_seconds": round(elapsed, 2),
-            "error": self.error
-        }
+        self.finished_at = time.time()
 
+    def cancel(self, error: str):
+        self.status = "cancelled"
+        self.error = error
+        self.finished_at = time.time()
 
-# Global transfer progress tracker
-active_transfers: Dict[str, TransferProgress] = {}
+    def current_speed(self) -> float:
+        """Bytes/s over the last FTP_SPEED_WINDOW seconds (0 once nothing has moved for that long)."""
+        now = time.monotonic()
+        window = self._window
+        while len(window) > 1 and now - window[1][0] >= FTP_SPEED_WINDOW:
+            window.popleft()
+        t0, b0 = window[0]
+        return max(0.0, (self.bytes_transferred - b0) / (now - t0)) if now > t0 else 0.0
 
+    def stalled(self) -> bool:
+        return self.status == "in_progress" and time.monotonic() - self.last_progress > FTP_STALL_SECONDS
+
+    def average_speed(self) -> float:
+        elapsed = (self.finished_at or time.time()) - self.start_time
+        return max(0, self.bytes_transferred - self.start_bytes) / elapsed if elapsed > 0 else 0.0
 
-class TransferProgress:
-    def __init__(self, file_size: int, transfer_id: str):
-        self.file_size = file_size
-        self.bytes_transferred = 0
-        self.start_time = time.time()
-        self.transfer_id = transfer_id
-        self.status = "in_progress"
-        self.error = None
-        
-    def update(self, bytes_count: int):
-        self.bytes_transferred += bytes_count
-        
-    def complete(self):
-        self.status = "completed"
-        
-    def fail(self, error: str):
-        self.status = "failed"
-        self.error = error
-        
     def get_progress(self) -> Dict[str, Any]:
-        elapsed = time.time() - self.start_time
+        elapsed = (self.finished_at or time.time()) - self.start_time
         percent = (self.bytes_transferred / self.file_size * 100) if self.file_size > 0 else 0
-        speed = self.bytes_transferred / elapsed if elapsed > 0 else 0
-        
+
         return {
             "transfer_id": self.transfer_id,
             "status": self.status,
             "bytes_transferred": self.bytes_transferred,
             "file_size": self.file_size,
             "percent_complete": round(percent, 2),
-            "speed_bytes_per_sec": round(speed, 2),
+            "speed_bytes_per_sec": round(self.average_speed(), 2),
+            "current_speed_bytes_per_sec": round(self.current_speed(), 2) if self.finished_at is None else 0.0,
+            "stalled": self.stalled(),
             "elapsed_seconds": round(elapsed, 2),
-            "error": self.error
+            "error": self.error,
+            "verification": self.verification,
         }
 
 
-# Global transfer progress tracker
-active_transfers: Dict[str, TransferProgress] = {}
+def _percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    return values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
 
 
-def connect_ftp(cfg: FTPConfig) -> FTP:
-    try:
-        ftp = FTP()
-        ftp.connect(cfg.host, cfg.port, timeout=10)
-        ftp.login(cfg.user, cfg.password)
-        ftp.set_pasv(cfg.passive)
+class TransferRegistry:
+    """Live transfers, plus a bounded history of finished ones that expires after `ttl`.
+
+    Finished transfers are moved to the history lazily, on the next access.
+    Completed ones also leave their average throughput in a small per-host
+    sample ring for /ftp/transfer-stats.
+    """
+
+    def __init__(self, history: int = FTP_TRANSFER_HISTORY, ttl: float = FTP_TRANSFER_HISTORY_TTL):
+        self.history_size = history
+        self.ttl = ttl
+        self._live: Dict[str, TransferProgress] = {}
+        self._history: "OrderedDict[str, TransferProgress]" = OrderedDict()
+        self._host_samples: Dict[str, deque] = {}
+        self._expire_callbacks: List[Callable[[str], None]] = []
+
+    def on_expire(self, callback: Callable[[str], None]):
+        """Call `callback(transfer_id)` when a finished transfer drops out of the history."""
+        self._expire_callbacks.append(callback)
+
+    def _sweep(self):
+        for transfer_id in [t for t, p in self._live.items() if p.finished_at is not None]:
+            progress = self._live.pop(transfer_id)
+            self._history[transfer_id] = progress
+            if progress.status == "completed" and progress.host:
+                samples = self._host_samples.setdefault(progress.host, deque(maxlen=FTP_HOST_STATS_SAMPLES))
+                samples.append((progress.finished_at, progress.average_speed(),
+                                progress.bytes_transferred - progress.start_bytes))
+        cutoff = time.time() - self.ttl
+        while self._history and (len(self._history) > self.history_size
+                                 or next(iter(self._history.values())).finished_at < cutoff):
+            transfer_id, _ = self._history.popitem(last=False)
+            for callback in self._expire_callbacks:
+                callback(transfer_id)
+
+    def register(self, progress: TransferProgress):
+        self._sweep()
+        self._history.pop(progress.transfer_id, None)
+        self._live[progress.transfer_id] = progress
+
+    def get(self, transfer_id: str) -> Optional[TransferProgress]:
+        self._sweep()
+        return self._live.get(transfer_id) or self._history.get(transfer_id)
+
+    def records(self) -> List[TransferProgress]:
+        """Live transfers first, then finished ones still in the history."""
+        self._sweep()
+        return list(self._live.values()) + list(self._history.values())
+
+    def host_summary(self) -> Dict[str, Any]:
+        self._sweep()
+        cutoff = time.time() - self.ttl
+        summary = {}
+        for host, samples in self._host_samples.items():
+            recent = [(rate, size) for finished, rate, size in samples if finished >= cutoff]
+            if not recent:
+                continue
+            rates = sorted(rate for rate, _ in recent)
+            summary[host] = {
+                "transfers": len(recent),
+                "bytes": sum(size for _, size in recent),
+                "p50_bytes_per_sec": round(_percentile(rates, 0.5), 2),
+                "p90_bytes_per_sec": round(_percentile(rates, 0.9), 2),
+                "p99_bytes_per_sec": round(_percentile(rates, 0.99), 2),
+                "min_bytes_per_sec": round(rates[0], 2),
+                "max_bytes_per_sec": round(rates[-1], 2),
+            }
+        return {
+            "live": len(self._live),
+            "stalled": sum(1 for p in self._live.values() if p.stalled()),
+            "history": len(self._history),
+            "hosts": summary,
+        }
+
+
+# Global transfer progress tracker
+transfer_registry = TransferRegistry()
+
+
+# -----------------------------
+# asyncio FTP client (control + data channels on asyncio streams)
+# -----------------------------
+FTP_CONNECT_TIMEOUT = 10
+FTP_COMMAND_TIMEOUT = 60
+FTP_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def _tune_data_socket(writer: asyncio.StreamWriter, buffer_size: int = FTP_BLOCK_SIZE):
+    sock = writer.get_extra_info("socket")
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    except OSError:
+        pass
+
+
+# asyncio's start_tls() has no session argument; wrap_bio() runs inside the calling task,
+# so the session to resume travels there in a context variable
+_tls_resume_session: contextvars.ContextVar = contextvars.ContextVar("ftp_tls_resume_session", default=None)
+
+
+class _ResumingSSLContext(ssl.SSLContext):
+    """Client context that offers the session in `_tls_resume_session` for resumption."""
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return super().wrap_bio(incoming, outgoing, server_side=server_side, server_hostname=server_hostname,
+                                session=session or _tls_resume_session.get())
+
+
+class FTPTLSSessions:
+    """Client TLS contexts, the latest TLS session per server, and handshake metrics.
+
+    New control connections resume the server's last session, and data
+    connections resume their control connection's, which servers such as
+    vsftpd (require_ssl_reuse) insist on. A resumed handshake skips the
+    certificate exchange and key agreement, so parallel segment connections
+    cost little more than on plain FTP.
+    """
+
+    def __init__(self):
+        self._contexts: Dict[bool, ssl.SSLContext] = {}
+        self._sessions: Dict[tuple, ssl.SSLSession] = {}
+        self._handshakes: Dict[tuple, Dict[str, Dict[str, float]]] = {}
+
+    def context(self, verify: bool) -> ssl.SSLContext:
+        # One context per mode: sessions can only be resumed through the context that made them
+        ctx = self._contexts.get(verify)
+        if ctx is None:
+            ctx = _ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            if verify:
+                ctx.load_default_certs()
+            else:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+            self._contexts[verify] = ctx
+        return ctx
+
+    def session(self, host_key: tuple, verify: bool) -> Optional[ssl.SSLSession]:
+        return self._sessions.get((host_key, verify))
+
+    def remember(self, host_key: tuple, verify: bool, session: Optional[ssl.SSLSession]):
+        if session is not None:
+            self._sessions[(host_key, verify)] = session
+
+    def record(self, host_key: tuple, channel: str, resumed: bool, seconds: float):
+        entry = self._handshakes.setdefault(host_key, {}).setdefault(
+            channel, {"handshakes": 0, "resumed": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        entry["handshakes"] += 1
+        entry["resumed"] += resumed
+        entry["total_seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            f"{h}:{p}": {
+                channel: {
+                    "handshakes": e["handshakes"],
+                    "resumed": e["resumed"],
+                    "avg_ms": round(e["total_seconds"] / e["handshakes"] * 1000, 2),
+                    "max_ms": round(e["max_seconds"] * 1000, 2),
+                }
+                for channel, e in channels.items()
+            }
+            for (h, p), channels in self._handshakes.items()
+        }
+
+
+ftp_tls = FTPTLSSessions()
+
+
+class AsyncFTP:
+    """Minimal FTP client built on asyncio streams.
+
+    Transfers run on the event loop, so concurrency is bounded by sockets
+    rather than threads. Error replies raise ftplib's exception types
+    (error_perm for 5xx, error_temp for 4xx, error_reply/error_proto
+    otherwise), so callers handle them exactly as they did with ftplib.
+    After auth_tls() and prot_p() it speaks explicit FTPS like ftplib.FTP_TLS.
+    """
+    encoding = "utf-8"
+
+    def __init__(self, host: str, port: int = 21, passive: bool = True, timeout: float = FTP_COMMAND_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.passive = passive
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.welcome = ""
+        self.data_buffer_size = FTP_BLOCK_SIZE  # SO_SNDBUF/SO_RCVBUF of data connections
+        self.ssl_context: Optional[ssl.SSLContext] = None
+        self.protect_data = False
+        self._type: Optional[str] = None
+
+    async def connect(self, timeout: float = FTP_CONNECT_TIMEOUT) -> str:
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+        sock = self.writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.welcome = await self.getresp()
+        return self.welcome
+
+    # -- TLS --
+    async def _start_tls(self, writer: asyncio.StreamWriter, channel: str, session: Optional[ssl.SSLSession]):
+        token = _tls_resume_session.set(session)
+        started = time.monotonic()
+        try:
+            await writer.start_tls(self.ssl_context, server_hostname=self.host,
+                                   ssl_handshake_timeout=FTP_CONNECT_TIMEOUT)
+        finally:
+            _tls_resume_session.reset(token)
+        ssl_object = writer.get_extra_info("ssl_object")
+        ftp_tls.record((self.host, self.port), channel, ssl_object.session_reused, time.monotonic() - started)
+
+    async def auth_tls(self, context: ssl.SSLContext, session: Optional[ssl.SSLSession] = None) -> str:
+        """AUTH TLS: encrypt the control connection, resuming `session` when the server allows."""
+        resp = await self.sendcmd("AUTH TLS")
+        if resp[:3] != "234":
+            raise error_reply(resp)
+        self.ssl_context = context
+        await self._start_tls(self.writer, "control", session)
+        return resp
+
+    async def prot_p(self):
+        """PBSZ 0 + PROT P: data connections use TLS too."""
+        await self.voidcmd("PBSZ 0")
+        await self.voidcmd("PROT P")
+        self.protect_data = True
+
+    @property
+    def tls_session(self) -> Optional[ssl.SSLSession]:
+        ssl_object = self.writer.get_extra_info("ssl_object") if self.writer is not None else None
+        return ssl_object.session if ssl_object is not None else None
+
+    # -- control channel --
+    async def _readline(self) -> str:
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise EOFError("FTP control connection closed")
+        return line.decode(self.encoding, "surrogateescape").rstrip("\r\n")
+
+    async def getmultiline(self) -> str:
+        line = await self._readline()
+        if line[3:4] == "-":
+            code = line[:3]
+            lines = [line]
+            while True:
+                nxt = await self._readline()
+                lines.append(nxt)
+                if nxt[:3] == code and nxt[3:4] != "-":
+                    break
+            return "\n".join(lines)
+        return line
+
+    async def getresp(self) -> str:
+        resp = await self.getmultiline()
+        c = resp[:1]
+        if c in ("1", "2", "3"):
+            return resp
+        if c == "4":
+            raise error_temp(resp)
+        if c == "5":
+            raise error_perm(resp)
+        raise error_proto(resp)
+
+    async def voidresp(self) -> str:
+        resp = await self.getresp()
+        if resp[:1] != "2":
+            raise error_reply(resp)
+        return resp
+
+    async def putcmd(self, cmd: str):
+        if "\r" in cmd or "\n" in cmd:
+            raise ValueError("an illegal newline character should not be contained")
+        self.writer.write((cmd + "\r\n").encode(self.encoding, "surrogateescape"))
+        await self.writer.drain()
+
+    async def sendcmd(self, cmd: str) -> str:
+        await self.putcmd(cmd)
+        return await self.getresp()
+
+    async def voidcmd(self, cmd: str) -> str:
+        await self.putcmd(cmd)
+        return await self.voidresp()
+
+    async def login(self, user: str, password: str) -> str:
+        resp = await self.sendcmd("USER " + user)
+        if resp[:1] == "3":
+            resp = await self.sendcmd("PASS " + password)
+        if resp[:1] != "2":
+            raise error_reply(resp)
+        return resp
+
+    async def pwd(self) -> str:
+        resp = await self.voidcmd("PWD")
+        # 257 "/the/dir" is the current directory (embedded quotes are doubled)
+        if resp[:3] != "257" or '"' not in resp:
+            return ""
+        dirname, i, n = "", resp.index('"') + 1, len(resp)
+        while i < n:
+            c = resp[i]
+            i += 1
+            if c == '"':
+                if i >= n or resp[i] != '"':
+                    break
+                i += 1
+            dirname += c
+        return dirname
+
+    async def set_type(self, type_code: str):
+        """TYPE A/I, skipped when the session is already in that mode."""
+        if self._type != type_code:
+            await self.voidcmd("TYPE " + type_code)
+            self._type = type_code
+
+    async def cwd(self, path: str) -> str:
+        return await self.voidcmd("CWD " + path)
+
+    async def size(self, name: str) -> Optional[int]:
+        # Many servers refuse SIZE in ASCII mode
+        await self.set_type("I")
+        resp = await self.sendcmd("SIZE " + name)
+        if resp[:3] == "213":
+            return int(resp[3:].strip())
+        return None
+
+    async def rename(self, fromname: str, toname: str) -> str:
+        resp = await self.sendcmd("RNFR " + fromname)
+        if resp[:1] != "3":
+            raise error_reply(resp)
+        return await self.voidcmd("RNTO " + toname)
+
+    async def delete(self, name: str) -> str:
+        return await self.voidcmd("DELE " + name)
+
+    async def mkd(self, path: str) -> str:
+        return await self.voidcmd("MKD " + path)
+
+    async def mdtm(self, name: str) -> Optional[float]:
+        """Modification time of a remote file as Unix seconds (MDTM replies are UTC)."""
+        resp = await self.sendcmd("MDTM " + name)
+        m = re.match(r"213 (\d{14})(\.\d+)?", resp)
+        if not m:
+            return None
+        stamp = datetime.strptime(m.group(1), "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+        return stamp.timestamp() + float(m.group(2) or 0)
+
+    async def feat(self) -> List[str]:
+        # Multi-line reply: "211-Features:", one feature per line, "211 End"
+        return [line.strip().upper() for line in (await self.sendcmd("FEAT")).splitlines()[1:-1]]
+
+    async def quit(self):
+        try:
+            await asyncio.wait_for(self.voidcmd("QUIT"), 5)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    # -- data channel --
+    async def _open_data_connection(self):
+        loop = asyncio.get_running_loop()
+        peer_host = self.writer.get_extra_info("peername")[0]
+        ipv6 = ":" in peer_host
+        if self.passive:
+            if ipv6:
+                resp = await self.sendcmd("EPSV")
+                m = re.search(r"\((.)\1\1(\d+)\1\)", resp)
+            else:
+                resp = await self.sendcmd("PASV")
+                m = re.search(r"(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)", resp)
+            if not m:
+                raise error_proto(resp)
+            port = int(m.group(2)) if ipv6 else int(m.group(5)) * 256 + int(m.group(6))
+            # Like ftplib, trust the control connection's address over the one in the reply
+            data = await asyncio.wait_for(asyncio.open_connection(peer_host, port), FTP_CONNECT_TIMEOUT)
+            return data, None
+
+        accepted = loop.create_future()
+
+        async def on_accept(reader, writer):
+            if accepted.done():
+                writer.close()
+            else:
+                accepted.set_result((reader, writer))
+
+        local_host = self.writer.get_extra_info("sockname")[0]
+        listener = await asyncio.start_server(on_accept, local_host, 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            if ipv6:
+                await self.voidcmd(f"EPRT |2|{local_host}|{port}|")
+            else:
+                await self.voidcmd("PORT " + ",".join(local_host.split(".") + [str(port >> 8), str(port & 0xFF)]))
+        except BaseException:
+            listener.close()
+            raise
+        return None, (listener, accepted)
+
+    async def transfercmd(self, cmd: str, rest: Optional[int] = None):
+        """Send a transfer command and return the (reader, writer) of its data connection."""
+        data, active = await self._open_data_connection()
+        try:
+            if rest is not None:
+                await self.sendcmd(f"REST {rest}")
+            resp = await self.sendcmd(cmd)
+            # Some servers send a 200 before the 150 (see ftplib.ntransfercmd)
+            if resp[:1] == "2":
+                resp = await self.getresp()
+            if resp[:1] != "1":
+                raise error_reply(resp)
+            if active is not None:
+                listener, accepted = active
+                data = await asyncio.wait_for(accepted, FTP_CONNECT_TIMEOUT)
+        finally:
+            if active is not None:
+                active[0].close()
+        if data is None:
+            raise error_proto("data connection not established")
+        if self.protect_data:
+            # Like ftplib.FTP_TLS, after the preliminary reply; resuming the control session
+            try:
+                await self._start_tls(data[1], "data", self.tls_session)
+            except BaseException:
+                data[1].close()
+                raise
+        _tune_data_socket(data[1], self.data_buffer_size)
+        return data
+
+    async def abort(self):
+        """Abandon the running transfer and bring the control channel back in sync.
+
+        The aborted command answers first (426, or 226 if it had just
+        finished), then ABOR itself (225/226). A NOOP round trip afterwards
+        proves no stray reply is left; anything unexpected raises error_proto
+        so the pool discards the connection.
+        """
+        await self.putcmd("ABOR")
+        resp = await self.getmultiline()
+        if resp[:3] != "225":
+            resp = await asyncio.wait_for(self.getmultiline(), 5)
+        await self.putcmd("NOOP")
+        resp = await self.getmultiline()
+        if resp[:3] != "200":
+            raise error_proto(f"control channel out of sync after ABOR: {resp}")
+
+    async def stor(self, name: str, source, rest: Optional[int] = None) -> str:
+        """STOR from `source` (anything with `async send_to(writer)`), at `rest` when given."""
+        return await self._store_from(f"STOR {name}", source, rest)
+
+    async def appe(self, name: str, source) -> str:
+        """APPE: add `source` to the end of the remote file (resuming without REST)."""
+        return await self._store_from(f"APPE {name}", source)
+
+    async def _store_from(self, cmd: str, source, rest: Optional[int] = None) -> str:
+        await self.set_type("I")
+        _, writer = await self.transfercmd(cmd, rest)
+        try:
+            await source.send_to(writer)
+            writer.close()
+            await writer.wait_closed()
+        except BaseException:
+            writer.close()
+            raise
+        return await self.voidresp()
+
+    async def iter_lines(self, cmd: str) -> AsyncIterator[str]:
+        """Yield the lines of a LIST/NLST/MLSD listing as the data connection produces them.
+
+        Use with contextlib.aclosing(); stopping early aborts the transfer.
+        """
+        await self.set_type("A")
+        reader, writer = await self.transfercmd(cmd)
+        completed = False
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not line:
+                    break
+                yield line.decode(self.encoding, "surrogateescape").rstrip("\r\n")
+            completed = True
+        finally:
+            writer.close()
+            if completed:
+                await self.voidresp()
+            else:
+                await self.abort()
+
+    async def iter_retr(self, name: str, rest: Optional[int] = None, length: Optional[int] = None,
+                        blocksize: int = 256 * 1024) -> AsyncIterator[bytes]:
+        """Yield blocks of a RETR starting at `rest`, stopping after `length` bytes when given.
+
+        Use with contextlib.aclosing(); stopping early aborts the transfer.
+        """
+        await self.set_type("I")
+        reader, writer = await self.transfercmd(f"RETR {name}", rest or None)
+        remaining = length
+        completed = False
+        try:
+            while remaining is None or remaining > 0:
+                block = await asyncio.wait_for(
+                    reader.read(blocksize if remaining is None else min(blocksize, remaining)), self.timeout)
+                if not block:
+                    break
+                if remaining is not None:
+                    remaining -= len(block)
+                yield block
+            # Hitting EOF ends the transfer normally; stopping at `length` needs an ABOR
+            completed = remaining is None or remaining > 0
+        finally:
+            writer.close()
+            if completed:
+                await self.voidresp()
+            else:
+                await self.abort()
+
+
+async def connect_ftp(cfg: FTPConfig) -> AsyncFTP:
+    ftp = AsyncFTP(cfg.host, cfg.port, passive=cfg.passive)
+    host_key = (cfg.host, cfg.port)
+    try:
+        await ftp.connect()
+        if cfg.tls:
+            await ftp.auth_tls(ftp_tls.context(cfg.tls_verify), ftp_tls.session(host_key, cfg.tls_verify))
+        await ftp.login(cfg.user, cfg.password)
+        if cfg.tls:
+            await ftp.prot_p()
+            # Taken after login: a TLS 1.3 session ticket only arrives after the handshake
+            ftp_tls.remember(host_key, cfg.tls_verify, ftp.tls_session)
         if cfg.cwd:
-            ftp.cwd(cfg.cwd)
+            await ftp.cwd(cfg.cwd)
         return ftp
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"FTP connect failed: {e}")
+        ftp.close()
+        raise HTTPException(status_code=400, detail=f"FTP connect failed: {str(e) or type(e).__name__}")
+
+
+# -----------------------------
+# FTP control connection pool
+# -----------------------------
+FTP_POOL_MAX_PER_HOST = int(os.environ.get("FTP_POOL_MAX_PER_HOST", 8))
+FTP_POOL_IDLE_TTL = float(os.environ.get("FTP_POOL_IDLE_TTL", 60))
+FTP_POOL_NOOP_AFTER = float(os.environ.get("FTP_POOL_NOOP_AFTER", 5))
+FTP_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("FTP_POOL_ACQUIRE_TIMEOUT", 30))
+
+
+class PooledFTP:
+    """A logged-in control connection checked out of the pool."""
+
+    def __init__(self, ftp: AsyncFTP, key: tuple, home: str):
+        self.ftp = ftp
+        self.key = key
+        self.host_key = (key[0], key[1])
+        # Absolute home directory (the config cwd) and where the connection is now
+        self.home = home or "/"
+        self.cwd = self.home
+        self.last_used = time.monotonic()
+
+    async def chdir(self, path: Optional[str]):
+        """cwd relative to the config cwd, skipping the round trip when already there."""
+        target = posixpath.normpath(posixpath.join(self.home, path or "."))
+        if target != self.cwd:
+            await self.ftp.cwd(target)
+            self.cwd = target
+
+    async def close(self):
+        try:
+            await self.ftp.quit()
+        except Exception:
+            self.ftp.close()
+
+
+class FTPConnectionPool:
+    """Pool of logged-in FTP sessions shared by every request on the event loop.
+
+    Connections are keyed by (host, port, user, passive, cwd, TLS mode) plus a credential
+    fingerprint, so a wrong password never gets someone else's session. Idle
+    connections are NOOP-checked before reuse and closed after `idle_ttl`;
+    at most `max_per_host` sessions are open per (host, port).
+    """
+
+    def __init__(self, max_per_host: int = FTP_POOL_MAX_PER_HOST, idle_ttl: float = FTP_POOL_IDLE_TTL,
+                 noop_after: float = FTP_POOL_NOOP_AFTER, acquire_timeout: float = FTP_POOL_ACQUIRE_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.idle_ttl = idle_ttl
+        self.noop_after = noop_after
+        self.acquire_timeout = acquire_timeout
+        self._cond: Optional[asyncio.Condition] = None
+        self._idle: Dict[tuple, List[PooledFTP]] = {}
+        self._open: Dict[tuple, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.health_check_failures = 0
+        self._closing: set = set()
+
+    @property
+    def cond(self) -> asyncio.Condition:
+        # Created lazily so it binds to the running loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    @staticmethod
+    def key_for(cfg: FTPConfig) -> tuple:
+        secret = hashlib.sha256(cfg.password.encode("utf-8")).hexdigest()[:16]
+        return (cfg.host, cfg.port, cfg.user, cfg.passive, cfg.cwd, cfg.tls, cfg.tls_verify, secret)
+
+    def _close_soon(self, conns: List[PooledFTP]):
+        # QUIT in the background instead of making the caller wait for it
+        for conn in conns:
+            task = asyncio.get_running_loop().create_task(conn.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _pop_expired(self) -> List[PooledFTP]:
+        now = time.monotonic()
+        expired: List[PooledFTP] = []
+        for key in list(self._idle):
+            keep = []
+            for conn in self._idle[key]:
+                if now - conn.last_used > self.idle_ttl:
+                    expired.append(conn)
+                else:
+                    keep.append(conn)
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        for conn in expired:
+            self._open[conn.host_key] -= 1
+        self.evictions += len(expired)
+        return expired
+
+    def _pop_idle_for_host(self, host_key: tuple) -> Optional[PooledFTP]:
+        # Oldest idle connection to the same server under a different key
+        victim = None
+        for conns in self._idle.values():
+            for conn in conns:
+                if conn.host_key == host_key and (victim is None or conn.last_used < victim.last_used):
+                    victim = conn
+        if victim is not None:
+            self._idle[victim.key].remove(victim)
+            if not self._idle[victim.key]:
+                del self._idle[victim.key]
+            self.evictions += 1
+        return victim
+
+    async def acquire(self, cfg: FTPConfig) -> PooledFTP:
+        key = self.key_for(cfg)
+        host_key = (cfg.host, cfg.port)
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            conn: Optional[PooledFTP] = None
+            async with self.cond:
+                while True:
+                    expired = self._pop_expired()
+                    if expired:
+                        self._close_soon(expired)
+                        self.cond.notify_all()
+                    idle = self._idle.get(key)
+                    if idle:
+                        conn = idle.pop()
+                        if not idle:
+                            del self._idle[key]
+                        self.hits += 1
+                        break
+                    if self._open.get(host_key, 0) < self.max_per_host:
+                        self._open[host_key] = self._open.get(host_key, 0) + 1
+                        self.misses += 1
+                        break
+                    victim = self._pop_idle_for_host(host_key)
+                    if victim is not None:
+                        # Reuse the victim's slot for a fresh connection
+                        self._close_soon([victim])
+                        self.misses += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    try:
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        await asyncio.wait_for(self.cond.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        raise HTTPException(status_code=503, detail=f"FTP connection limit reached for {cfg.host}")
+
+            if conn is None:
+                try:
+                    started = time.monotonic()
+                    ftp = await connect_ftp(cfg)
+                    record_connect_latency(host_key, time.monotonic() - started)
+                    try:
+                        home = await ftp.pwd()
+                    except BaseException:
+                        ftp.close()
+                        raise
+                    return PooledFTP(ftp, key, home)
+                except BaseException:
+                    await self._release_slot(host_key)
+                    raise
+
+            if time.monotonic() - conn.last_used < self.noop_after:
+                return conn
+            try:
+                await conn.ftp.voidcmd("NOOP")
+                return conn
+            except Exception:
+                # Server dropped the idle session; discard it and try again
+                self.health_check_failures += 1
+                await self.release(conn, discard=True)
+
+    def spare(self, cfg: FTPConfig) -> int:
+        """Sessions a caller could get right now without waiting."""
+        host_key = (cfg.host, cfg.port)
+        return (self.max_per_host - self._open.get(host_key, 0)) + len(self._idle.get(self.key_for(cfg), ()))
+
+    async def _release_slot(self, host_key: tuple):
+        async with self.cond:
+            self._open[host_key] -= 1
+            if self._open[host_key] <= 0:
+                del self._open[host_key]
+            self.cond.notify_all()
+
+    async def release(self, conn: PooledFTP, discard: bool = False):
+        if discard:
+            conn.ftp.close()
+            await self._release_slot(conn.host_key)
+            return
+        conn.last_used = time.monotonic()
+        async with self.cond:
+            self._idle.setdefault(conn.key, []).append(conn)
+            self.cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def connection(self, cfg: FTPConfig):
+        conn = await self.acquire(cfg)
+        try:
+            yield conn
+        except error_perm:
+            # The server answered with an error reply; the session itself is fine
+            await self.release(conn)
+            raise
+        except BaseException:
+            await self.release(conn, discard=True)
+            raise
+        else:
+            await self.release(conn)
+
+    async def evict_idle(self):
+        async with self.cond:
+            expired = self._pop_expired()
+            if expired:
+                self.cond.notify_all()
+        for conn in expired:
+            await conn.close()
+
+    async def close_all(self):
+        async with self.cond:
+            conns = [c for cs in self._idle.values() for c in cs]
+            self._idle.clear()
+            for conn in conns:
+                self._open[conn.host_key] -= 1
+        for conn in conns:
+            await conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "health_check_failures": self.health_check_failures,
+            "idle": sum(len(cs) for cs in self._idle.values()),
+            "open_per_host": {f"{h}:{p}": n for (h, p), n in self._open.items() if n > 0},
+            "max_per_host": self.max_per_host,
+            "idle_ttl": self.idle_ttl,
+        }
+
+
+ftp_pool = FTPConnectionPool()
+
+
+async def _ftp_pool_reaper():
+    while True:
+        await asyncio.sleep(max(1.0, ftp_pool.idle_ttl / 2))
+        try:
+            await ftp_pool.evict_idle()
+        except Exception as e:
+            logging.warning(f"FTP pool eviction failed: {e}")
+
+
+@app.on_event("startup")
+async def _start_ftp_pool_reaper():
+    app.state.ftp_pool_reaper = asyncio.create_task(_ftp_pool_reaper())
+
+
+@app.on_event("shutdown")
+async def _stop_ftp_pool():
+    reaper = getattr(app.state, "ftp_pool_reaper", None)
+    if reaper:
+        reaper.cancel()
+    await ftp_pool.close_all()
+
+
+@api_router.get("/ftp/pool-stats")
+async def get_ftp_pool_stats():
+    """Connection pool hit/miss counters and open sessions per host"""
+    return ftp_pool.stats()
+
+
+@api_router.get("/ftp/tls-stats")
+async def get_ftp_tls_stats():
+    """FTPS handshake counts and durations per host, for control and data connections"""
+    return ftp_tls.stats()
+
+
+# -----------------------------
+# Server capabilities (FEAT), learned once per host
+# -----------------------------
+# Per-server capabilities learned from FEAT and from verified uploads
+ftp_host_caps: Dict[tuple, Dict[str, Any]] = {}
+
+
+async def get_ftp_features(conn: PooledFTP) -> Dict[str, Any]:
+    caps = ftp_host_caps.get(conn.host_key)
+    if caps is not None:
+        return caps
+    try:
+        features = set(await conn.ftp.feat())
+    except error_perm:
+        features = set()
+    caps = {
+        "features": sorted(features),
+        "rest_stor": any(f.startswith("REST STREAM") for f in features),
+        "mlsd": any(f.startswith("MLST") for f in features),
+    }
+    ftp_host_caps[conn.host_key] = caps
+    return caps
+
+
+def set_ftp_capability(host_key: tuple, name: str, value: Any):
+    ftp_host_caps.setdefault(host_key, {"features": []})[name] = value
+
+
+class HostProfile:
+    """Transfer settings learned for one server by auto-tuned uploads."""
+
+    def __init__(self):
+        self.connections: Optional[int] = None
+        self.piece_size: Optional[int] = None
+        self.block_size: Optional[int] = None
+        self.throughput = 0.0  # Bytes/s at `connections`
+        self.connect_latency: Optional[float] = None  # EWMA of connect + login, seconds
+        self.samples: Dict[int, float] = {}  # EWMA of whole-transfer bytes/s by connection count
+        self.transfers = 0
+        self.updated: Optional[float] = None
+
+    def record_sample(self, connections: int, nbytes: int, seconds: float):
+        """Fold one finished transfer in; short uploads end before a tuner can measure a window."""
+        if nbytes <= 0 or seconds <= 0:
+            return
+        rate = nbytes / seconds
+        previous = self.samples.get(connections)
+        self.samples[connections] = rate if previous is None else 0.3 * rate + 0.7 * previous
+        self.transfers += 1
+        self.updated = time.time()
+
+    def best_sample(self) -> Optional[int]:
+        """Connection count with the best whole-transfer rate; the fewer on a tie."""
+        if not self.samples:
+            return None
+        return max(sorted(self.samples), key=self.samples.get)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "connections": self.connections,
+            "piece_size": self.piece_size,
+            "block_size": self.block_size,
+            "throughput_bytes_per_sec": round(self.throughput, 2),
+            "connect_latency_ms": round(self.connect_latency * 1000, 1) if self.connect_latency is not None else None,
+            "samples": {n: round(rate, 2) for n, rate in sorted(self.samples.items())},
+            "transfers": self.transfers,
+            "updated": datetime.utcfromtimestamp(self.updated).isoformat() + "Z" if self.updated else None,
+        }
+
+
+ftp_host_profiles: Dict[tuple, HostProfile] = {}
+
+
+def record_connect_latency(host_key: tuple, seconds: float):
+    profile = ftp_host_profiles.setdefault(host_key, HostProfile())
+    previous = profile.connect_latency
+    profile.connect_latency = seconds if previous is None else 0.3 * seconds + 0.7 * previous
+
+
+@api_router.get("/ftp/host-profiles")
+async def get_ftp_host_profiles():
+    """Learned per-server capabilities and auto-tuning profiles"""
+    return {f"{h}:{p}": {**profile.as_dict(), "capabilities": ftp_host_caps.get((h, p))}
+            for (h, p), profile in ftp_host_profiles.items()}
+
+
+# -----------------------------
+# Directory listings: MLSD/LIST parsing and an LRU cache
+# -----------------------------
+FTP_LIST_CACHE_SIZE = int(os.environ.get("FTP_LIST_CACHE_SIZE", 256))
+FTP_LIST_CACHE_TTL = float(os.environ.get("FTP_LIST_CACHE_TTL", 30))
+FTP_LIST_CACHE_MAX_ITEMS = int(os.environ.get("FTP_LIST_CACHE_MAX_ITEMS", 50000))  # Bigger listings are streamed, not cached
+FTP_LIST_FLUSH_BYTES = 32 * 1024
+FTP_LIST_FLUSH_INTERVAL = 0.25
+
+_MONTHS = {m: i for i, m in enumerate(("jan", "feb", "mar", "apr", "may", "jun",
+                                       "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+_UNIX_LIST_RE = re.compile(
+    r"^(?P<kind>[\-ldbcpsD])\S*\s+.*?(?P<size>\d+)\s+(?P<month>[A-Za-z]{3})\s+(?P<day>\d{1,2})\s+"
+    r"(?P<time>\d{1,2}:\d{2}|\d{4})\s(?P<name>.+)$")
+_DOS_LIST_RE = re.compile(
+    r"^(?P<month>\d{2})-(?P<day>\d{2})-(?P<year>\d{2,4})\s+(?P<hour>\d{1,2}):(?P<minute>\d{2})\s*(?P<ampm>[AaPp][Mm])?"
+    r"\s+(?P<size><DIR>|\d+)\s+(?P<name>.+)$")
+
+
+def parse_mlsd_line(line: str) -> Optional[Dict[str, Any]]:
+    """`type=file;size=12;modify=20240101120000; name` -> entry (None for . and ..)."""
+    facts_part, sep, name = line.partition(" ")
+    if not sep or not name:
+        return None
+    facts = {}
+    for fact in facts_part.split(";"):
+        key, eq, value = fact.partition("=")
+        if eq:
+            facts[key.lower()] = value
+    kind = facts.get("type", "").lower()
+    if kind in ("cdir", "pdir"):
+        return None
+    if "symlink" in kind or "slink" in kind:
+        kind = "link"
+    elif kind not in ("file", "dir"):
+        kind = "other"
+    mtime = None
+    modify = facts.get("modify", "")
+    if len(modify) >= 14 and modify[:14].isdigit():
+        mtime = f"{modify[0:4]}-{modify[4:6]}-{modify[6:8]}T{modify[8:10]}:{modify[10:12]}:{modify[12:14]}Z"
+    size = facts.get("size") or facts.get("sizd")
+    return {"name": name, "type": kind, "size": int(size) if size and size.isdigit() else None, "mtime": mtime}
+
+
+def parse_list_line(line: str, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Parse one Unix `ls -l` or DOS/IIS style LIST line; unknown formats keep the raw line as name."""
+    if not line.strip() or line.lower().startswith("total "):
+        return None
+    m = _UNIX_LIST_RE.match(line)
+    if m:
+        name = m.group("name")
+        kind = {"-": "file", "d": "dir", "D": "dir", "l": "link"}.get(m.group("kind"), "other")
+        if kind == "link" and " -> " in name:
+            name = name.split(" -> ", 1)[0]
+        if name in (".", ".."):
+            return None
+        month = _MONTHS.get(m.group("month").lower())
+        mtime = None
+        if month:
+            now = now or datetime.utcnow()
+            day = int(m.group("day"))
+            if ":" in m.group("time"):
+                # No year means "within the last six months"
+                hour, minute = (int(x) for x in m.group("time").split(":"))
+                year = now.year if (month, day) <= (now.month, now.day + 1) else now.year - 1
+            else:
+                hour = minute = 0
+                year = int(m.group("time"))
+            mtime = f"{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}:00"
+        return {"name": name, "type": kind, "size": int(m.group("size")) if kind == "file" else None,
+                "mtime": mtime}
+    m = _DOS_LIST_RE.match(line)
+    if m:
+        year = int(m.group("year"))
+        if year < 100:
+            year += 2000 if year < 70 else 1900
+        hour = int(m.group("hour"))
+        if m.group("ampm"):
+            hour = hour % 12 + (12 if m.group("ampm").lower() == "pm" else 0)
+        is_dir = m.group("size") == "<DIR>"
+        return {"name": m.group("name"), "type": "dir" if is_dir else "file",
+                "size": None if is_dir else int(m.group("size")),
+                "mtime": f"{year:04d}-{m.group('month')}-{m.group('day')}T{hour:02d}:{m.group('minute')}:00"}
+    return {"name": line, "type": "unknown", "size": None, "mtime": None}
+
+
+def ftp_abs_path(cfg: FTPConfig, path: Optional[str]) -> str:
+    """A remote path resolved against the config cwd, as used for cache keys."""
+    return posixpath.normpath(posixpath.join(cfg.cwd or "/", path or "."))
+
+
+class ListingCache:
+    """LRU cache of parsed directory listings, each valid for `ttl` seconds.
+
+    Keyed by server, user (plus credential fingerprint) and absolute path, so
+    only someone who could log in sees a cached listing.
+    """
+
+    def __init__(self, max_entries: int = FTP_LIST_CACHE_SIZE, ttl: float = FTP_LIST_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key_for(cfg: FTPConfig, path: Optional[str]) -> tuple:
+        host, port, user, *_, secret = FTPConnectionPool.key_for(cfg)
+        return (host, port, user, secret, ftp_abs_path(cfg, path))
+
+    def get(self, key: tuple) -> Optional[List[Dict[str, Any]]]:
+        item = self._entries.get(key)
+        if item is None or time.monotonic() - item[0] > self.ttl:
+            if item is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: tuple, entries: List[Dict[str, Any]]):
+        self._entries[key] = (time.monotonic(), entries)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, cfg: FTPConfig, path: Optional[str]):
+        if self._entries.pop(self.key_for(cfg, path), None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+
+listing_cache = ListingCache()
+
+
+async def iter_directory(conn: PooledFTP) -> AsyncIterator[Dict[str, Any]]:
+    """Typed entries of the connection's current directory, via MLSD when the server has it."""
+    caps = await get_ftp_features(conn)
+    if caps.get("mlsd"):
+        try:
+            async with contextlib.aclosing(conn.ftp.iter_lines("MLSD")) as lines:
+                async for line in lines:
+                    entry = parse_mlsd_line(line)
+                    if entry:
+                        yield entry
+            return
+        except error_perm as e:
+            if not e.args[0].startswith(("500", "502", "504")):
+                raise
+            # Advertised but not implemented; remember and use LIST from now on
+            set_ftp_capability(conn.host_key, "mlsd", False)
+    now = datetime.utcnow()
+    async with contextlib.aclosing(conn.ftp.iter_lines("LIST")) as lines:
+        async for line in lines:
+            entry = parse_list_line(line, now)
+            if entry:
+                yield entry
+
+
+async def list_directory(cfg: FTPConfig, path: Optional[str], refresh: bool = False) -> tuple:
+    """Entries of a remote directory and whether they came from the cache."""
+    key = ListingCache.key_for(cfg, path)
+    if not refresh:
+        entries = listing_cache.get(key)
+        if entries is not None:
+            return entries, True
+    async with ftp_pool.connection(cfg) as conn:
+        await conn.chdir(path)
+        async with contextlib.aclosing(iter_directory(conn)) as listing:
+            entries = [entry async for entry in listing]
+    listing_cache.put(key, entries)
+    return entries, False
+
+
+@api_router.post("/ftp/list")
+async def ftp_list(body: FTPPath):
+    entries, cached = await list_directory(body.config, body.path, body.refresh)
+    return {"path": ftp_abs_path(body.config, body.path), "entries": entries, "cached": cached}
+
+
+class FTPListQuery(FTPPath):
+    offset: int = Field(0, ge=0)  # Matching entries to skip (after the cursor, if any)
+    limit: Optional[int] = Field(None, ge=1)
+    cursor: Optional[str] = None  # next_cursor of the previous page
+    pattern: Optional[str] = None  # Case-insensitive glob on the name, e.g. "*.jpg"
+    types: Optional[List[str]] = None  # Keep only these entry types, e.g. ["file"]
+
+
+class ListingPager:
+    """Filters and pages a stream of entries into buffered NDJSON lines.
+
+    `feed` returns False once the page is full and one more match has been
+    seen, so the caller can stop reading (and abort) the listing.
+    """
+
+    def __init__(self, query: FTPListQuery):
+        self.pattern = re.compile(fnmatch.translate(query.pattern), re.IGNORECASE) if query.pattern else None
+        self.types = set(query.types) if query.types else None
+        self.cursor = query.cursor
+        self.paged_by_cursor = query.cursor is not None
+        self.skip = query.offset
+        self.offset = query.offset
+        self.limit = query.limit
+        self.returned = 0
+        self.has_more = False
+        self.last_name: Optional[str] = None
+        self._buf: List[str] = []
+        self._buf_bytes = 0
+        self._flushed_at = time.monotonic()
+
+    def feed(self, entry: Dict[str, Any]) -> bool:
+        if self.types is not None and entry["type"] not in self.types:
+            return True
+        if self.pattern is not None and not self.pattern.match(entry["name"]):
+            return True
+        if self.cursor is not None:
+            if entry["name"] == self.cursor:
+                self.cursor = None
+            return True
+        if self.skip:
+            self.skip -= 1
+            return True
+        if self.limit is not None and self.returned >= self.limit:
+            self.has_more = True
+            return False
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        self._buf.append(line)
+        self._buf_bytes += len(line)
+        self.returned += 1
+        self.last_name = entry["name"]
+        return True
+
+    def take(self, force: bool = False) -> Optional[bytes]:
+        """Buffered lines once enough have piled up (or some time has passed)."""
+        if not self._buf:
+            return None
+        now = time.monotonic()
+        if not force and self._buf_bytes < FTP_LIST_FLUSH_BYTES and now - self._flushed_at < FTP_LIST_FLUSH_INTERVAL:
+            return None
+        chunk = "".join(self._buf).encode()
+        self._buf.clear()
+        self._buf_bytes = 0
+        self._flushed_at = now
+        return chunk
+
+    def footer(self, path: str, cached: bool) -> bytes:
+        return (json.dumps({
+            "done": True,
+            "path": path,
+            "returned": self.returned,
+            "has_more": self.has_more,
+            "next_cursor": self.last_name if self.has_more else None,
+            "next_offset": self.offset + self.returned if self.has_more and not self.paged_by_cursor else None,
+            "cursor_found": self.cursor is None,
+            "cached": cached,
+        }) + "\n").encode()
+
+
+async def _iter_listing_ndjson(query: FTPListQuery, cached: Optional[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    cfg = query.config
+    pager = ListingPager(query)
+    if cached is not None:
+        for entry in cached:
+            if not pager.feed(entry):
+                break
+    else:
+        collected: Optional[List[Dict[str, Any]]] = []
+        async with ftp_pool.connection(cfg) as conn:
+            await conn.chdir(query.path)
+            async with contextlib.aclosing(iter_directory(conn)) as listing:
+                async for entry in listing:
+                    if collected is not None:
+                        collected.append(entry)
+                        if len(collected) > FTP_LIST_CACHE_MAX_ITEMS:
+                            collected = None
+                    if not pager.feed(entry):
+                        # Leaving the block aborts the rest of the listing
+                        collected = None
+                        break
+                    chunk = pager.take()
+                    if chunk:
+                        yield chunk
+        if collected is not None:
+            listing_cache.put(ListingCache.key_for(cfg, query.path), collected)
+    chunk = pager.take(force=True)
+    if chunk:
+        yield chunk
+    yield pager.footer(ftp_abs_path(cfg, query.path), cached is not None)
+
+
+@api_router.post("/ftp/list-stream")
+async def ftp_list_stream(query: FTPListQuery):
+    """Directory listing as NDJSON, one entry per line, sent while the server is still listing.
+
+    The last line is a summary: {"done": true, "has_more", "next_cursor", ...}.
+    Pass `next_cursor` back as `cursor` (or `next_offset` as `offset`) for the next page.
+    """
+    cached = None if query.refresh else listing_cache.get(ListingCache.key_for(query.config, query.path))
+    if cached is None:
+        # Fail with a proper status before the response starts; the connection goes back to the pool
+        try:
+            async with ftp_pool.connection(query.config) as conn:
+                await conn.chdir(query.path)
+        except error_perm as e:
+            raise HTTPException(status_code=404, detail=f"Remote directory not available: {e}")
+    return StreamingResponse(_iter_listing_ndjson(query, cached), media_type="application/x-ndjson")
+
+
+@api_router.get("/ftp/list-cache-stats")
+async def get_ftp_list_cache_stats():
+    """Directory listing cache hit/miss counters"""
+    return listing_cache.stats()
+
+
+# -----------------------------
+# Recursive tree walk: breadth-first over a few pooled sessions
+# -----------------------------
+FTP_WALK_CONNECTIONS = int(os.environ.get("FTP_WALK_CONNECTIONS", 4))
+FTP_WALK_QUEUE = 256  # Listed directories waiting to be streamed; workers pause when it is full
+
+
+class FTPWalkQuery(FTPPath):
+    max_depth: Optional[int] = Field(None, ge=1)  # 1 lists `path` itself only
+    exclude: Optional[List[str]] = None  # Case-insensitive globs on the name or relative path, e.g. ".git"
+    entries: bool = True  # False streams only the totals
+    connections: int = Field(FTP_WALK_CONNECTIONS, ge=1)  # Capped at a transfer's share of the pool
+
+
+class _WalkDir:
+    """One directory of a walk; `pending` counts its own listing plus unfinished subdirectories."""
+    __slots__ = ("path", "depth", "parent", "pending", "files", "dirs", "bytes")
+
+    def __init__(self, path: str, depth: int, parent: Optional["_WalkDir"]):
+        self.path = path
+        self.depth = depth
+        self.parent = parent
+        self.pending = 1
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+
+
+class TreeWalker:
+    """Breadth-first walk of a remote tree, streamed as NDJSON.
+
+    Workers take directories from a FIFO queue, so the tree is listed level
+    by level with up to `connections` listings in flight, each worker on one
+    pooled session. Once a directory and everything below it has been
+    listed, a {"subtree": ...} line gives its totals and they roll up into
+    the parent. Symlinks are reported but not followed.
+    """
+
+    def __init__(self, query: FTPWalkQuery, connections: int):
+        self.cfg = query.config
+        self.root = query.path
+        self.max_depth = query.max_depth
+        self.exclude = [re.compile(fnmatch.translate(p), re.IGNORECASE) for p in query.exclude or ()]
+        self.refresh = query.refresh
+        self.with_entries = query.entries
+        self.connections = max(1, connections)
+        self._todo: deque = deque([_WalkDir("", 0, None)])
+        self._listing = 0
+        self._cond = asyncio.Condition()
+        self._out: asyncio.Queue = asyncio.Queue(FTP_WALK_QUEUE)
+        self._attempts: Dict[str, int] = {}
+        self._sessions = 0  # Workers holding a pooled session right now
+        self._stopped = False
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.listed = 0
+        self.errors = 0
+        self.depth_limited = False
+        self._lines: List[str] = []
+        self._buf_bytes = 0
+        self._flushed_at = time.monotonic()
+
+    def _excluded(self, name: str, rel: str) -> bool:
+        return any(p.match(name) or p.match(rel) for p in self.exclude)
+
+    async def _next(self) -> Optional[_WalkDir]:
+        """The next directory to list; None once nothing is queued or being listed."""
+        async with self._cond:
+            while not self._todo and self._listing and not self._stopped:
+                await self._cond.wait()
+            if not self._todo or self._stopped:
+                return None
+            self._listing += 1
+            return self._todo.popleft()
+
+    async def _report(self, node: _WalkDir, listed: Optional[List[Dict[str, Any]]] = None,
+                      error: Optional[str] = None):
+        kept, children = [], []
+        for item in listed or ():
+            rel = posixpath.join(node.path, item["name"])
+            if self._excluded(item["name"], rel):
+                continue
+            kept.append(item)
+            if item["type"] == "dir":
+                if self.max_depth is None or node.depth + 1 < self.max_depth:
+                    children.append(_WalkDir(rel, node.depth + 1, node))
+                else:
+                    self.depth_limited = True
+        node.pending += len(children)
+        async with self._cond:
+            self._todo.extend(children)
+            self._listing -= 1
+            self._cond.notify_all()
+        await self._out.put((node, kept, error))
+
+    async def _list(self, conn: PooledFTP, node: _WalkDir):
+        remote_dir = posixpath.join(self.root, node.path)
+        listed = None if self.refresh else listing_cache.get(ListingCache.key_for(self.cfg, remote_dir))
+        if listed is None:
+            try:
+                await conn.chdir(remote_dir)
+                async with contextlib.aclosing(iter_directory(conn)) as listing:
+                    listed = [item async for item in listing]
+            except error_perm as e:
+                await self._report(node, error=str(e))
+                return
+        await self._report(node, listed)
+
+    async def _worker(self):
+        retry_delay = 1
+        node = await self._next()
+        while node is not None:
+            try:
+                async with ftp_pool.connection(self.cfg) as conn:
+                    self._sessions += 1
+                    try:
+                        while node is not None:
+                            await self._list(conn, node)
+                            retry_delay = 1
+                            node = await self._next()
+                    finally:
+                        self._sessions -= 1
+            except HTTPException as e:
+                async with self._cond:
+                    if self._sessions:
+                        # Other workers still have sessions: hand the directory back and retire
+                        self._todo.appendleft(node)
+                        self._listing -= 1
+                        self._cond.notify_all()
+                        return
+                    # No session to be had; nothing still queued can be listed either
+                    failed, self._listing = list(self._todo), self._listing + len(self._todo)
+                    self._todo.clear()
+                await self._report(node, error=e.detail)
+                for other in failed:
+                    await self._report(other, error=e.detail)
+                node = await self._next()
+            except Exception as e:
+                attempts = self._attempts[node.path] = self._attempts.get(node.path, 0) + 1
+                if attempts >= FTP_SEGMENT_RETRIES:
+                    await self._report(node, error=str(e))
+                    node = await self._next()
+                    continue
+                logging.warning(f"Walk session failed: {str(e)}. Reconnecting in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2
+
+    def _emit(self, line: Dict[str, Any]):
+        text = json.dumps(line, separators=(",", ":")) + "\n"
+        self._lines.append(text)
+        self._buf_bytes += len(text)
+
+    def _absorb(self, node: _WalkDir, kept: List[Dict[str, Any]], error: Optional[str]):
+        self.listed += 1
+        if error is not None:
+            self.errors += 1
+            self._emit({"error": error, "path": node.path or "."})
+        files = dirs = size = 0
+        for item in kept:
+            if item["type"] == "file":
+                files += 1
+                size += item["size"] or 0
+            elif item["type"] == "dir":
+                dirs += 1
+            if self.with_entries:
+                self._emit({**item, "path": posixpath.join(node.path, item["name"])})
+        node.files += files
+        node.dirs += dirs
+        node.bytes += size
+        self.files += files
+        self.dirs += dirs
+        self.bytes += size
+        # The listing is done; report every subtree that is now complete
+        node.pending -= 1
+        while node is not None and node.pending == 0:
+            self._emit({"subtree": node.path or ".", "files": node.files, "dirs": node.dirs, "bytes": node.bytes})
+            parent = node.parent
+            if parent is not None:
+                parent.files += node.files
+                parent.dirs += node.dirs
+                parent.bytes += node.bytes
+                parent.pending -= 1
+            node = parent
+
+    def _take(self, force: bool = False) -> Optional[bytes]:
+        now = time.monotonic()
+        if not force and self._buf_bytes < FTP_LIST_FLUSH_BYTES and now - self._flushed_at < FTP_LIST_FLUSH_INTERVAL:
+            return None
+        self._emit({"progress": {"files": self.files, "dirs": self.dirs, "bytes": self.bytes,
+                                 "listed_dirs": self.listed, "queued_dirs": len(self._todo) + self._listing}})
+        chunk = "".join(self._lines).encode()
+        self._lines.clear()
+        self._buf_bytes = 0
+        self._flushed_at = now
+        return chunk
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        started = time.monotonic()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.connections)]
+
+        async def _close():
+            for result in await asyncio.gather(*workers, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logging.error(f"Walk worker failed: {str(result)}")
+            await self._out.put(None)
+
+        closer = asyncio.create_task(_close())
+        try:
+            while True:
+                item = await self._out.get()
+                if item is None:
+                    break
+                self._absorb(*item)
+                chunk = self._take()
+                if chunk:
+                    yield chunk
+            yield self._take(force=True)
+            yield (json.dumps({
+                "done": True,
+                "path": ftp_abs_path(self.cfg, self.root),
+                "files": self.files,
+                "dirs": self.dirs,
+                "bytes": self.bytes,
+                "listed_dirs": self.listed,
+                "errors": self.errors,
+                "depth_limited": self.depth_limited,
+                "connections": self.connections,
+                "elapsed_seconds": round(time.monotonic() - started, 2),
+            }) + "\n").encode()
+        finally:
+            # Also reached when the client goes away mid-walk. The flag stops a worker
+            # that misses its cancellation (wait_for can swallow one that races a reply).
+            self._stopped = True
+            for task in workers + [closer]:
+                task.cancel()
+
+
+@api_router.post("/ftp/walk")
+async def ftp_walk(query: FTPWalkQuery):
+    """Recursive listing of a remote tree as NDJSON, with file counts and bytes per subtree.
+
+    Lines are entries (with their `path` relative to the walk root), then
+    {"subtree": path, "files", "dirs", "bytes"} once a directory is fully
+    listed, {"error", "path"} for unreadable directories, and a running
+    {"progress": {...}} with every flush. The last line is {"done": true, ...}
+    with the grand totals.
+    """
+    try:
+        async with ftp_pool.connection(query.config) as conn:
+            await conn.chdir(query.path)
+    except error_perm as e:
+        raise HTTPException(status_code=404, detail=f"Remote directory not available: {e}")
+    # Like a transfer, a walk takes at most its share of the host's sessions
+    walker = TreeWalker(query, min(query.connections, transfer_jobs.connection_share()))
+    return StreamingResponse(walker.stream(), media_type="application/x-ndjson")
+
+
+# -----------------------------
+# Bandwidth scheduling: token buckets with weighted fair shares
+# -----------------------------
+FTP_BANDWIDTH_LIMIT = int(os.environ.get("FTP_BANDWIDTH_LIMIT", 0)) or None  # Global cap, bytes/s
+FTP_BANDWIDTH_IDLE = 1.0  # A flow that has not sent for this long gives up its share
+FTP_BANDWIDTH_FORGET = 600.0
+FTP_BANDWIDTH_BURST_SECONDS = 0.1
+FTP_BANDWIDTH_MIN_BURST = 64 * 1024
+
+
+class BandwidthFlow:
+    """Token bucket of one transfer (all of its connections share it)."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.priority = 0
+        self.limit: Optional[int] = None  # Per-transfer cap, bytes/s
+        self.rate: Optional[float] = None  # Allocated rate; None means unthrottled
+        self.tokens = 0.0
+        self.stamp = time.monotonic()
+        self.last_used = 0.0
+        self.sent = 0
+
+    @property
+    def weight(self) -> float:
+        return 2.0 ** max(-4, min(4, self.priority))
+
+    @property
+    def burst(self) -> int:
+        return int(max(FTP_BANDWIDTH_MIN_BURST, (self.rate or 0) * FTP_BANDWIDTH_BURST_SECONDS))
+
+    def refill(self, now: float):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+
+class BandwidthScheduler:
+    """Paces upload and download readers against a global cap and per-transfer caps.
+
+    Readers call `acquire(transfer_id, n)` before sending a block. Without
+    any limit that returns at once. With a global cap, the cap is split
+    between transfers that are currently sending in proportion to
+    2**priority (max-min fair: a transfer capped below its share hands the
+    rest to the others), and each transfer's token bucket refills at its
+    share. Limits and priorities can change at any time; running
+    transfers pick them up within one burst.
+    """
+
+    def __init__(self, global_limit: Optional[int] = FTP_BANDWIDTH_LIMIT):
+        self.global_limit = global_limit
+        self._flows: Dict[str, BandwidthFlow] = {}
+        self._allocated_at = 0.0
+
+    def flow(self, key: str) -> BandwidthFlow:
+        flow = self._flows.get(key)
+        if flow is None:
+            flow = self._flows[key] = BandwidthFlow(key)
+        return flow
+
+    def configure(self, key: str, **settings):
+        flow = self.flow(key)
+        for name, value in settings.items():
+            setattr(flow, name, value)
+        self.reallocate()
+
+    def set_global_limit(self, limit: Optional[int]):
+        self.global_limit = limit
+        self.reallocate()
+
+    @staticmethod
+    def _sending(flow: BandwidthFlow, now: float) -> bool:
+        if now - flow.last_used > FTP_BANDWIDTH_IDLE:
+            return False
+        progress = transfer_registry.get(flow.key)
+        return progress is None or progress.finished_at is None
+
+    def reallocate(self):
+        now = time.monotonic()
+        self._allocated_at = now
+        for key in [k for k, f in self._flows.items() if now - max(f.last_used, f.stamp) > FTP_BANDWIDTH_FORGET]:
+            del self._flows[key]
+        active = [f for f in self._flows.values() if self._sending(f, now)]
+        for flow in self._flows.values():
+            flow.refill(now)
+        shares: Dict[str, float] = {}
+        if self.global_limit:
+            remaining = float(self.global_limit)
+            pending = list(active)
+            while pending:
+                total_weight = sum(f.weight for f in pending)
+                capped = [f for f in pending if f.limit is not None and f.limit <= remaining * f.weight / total_weight]
+                if not capped:
+                    for f in pending:
+                        shares[f.key] = remaining * f.weight / total_weight
+                    break
+                for f in capped:
+                    shares[f.key] = f.limit
+                    remaining -= f.limit
+                    pending.remove(f)
+        for flow in self._flows.values():
+            rate = shares.get(flow.key)
+            if rate is None and self.global_limit:
+                # Not sending right now: start from an even split until the next reallocation
+                rate = self.global_limit / (len(active) + 1)
+            if flow.limit is not None:
+                rate = min(rate, flow.limit) if rate is not None else float(flow.limit)
+            flow.rate = rate
+
+    async def acquire(self, key: Optional[str], wanted: int, partial: bool = True) -> int:
+        """Wait until `key` may send; returns how many of `wanted` bytes to send now.
+
+        With `partial` the grant is at most one burst; otherwise all of
+        `wanted` is granted and the wait covers it.
+        """
+        if key is None:
+            return wanted
+        flow = self.flow(key)
+        now = time.monotonic()
+        newly_active = now - flow.last_used > FTP_BANDWIDTH_IDLE
+        flow.last_used = now
+        if newly_active or now - self._allocated_at > FTP_BANDWIDTH_IDLE / 2:
+            self.reallocate()
+        if flow.rate is None:
+            flow.sent += wanted
+            return wanted
+        grant = min(wanted, flow.burst) if partial else wanted
+        flow.refill(now)
+        flow.tokens -= grant
+        while flow.tokens < 0 and flow.rate:
+            # Sleep in slices so a changed limit or share applies to long waits too
+            await asyncio.sleep(min(-flow.tokens / flow.rate, FTP_BANDWIDTH_IDLE / 2))
+            now = time.monotonic()
+            flow.last_used = now
+            if now - self._allocated_at > FTP_BANDWIDTH_IDLE / 2:
+                self.reallocate()
+            else:
+                flow.refill(now)
+        flow.last_used = time.monotonic()
+        flow.sent += grant
+        return grant
+
+    def burst_for(self, key: Optional[str], default: int) -> int:
+        """How much to read ahead of an `acquire` without overshooting the flow's bucket."""
+        flow = self._flows.get(key) if key else None
+        return min(default, flow.burst) if flow is not None and flow.rate is not None else default
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "global_limit": self.global_limit,
+            "flows": [{
+                "transfer_id": f.key,
+                "priority": f.priority,
+                "weight": f.weight,
+                "limit": f.limit,
+                "rate": round(f.rate, 2) if f.rate is not None else None,
+                "active": self._sending(f, now),
+                "bytes_sent": f.sent,
+            } for f in self._flows.values()],
+        }
+
+
+bandwidth = BandwidthScheduler()
+
+
+class BandwidthSettings(BaseModel):
+    global_limit: Optional[int] = Field(None, ge=1)  # bytes/s; null removes the cap
+
+
+class TransferBandwidth(BaseModel):
+    limit: Optional[int] = Field(None, ge=1)  # bytes/s; null removes the cap
+    priority: Optional[int] = None
+
+
+@api_router.get("/ftp/bandwidth")
+async def get_ftp_bandwidth():
+    """Global cap and the current allocation per transfer"""
+    return bandwidth.stats()
+
+
+@api_router.put("/ftp/bandwidth")
+async def set_ftp_bandwidth(body: BandwidthSettings):
+    bandwidth.set_global_limit(body.global_limit)
+    return bandwidth.stats()
+
+
+@api_router.put("/ftp/bandwidth/{transfer_id}")
+async def set_transfer_bandwidth(transfer_id: str, body: TransferBandwidth):
+    """Cap or re-prioritise one transfer while it runs; omitted fields stay as they are."""
+    settings = {name: getattr(body, name) for name in body.model_fields_set}
+    if settings.get("priority", 0) is None:
+        del settings["priority"]
+    bandwidth.configure(transfer_id, **settings)
+    return bandwidth.stats()
+
+
+# -----------------------------
+# Upload integrity: hashing in the send path, checked with HASH/XCRC/XMD5
+# -----------------------------
+FTP_HASH_BLOCK_SIZE = 1024 * 1024
+_HASHLIB_NAMES = {"MD5": "md5", "SHA-1": "sha1", "SHA-256": "sha256", "SHA-512": "sha512"}
+_DIGEST_HEX_LENGTHS = {"CRC32": 8, "MD5": 32, "SHA-1": 40, "SHA-256": 64, "SHA-512": 128}
+
+
+def _gf2_times(matrix: List[int], vector: int) -> int:
+    total, i = 0, 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+
+def _gf2_square(matrix: List[int]) -> List[int]:
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """CRC32 of A+B from crc32(A), crc32(B) and len(B), as zlib's crc32_combine()."""
+    if len2 <= 0:
+        return crc1
+    # Operator for one zero bit, then squared into operators for 2, 4, 8... zero bits
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    while True:
+        even = _gf2_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_square(even)
+        if len2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+    return crc1 ^ crc2
+
+
+class UploadDigest:
+    """Running CRC32 of the bytes a reader sends, plus `algorithm` when a stronger one is wanted.
+
+    CRC32s of separate pieces can be combined into the whole file's, so
+    segmented uploads hash every piece on its own connection; a stronger
+    hash needs the bytes in order and is only used for single-stream uploads.
+    """
+
+    def __init__(self, algorithm: str = "CRC32"):
+        self.algorithm = algorithm
+        self.reset()
+
+    def reset(self):
+        self.crc = 0
+        self.length = 0
+        self._hash = hashlib.new(_HASHLIB_NAMES[self.algorithm]) if self.algorithm != "CRC32" else None
+
+    def update(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        if self._hash is not None:
+            self._hash.update(data)
+        self.length += len(data)
+
+    def read_at(self, source: "SharedFileSource", offset: int, size: int):
+        """Read a block for sending and hash it on the way (run on a worker thread)."""
+        data = source.read_at(offset, size)
+        self.update(data)
+        return data
+
+    async def absorb(self, source: "SharedFileSource", start: int, end: int):
+        """Hash [start, end) of the local file; used when a retry resumes from the remote size."""
+        loop = asyncio.get_running_loop()
+        for pos in range(start, end, FTP_HASH_BLOCK_SIZE):
+            await loop.run_in_executor(None, self.read_at, source, pos, min(FTP_HASH_BLOCK_SIZE, end - pos))
+
+    def digests(self) -> Dict[str, str]:
+        result = {"CRC32": f"{self.crc:08x}"}
+        if self._hash is not None:
+            result[self.algorithm] = self._hash.hexdigest()
+        return result
+
+
+def _hash_algorithms(caps: Dict[str, Any]) -> List[str]:
+    # FEAT line "HASH SHA-256*;SHA-1;MD5;CRC32"; the starred one is the current selection
+    for feature in caps.get("features", ()):
+        if feature.startswith("HASH "):
+            return [name.strip().rstrip("*") for name in feature[5:].split(";")]
+    return []
+
+
+def upload_digest_algorithm(caps: Dict[str, Any]) -> str:
+    """The strongest hash the server can check for a single-stream upload (CRC32 otherwise)."""
+    if caps.get("hash", True):
+        offered = _hash_algorithms(caps)
+        for algorithm in ("SHA-256", "SHA-512", "SHA-1", "MD5"):
+            if algorithm in offered:
+                return algorithm
+    if "XMD5" in caps.get("features", ()) and caps.get("xmd5", True):
+        return "MD5"
+    return "CRC32"
+
+
+def _verification_method(caps: Dict[str, Any], local: Dict[str, str]) -> Optional[tuple]:
+    if caps.get("hash", True):
+        offered = _hash_algorithms(caps)
+        for algorithm in ("SHA-256", "SHA-512", "SHA-1", "MD5", "CRC32"):
+            if algorithm in offered and algorithm in local:
+                return "HASH", algorithm
+    if "MD5" in local and "XMD5" in caps.get("features", ()) and caps.get("xmd5", True):
+        return "XMD5", "MD5"
+    # Many servers answer XCRC without listing it in FEAT; a 500 turns it off for the host
+    if caps.get("xcrc", True):
+        return "XCRC", "CRC32"
+    return None
+
+
+def _parse_remote_digest(resp: str, algorithm: str) -> Optional[str]:
+    # "213 SHA-256 0-1234 <hex> name" for HASH, "250 <hex>" or "213 <hex>" for XCRC/XMD5
+    want = _DIGEST_HEX_LENGTHS[algorithm]
+    for token in resp[4:].split():
+        if re.fullmatch(r"[0-9A-Fa-f]+", token) and (len(token) == want or (algorithm == "CRC32" and len(token) < want)):
+            return token.lower().zfill(want)
+    return None
+
+
+async def check_remote_digest(conn: PooledFTP, name: str, local: Dict[str, str]) -> Dict[str, Any]:
+    """Ask the server to hash `name` in the connection's directory and compare with what was sent.
+
+    `verified` is True or False when the server produced a hash, None when
+    it cannot hash files (or refused this one).
+    """
+    caps = await get_ftp_features(conn)
+    record: Dict[str, Any] = {"algorithm": None, "method": None, "local": local, "remote": None, "verified": None}
+    method = _verification_method(caps, local)
+    if method is None:
+        return record
+    command, algorithm = method
+    record.update(algorithm=algorithm, method=command)
+    try:
+        if command == "HASH":
+            await conn.ftp.voidcmd(f"OPTS HASH {algorithm}")
+            resp = await conn.ftp.sendcmd(f"HASH {name}")
+        else:
+            resp = await conn.ftp.sendcmd(f"{command} {name}")
+    except error_perm as e:
+        if e.args[0].startswith(("500", "502", "504")):
+            set_ftp_capability(conn.host_key, command.lower(), False)
+        record["error"] = str(e)
+        return record
+    remote = _parse_remote_digest(resp, algorithm)
+    record.update(remote=remote, verified=None if remote is None else remote == local[algorithm])
+    return record
+
+
+async def new_upload_digest(cfg: FTPConfig) -> UploadDigest:
+    """A digest for a single-stream upload, using the strongest hash the server can check."""
+    async with ftp_pool.connection(cfg) as conn:
+        return UploadDigest(upload_digest_algorithm(await get_ftp_features(conn)))
+
+
+async def verify_upload(cfg: FTPConfig, dest_dir: str, name: str, local: Dict[str, str],
+                        progress: "TransferProgress"):
+    """check_remote_digest() on a pooled session; the outcome goes into the transfer status."""
+    async with ftp_pool.connection(cfg) as conn:
+        await conn.chdir(dest_dir)
+        record = progress.verification = await check_remote_digest(conn, name, local)
+    if record["verified"] is False:
+        algorithm = record["algorithm"]
+        raise UploadVerificationError(f"{algorithm} mismatch for {name}: sent {local[algorithm]}, "
+                                      f"server has {record['remote']}")
+
+
+# -----------------------------
+# Segmented (multi-connection) FTP upload engine
+# -----------------------------
+FTP_MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+FTP_MAX_CONNECTIONS = int(os.environ.get("FTP_MAX_CONNECTIONS", 16))
+FTP_SEED_SIZE = 256 * 1024
+FTP_SEGMENT_RETRIES = 3
+FTP_PART_SUFFIX = ".easymesh-part"
+FTP_RESUME_MIN_SIZE = 10 * 1024 * 1024  # Smaller uploads are simply re-sent
+FTP_TUNE_INTERVAL = 0.5
+FTP_TUNE_SETTLE = 1.0  # Let a new connection count ramp up before measuring it
+FTP_TUNE_MEASURE = 2.0
+FTP_TUNE_PIECE_SECONDS = 2.0  # Target time to send one piece
+FTP_TUNE_MIN_PIECE = 2 * 1024 * 1024
+FTP_TUNE_MAX_PIECE = 64 * 1024 * 1024
+FTP_TUNE_MIN_BLOCK = 256 * 1024
+FTP_RESUME_TTL = float(os.environ.get("FTP_RESUME_TTL", 6 * 3600))
+
+
+class SharedFileSource:
+    """Random access to an uploaded (spooled) file without touching its file position.
+
+    Reads use os.pread where available and a read-only mmap otherwise
+    (Windows), so any number of transfers can read different ranges at once.
+    Offsets are positions in the remote file: a resumed upload only carries
+    the bytes from `base` on, and `size` is the full file size.
+    """
+
+    def __init__(self, file_obj, base: int = 0):
+        file_obj.flush()
+        # fileno() also rolls a SpooledTemporaryFile over to disk
+        self.fd = file_obj.fileno()
+        self.base = base
+        local_size = os.fstat(self.fd).st_size
+        self.size = base + local_size
+        self._mmap: Optional[mmap.mmap] = None
+        if not hasattr(os, "pread") and local_size:
+            self._mmap = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+    def read_at(self, offset: int, size: int):
+        offset -= self.base
+        if self._mmap is not None:
+            # Zero-copy slice; socket writes accept memoryviews directly
+            return memoryview(self._mmap)[offset:offset + size]
+        return os.pread(self.fd, size, offset)
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A failed transfer may still hold a slice; the mmap goes with the GC
+                pass
+            self._mmap = None
+
+
+class _SourceCursor:
+    """File-like view with a private position, handed to loop.sendfile().
+
+    loop.sendfile() seeks the file it is given (and reads it when it has to
+    fall back); this keeps both away from the shared upload file. Positions
+    are offsets in the local file, not the remote one.
+    """
+    mode = "rb"
+
+    def __init__(self, source: SharedFileSource, offset: int):
+        self.source = source
+        self.pos = offset
+
+    def fileno(self) -> int:
+        return self.source.fd
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        self.pos = pos
+        return pos
+
+    def readinto(self, buf) -> int:
+        data = self.source.read_at(self.source.base + self.pos, len(buf))
+        n = len(data)
+        buf[:n] = data
+        self.pos += n
+        return n
+
+
+class PositionalFileReader:
+    """Streams [start_pos, start_pos + chunk_size) of a SharedFileSource.
+
+    Each reader keeps its own offset, so readers for different ranges can run
+    concurrently without racing on a shared file position.
+    """
+
+    def __init__(self, source: SharedFileSource, start_pos: int, chunk_size: int, progress_tracker=None,
+                 blocksize: int = FTP_BLOCK_SIZE, digest: Optional[UploadDigest] = None):
+        self.source = source
+        self.start_pos = start_pos
+        self.end_pos = start_pos + chunk_size
+        self.current_pos = start_pos
+        self.progress_tracker = progress_tracker
+        self.blocksize = blocksize
+        self.digest = digest
+
+    async def send_to(self, writer: asyncio.StreamWriter, blocksize: Optional[int] = None):
+        """Send the range with loop.sendfile(): os.sendfile/TransmitFile where the
+        transport allows it, a buffered read+write on a worker thread otherwise.
+        One call per block so progress keeps moving."""
+        blocksize = blocksize or self.blocksize
+        if self.digest is not None:
+            await self._send_hashed(writer, min(blocksize, FTP_HASH_BLOCK_SIZE))
+            return
+        loop = asyncio.get_running_loop()
+        flow = self.progress_tracker.transfer_id if self.progress_tracker else None
+        while self.current_pos < self.end_pos:
+            count = await bandwidth.acquire(flow, min(blocksize, self.end_pos - self.current_pos))
+            local_pos = self.current_pos - self.source.base
+            sent = await loop.sendfile(writer.transport, _SourceCursor(self.source, local_pos), local_pos, count)
+            if sent <= 0:
+                raise Exception(f"sendfile made no progress at offset {self.current_pos}")
+            self.current_pos += sent
+            if self.progress_tracker:
+                self.progress_tracker.update(sent)
+
+    async def _send_hashed(self, writer: asyncio.StreamWriter, blocksize: int):
+        """Read, hash and write each block: the one pass over the bytes that verification needs.
+        pread and hashing both release the GIL, so pieces hash in parallel on worker threads."""
+        loop = asyncio.get_running_loop()
+        flow = self.progress_tracker.transfer_id if self.progress_tracker else None
+        while self.current_pos < self.end_pos:
+            count = await bandwidth.acquire(flow, min(blocksize, self.end_pos - self.current_pos))
+            data = await loop.run_in_executor(None, self.digest.read_at, self.source, self.current_pos, count)
+            if not data:
+                raise Exception(f"Short read at offset {self.current_pos}")
+            writer.write(data)
+            await writer.drain()
+            self.current_pos += len(data)
+            if self.progress_tracker:
+                self.progress_tracker.update(len(data))
+
+    @property
+    def bytes_read(self) -> int:
+        return self.current_pos - self.start_pos
+
+
+async def remote_file_size(cfg: FTPConfig, dest_dir: str, name: str) -> Optional[int]:
+    async with ftp_pool.connection(cfg) as conn:
+        await conn.chdir(dest_dir)
+        return await conn.ftp.size(name)
+
+
+async def commit_part_file(cfg: FTPConfig, dest_dir: str, part_name: str, dest_filename: str):
+    """Rename a fully uploaded part file over its final name."""
+    async with ftp_pool.connection(cfg) as conn:
+        await conn.chdir(dest_dir)
+        try:
+            await conn.ftp.rename(part_name, dest_filename)
+        except error_perm:
+            # Some servers refuse to rename over an existing file
+            await conn.ftp.delete(dest_filename)
+            await conn.ftp.rename(part_name, dest_filename)
+
+
+async def remove_remote_file_quietly(cfg: FTPConfig, dest_dir: str, name: str):
+    try:
+        async with ftp_pool.connection(cfg) as conn:
+            await conn.chdir(dest_dir)
+            await conn.ftp.delete(name)
+    except Exception:
+        pass
+
+
+class UploadVerificationError(Exception):
+    """The remote file does not match what was sent; it cannot be resumed."""
+
+
+class ResumableUpload:
+    """An unfinished upload whose part file was left on the server for a later request.
+
+    `sequential` part files hold exactly their first SIZE bytes; segmented
+    ones are pre-sized, so `committed` (the contiguous prefix of finished
+    pieces) is what can be trusted.
+    """
+
+    def __init__(self, transfer_id: str, cfg: FTPConfig, dest_dir: str, filename: str, size: Optional[int],
+                 sequential: bool, committed: int = 0):
+        self.transfer_id = transfer_id
+        self.cfg = cfg
+        self.dest_dir = dest_dir
+        self.filename = filename
+        self.part_name = f"{filename}{FTP_PART_SUFFIX}"
+        self.size = size
+        self.sequential = sequential
+        self.committed = committed
+        self.updated = time.monotonic()
+
+    def matches(self, cfg: FTPConfig, dest_dir: str, filename: str) -> bool:
+        return (FTPConnectionPool.key_for(cfg) == FTPConnectionPool.key_for(self.cfg)
+                and ftp_abs_path(cfg, dest_dir) == ftp_abs_path(self.cfg, self.dest_dir)
+                and filename == self.filename)
+
+    async def offset(self) -> int:
+        """Where the next request has to continue from."""
+        if not self.sequential:
+            return self.committed
+        try:
+            return await remote_file_size(self.cfg, self.dest_dir, self.part_name) or 0
+        except error_perm:
+            return 0
+
+
+class ResumableUploadRegistry:
+    """Unfinished uploads by transfer id; part files of expired entries are deleted."""
+
+    def __init__(self, ttl: float = FTP_RESUME_TTL):
+        self.ttl = ttl
+        self._uploads: Dict[str, ResumableUpload] = {}
+
+    def _prune(self):
+        now = time.monotonic()
+        for transfer_id, upload in list(self._uploads.items()):
+            if now - upload.updated > self.ttl:
+                del self._uploads[transfer_id]
+                asyncio.create_task(remove_remote_file_quietly(upload.cfg, upload.dest_dir, upload.part_name))
+
+    def get(self, transfer_id: str) -> Optional[ResumableUpload]:
+        self._prune()
+        return self._uploads.get(transfer_id)
+
+    def put(self, upload: ResumableUpload):
+        self._prune()
+        upload.updated = time.monotonic()
+        self._uploads[upload.transfer_id] = upload
+
+    def discard(self, transfer_id: str):
+        self._uploads.pop(transfer_id, None)
+
+
+resumable_uploads = ResumableUploadRegistry()
+
+
+async def resolve_resume(transfer_id: Optional[str], offset: int, cfg: FTPConfig, dest_dir: str,
+                         filename: str) -> tuple:
+    """Validate a request's transfer id and offset; returns (transfer_id, ResumableUpload or None).
+
+    Offset 0 starts over. A non-zero offset has to name a registered upload
+    of the same file and match where it stopped (409 tells the client where).
+    """
+    if transfer_id:
+        running = transfer_registry.get(transfer_id)
+        if running is not None and running.status in ("queued", "in_progress"):
+            raise HTTPException(status_code=409, detail="Transfer is still in progress")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="offset must not be negative")
+    if not offset:
+        if transfer_id:
+            resumable_uploads.discard(transfer_id)
+        return transfer_id or str(uuid.uuid4()), None
+    upload = resumable_uploads.get(transfer_id) if transfer_id else None
+    if upload is None or not upload.matches(cfg, dest_dir, filename):
+        raise HTTPException(status_code=404, detail="No resumable upload for this transfer_id")
+    expected = await upload.offset()
+    if offset != expected:
+        raise HTTPException(status_code=409, detail=f"Upload can only resume at offset {expected}",
+                            headers={"X-Resume-Offset": str(expected)})
+    return transfer_id, upload
+
+
+async def store_sequential(cfg: FTPConfig, dest_dir: str, name: str, source: SharedFileSource, start: int,
+                           progress: "TransferProgress", digest: Optional[UploadDigest] = None):
+    """STOR source[start:] into `name`; after a failure, continue from the remote SIZE.
+
+    Resumes with REST+STOR where the server advertises REST STREAM and APPE
+    otherwise, so a drop at 95% only re-sends the last 5%. `digest` ends up
+    covering exactly source[start:], however many attempts it took.
+    """
+    pos = start
+    retry_delay = 1
+    for attempt in range(FTP_SEGMENT_RETRIES):
+        progress.bytes_transferred = pos
+        reader = PositionalFileReader(source, pos, source.size - pos, progress, digest=digest)
+        try:
+            async with ftp_pool.connection(cfg) as conn:
+                await conn.chdir(dest_dir)
+                if not pos:
+                    await conn.ftp.stor(name, reader)
+                elif (await get_ftp_features(conn)).get("rest_stor"):
+                    await conn.ftp.stor(name, reader, pos)
+                else:
+                    await conn.ftp.appe(name, reader)
+            return
+        except Exception as e:
+            # A permanent (5xx) reply will not change on retry
+            if attempt == FTP_SEGMENT_RETRIES - 1 or isinstance(e, error_perm):
+                raise
+            logging.warning(f"Transfer attempt {attempt+1} failed at offset {reader.current_pos}: {str(e)}. "
+                            f"Retrying in {retry_delay} seconds...")
+            await asyncio.sleep(retry_delay)
+            retry_delay *= 2
+            try:
+                remote = await remote_file_size(cfg, dest_dir, name)
+            except error_perm:
+                remote = None
+            if remote is not None and start <= remote <= source.size:
+                pos = remote
+            elif start == 0:
+                pos = 0
+            else:
+                # The bytes before `start` are not in this request; nothing to resume from
+                raise
+            if digest is not None:
+                # The failed attempt may have hashed bytes that never reached the server
+                digest.reset()
+                await digest.absorb(source, start, pos)
+
+
+def _clamp_size(value: float, low: int, high: int, step: int) -> int:
+    return int(min(high, max(low, value // step * step)))
+
+
+class AdaptiveTuner:
+    """Picks the connection count, piece size and block size of one upload from measured throughput.
+
+    Starts from the server's learned profile (the best whole-transfer sample,
+    or two connections for a new server) and hill-climbs: each connection
+    count ramps up for a settle time and is then measured for a window. One
+    more connection is kept only if it buys at least 10% more throughput;
+    otherwise it steps back and tries one fewer, which is kept as long as
+    throughput stays within 5%. Failed attempts drop a connection straight
+    away. Pieces are sized to take about FTP_TUNE_PIECE_SECONDS at the
+    measured per-connection rate, send blocks and socket buffers about a
+    quarter of a second.
+
+    The window is FTP_TUNE_MEASURE (settling FTP_TUNE_SETTLE) for long
+    uploads and shrinks to an eighth of the expected duration of `size`
+    bytes, no less than FTP_TUNE_INTERVAL, so short uploads still get
+    measured. Whatever is measured, the whole transfer is also recorded as a
+    sample for the connection count it mostly ran at.
+    """
+
+    def __init__(self, profile: HostProfile, cap: int, size: int = 0):
+        self.profile = profile
+        self.cap = max(1, cap)
+        self.size = size
+        self.target = min(self.cap, profile.connections or profile.best_sample() or 2)
+        self.piece_size = profile.piece_size or FTP_MIN_SEGMENT_SIZE
+        self.block_size = profile.block_size or FTP_BLOCK_SIZE
+        self.rates: Dict[int, float] = {}
+        self.direction = 1
+        self.settled = False
+        self._tried_fewer = False
+        self._changed_at = time.monotonic()
+        self._mark: Optional[tuple] = None
+        self._errors = 0
+        self._first: Optional[tuple] = None
+        self._last_seen = self._changed_at
+        self._time_at: Dict[int, float] = {}
+        self.measure, self.settle = FTP_TUNE_MEASURE, FTP_TUNE_SETTLE
+        if profile.throughput:
+            self._scale_window(size / profile.throughput)
+
+    def _scale_window(self, expected_seconds: float):
+        self.measure = min(FTP_TUNE_MEASURE, max(FTP_TUNE_INTERVAL, expected_seconds / 8))
+        self.settle = FTP_TUNE_SETTLE * self.measure / FTP_TUNE_MEASURE
+
+    def _change(self, target: int):
+        self.target = target
+        self._changed_at = time.monotonic()
+        self._mark = None
+
+    def _resize(self, per_connection: float):
+        self.piece_size = _clamp_size(per_connection * FTP_TUNE_PIECE_SECONDS, FTP_TUNE_MIN_PIECE, FTP_TUNE_MAX_PIECE,
+                                      256 * 1024)
+        self.block_size = _clamp_size(per_connection / 4, FTP_TUNE_MIN_BLOCK, FTP_BLOCK_SIZE, 64 * 1024)
+
+    def observe(self, total_bytes: int, errors: int, spare: int):
+        """Called every FTP_TUNE_INTERVAL with the bytes sent so far and failed attempts."""
+        now = time.monotonic()
+        self._time_at[self.target] = self._time_at.get(self.target, 0.0) + now - self._last_seen
+        self._last_seen = now
+        if self._first is None:
+            self._first = (now, total_bytes)
+        elif self.size and total_bytes > self._first[1]:
+            rate = (total_bytes - self._first[1]) / (now - self._first[0])
+            self._scale_window(self.size / rate)
+        if errors > self._errors:
+            self._errors = errors
+            if self.target > 1:
+                self._change(self.target - 1)
+            self.settled = True
+            return
+        if now - self._changed_at < self.settle:
+            return
+        if self._mark is None:
+            self._mark = (now, total_bytes)
+            return
+        elapsed = now - self._mark[0]
+        if elapsed < self.measure:
+            return
+        rate = max(0, total_bytes - self._mark[1]) / elapsed
+        self._mark = (now, total_bytes)
+        n = self.target
+        self.rates[n] = rate if n not in self.rates else (rate + self.rates[n]) / 2
+        self._resize(self.rates[n] / n)
+        if self.settled:
+            return
+        previous = self.rates.get(n - self.direction)
+        if previous is None:
+            better = True
+        elif self.direction > 0:
+            better = self.rates[n] >= previous * 1.10
+        else:
+            better = self.rates[n] >= previous * 0.95
+        if better:
+            step = n + self.direction
+            if 1 <= step <= self.cap and (self.direction < 0 or spare > 0):
+                self._change(step)
+            else:
+                self.settled = True
+        else:
+            self._change(n - self.direction)
+            if self.direction > 0 and not self._tried_fewer and n - 1 > 1:
+                self.direction = -1
+                self._tried_fewer = True
+            else:
+                self.settled = True
+
+    def remember(self, nbytes: int, seconds: float):
+        """Store what was learned; `nbytes` took `seconds` over the whole upload."""
+        profile = self.profile
+        ran_at = max(self._time_at, key=self._time_at.get) if self._time_at else self.target
+        profile.record_sample(ran_at, nbytes, seconds)
+        if self.rates:
+            best = self.target if self.target in self.rates else max(self.rates, key=self.rates.get)
+            rate = self.rates[best]
+        else:
+            # Over before a window closed: go by the whole-transfer samples instead
+            best = profile.best_sample()
+            if best is None:
+                return
+            rate = profile.samples[best]
+            self._resize(rate / best)
+        profile.connections = best
+        profile.piece_size = self.piece_size
+        profile.block_size = self.block_size
+        profile.throughput = rate
+
+
+class SegmentedUpload:
+    """Uploads one file over several pooled connections into a single remote file.
+
+    Data goes to `<name>.easymesh-part`. A short seed STOR creates (and
+    truncates) it and a one-byte REST STOR at the last offset extends it to
+    full length. Then every connection STORs its pieces with REST offsets
+    directly into that file. The part file's SIZE is verified before it is
+    renamed into place.
+
+    Servers such as pyftpdlib refuse REST past EOF (554), so the tail probe
+    fails there. That is remembered as the host's `rest_past_eof` capability,
+    not as a lack of REST: the seed is kept and the rest of the file follows
+    it in order over one connection (REST at EOF is always accepted), and
+    later uploads to that host skip the probe. Only when the server ignores
+    REST on STOR altogether (the size does not match) is the file re-sent
+    from byte 0 and `rest_stor` cleared.
+
+    A failed upload leaves the part file in place and `resume_state()`
+    describes it, so a later request can continue at `resume_from` instead
+    of starting over. Only a part file that fails verification is deleted.
+
+    With `cfg.verify`, every piece is CRC32-hashed as it is sent and the
+    piece CRCs are combined into the file's, which the server then checks
+    (single-stream sends use the strongest hash the server offers). Resumed
+    uploads are not hashed: the earlier bytes are not in this request.
+    """
+
+    def __init__(self, cfg: FTPConfig, dest_dir: str, dest_filename: str, source: SharedFileSource,
+                 progress: "TransferProgress", connections: int, resume_from: int = 0,
+                 sequential: bool = False):
+        self.cfg = cfg
+        self.dest_dir = dest_dir
+        self.dest_filename = dest_filename
+        self.part_name = f"{dest_filename}{FTP_PART_SUFFIX}"
+        self.source = source
+        self.file_size = source.size
+        self.progress = progress
+        self.connections = max(1, connections)
+        self.resume_from = resume_from
+        self.sequential = sequential
+        self.segments = 0
+        self.retries = 0
+        self._done: Dict[int, int] = {}  # start -> length of pieces known to be on the server
+        self.verify = cfg.verify and not resume_from
+        self.algorithm = "CRC32"
+        self.digest: Optional[UploadDigest] = None  # Single-stream sends
+        self._crcs: Dict[int, tuple] = {}  # start -> (crc32, length) of pieces as sent
+
+    def resume_state(self, transfer_id: str) -> ResumableUpload:
+        committed = self.resume_from
+        while committed in self._done:
+            committed += self._done[committed]
+        return ResumableUpload(transfer_id, self.cfg, self.dest_dir, self.dest_filename, self.file_size,
+                               self.sequential, committed)
+
+    def _pieces(self, start: int) -> List[tuple]:
+        remaining = self.file_size - start
+        # A few pieces per connection so a slow connection does not hold up the tail
+        piece_size = max(FTP_MIN_SEGMENT_SIZE, -(-remaining // (self.connections * 4)))
+        return [(pos, min(piece_size, self.file_size - pos)) for pos in range(start, self.file_size, piece_size)]
+
+    async def _store(self, start: int, length: int, offset_rest: bool = True, blocksize: int = FTP_BLOCK_SIZE):
+        # Retry a piece on a fresh connection; its bytes are un-counted from progress first
+        retry_delay = 1
+        for attempt in range(FTP_SEGMENT_RETRIES):
+            digest = UploadDigest() if self.verify else None
+            reader = PositionalFileReader(self.source, start, length, self.progress, blocksize, digest)
+            try:
+                async with ftp_pool.connection(self.cfg) as conn:
+                    await conn.chdir(self.dest_dir)
+                    conn.ftp.data_buffer_size = blocksize
+                    try:
+                        await conn.ftp.stor(self.part_name, reader, start if offset_rest and start else None)
+                    finally:
+                        conn.ftp.data_buffer_size = FTP_BLOCK_SIZE
+                self._done[start] = length
+                if digest is not None:
+                    self._crcs[start] = (digest.crc, length)
+                return
+            except Exception as e:
+                self.progress.update(-reader.bytes_read)
+                self.retries += 1
+                # A permanent (5xx) reply will not change on retry
+                if attempt == FTP_SEGMENT_RETRIES - 1 or isinstance(e, error_perm):
+                    raise
+                logging.warning(f"Segment at {start} attempt {attempt+1} failed: {str(e)}. Retrying in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2
+
+    async def _upload_pieces(self, pieces: List[tuple]):
+        work = list(reversed(pieces))
+
+        async def worker():
+            while work:
+                start, length = work.pop()
+                await self._store(start, length)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(min(self.connections, len(pieces)))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _upload_adaptive(self, start: int):
+        """Like _upload_pieces, but pieces are cut as they are handed out and an
+        AdaptiveTuner decides how many workers run and how big the pieces are."""
+        host_key = (self.cfg.host, self.cfg.port)
+        tuner = AdaptiveTuner(ftp_host_profiles.setdefault(host_key, HostProfile()), self.connections,
+                              self.file_size - start)
+        next_pos = start
+        began = time.monotonic()
+
+        def take() -> Optional[tuple]:
+            nonlocal next_pos
+            remaining = self.file_size - next_pos
+            if remaining <= 0:
+                return None
+            # Shrink the last pieces so every connection finishes at about the same time
+            length = min(tuner.piece_size, max(FTP_TUNE_MIN_PIECE, -(-remaining // tuner.target)), remaining)
+            piece = (next_pos, length)
+            next_pos += length
+            self.segments += 1
+            return piece
+
+        async def worker(index: int):
+            # Workers above the current target stop after their piece
+            while index < tuner.target:
+                piece = take()
+                if piece is None:
+                    return
+                await self._store(*piece, blocksize=tuner.block_size)
+
+        workers: Dict[int, asyncio.Task] = {}
+        try:
+            while True:
+                if next_pos < self.file_size:
+                    for index in range(tuner.target):
+                        if index not in workers or workers[index].done():
+                            workers[index] = asyncio.create_task(worker(index))
+                running = [task for task in workers.values() if not task.done()]
+                for task in workers.values():
+                    if task.done() and task.exception() is not None:
+                        raise task.exception()
+                if not running:
+                    break
+                await asyncio.wait(running, timeout=FTP_TUNE_INTERVAL, return_when=asyncio.FIRST_EXCEPTION)
+                tuner.observe(self.progress.bytes_transferred, self.retries, ftp_pool.spare(self.cfg))
+        except BaseException:
+            for task in workers.values():
+                task.cancel()
+            await asyncio.gather(*workers.values(), return_exceptions=True)
+            raise
+        tuner.remember(self.file_size - start, time.monotonic() - began)
+        self.connections = tuner.target
+        logging.info(f"Auto-tuned upload to {self.cfg.host}: {tuner.target} connections, "
+                     f"{tuner.piece_size // 1024} KiB pieces, {tuner.block_size // 1024} KiB blocks")
+
+    async def _probe_tail(self, host_key: tuple) -> bool:
+        # Writing the last byte first also pre-sizes the file for the other pieces
+        try:
+            await self._store(self.file_size - 1, 1)
+        except error_perm as e:
+            logging.info(f"{self.cfg.host} refused REST past EOF ({e}); continuing over one connection")
+            set_ftp_capability(host_key, "rest_past_eof", False)
+            return False
+        self.progress.update(-1)
+        set_ftp_capability(host_key, "rest_past_eof", True)
+        return True
+
+    async def _send_in_order(self, start: int):
+        """Send source[start:] over one connection after what the part file already holds."""
+        self.sequential = True
+        digest = UploadDigest() if self.verify else None
+        await store_sequential(self.cfg, self.dest_dir, self.part_name, self.source, start, self.progress, digest)
+        self._done[start] = self.file_size - start
+        if digest is not None:
+            self._crcs[start] = (digest.crc, self.file_size - start)
+
+    async def _remote_size(self) -> Optional[int]:
+        return await remote_file_size(self.cfg, self.dest_dir, self.part_name)
+
+    async def _send_single(self, start: int = 0):
+        self.sequential = True
+        self.segments = 1
+        self.digest = UploadDigest(self.algorithm) if self.verify and not start else None
+        await store_sequential(self.cfg, self.dest_dir, self.part_name, self.source, start, self.progress,
+                               self.digest)
+
+    def _local_digests(self, mode: str) -> Optional[Dict[str, str]]:
+        if mode == "single":
+            return self.digest.digests() if self.digest is not None else None
+        crc, pos = 0, 0
+        while pos < self.file_size:
+            piece_crc, length = self._crcs[pos]
+            crc = crc32_combine(crc, piece_crc, length)
+            pos += length
+        return {"CRC32": f"{crc:08x}"}
+
+    async def run(self) -> Dict[str, Any]:
+        async with ftp_pool.connection(self.cfg) as conn:
+            await conn.chdir(self.dest_dir)
+            host_key = conn.host_key
+            caps = await get_ftp_features(conn)
+        self.algorithm = upload_digest_algorithm(caps)
+        try:
+            mode = "single"
+            start = self.resume_from
+            seed = min(self.file_size, FTP_SEED_SIZE)
+            if self.sequential:
+                await self._send_single(start)
+            elif start or (caps.get("rest_stor") and caps.get("rest_past_eof") is not False
+                           and self.connections > 1 and self.file_size > seed):
+                # A segmented part file is pre-sized, so it can only be continued piece by piece
+                if not caps.get("rest_stor"):
+                    raise UploadVerificationError(f"{self.cfg.host} cannot write at offset {start}; "
+                                                  "the upload has to start over")
+                if not start:
+                    # The seed STOR truncates, so a resumed upload must not repeat it
+                    await self._store(0, seed, offset_rest=False)
+                    start = seed
+                self.progress.bytes_transferred = start
+                if not await self._probe_tail(host_key):
+                    # Keep the seed (or resumed prefix) and append the rest in order
+                    mode = "sequential"
+                    self.segments = 1 if self.resume_from else 2
+                    await self._send_in_order(start)
+                else:
+                    mode = "rest"
+                    if self.cfg.auto_tune:
+                        self.segments = 1
+                        await self._upload_adaptive(start)
+                    else:
+                        pieces = self._pieces(start)
+                        self.segments = len(pieces) + 1
+                        began = time.monotonic()
+                        await self._upload_pieces(pieces)
+                        ftp_host_profiles.setdefault(host_key, HostProfile()).record_sample(
+                            min(self.connections, len(pieces)), self.file_size - start, time.monotonic() - began)
+                    size = await self._remote_size()
+                    if size != self.file_size:
+                        logging.warning(f"Segmented upload of {self.dest_filename} produced {size} of {self.file_size} bytes; "
+                                        f"{self.cfg.host} ignores REST on STOR, re-sending over one connection")
+                        mode = "single"
+                if mode == "single":
+                    set_ftp_capability(host_key, "rest_stor", False)
+                    if self.resume_from:
+                        # Earlier bytes are not in this request and may never have landed
+                        raise UploadVerificationError(f"{self.cfg.host} ignores REST on STOR; "
+                                                      "the upload has to start over")
+                    self._done.clear()
+                    await self._send_single()
+            else:
+                await self._send_single()
+            if mode in ("single", "sequential"):
+                size = await self._remote_size()
+                if size != self.file_size:
+                    raise UploadVerificationError(f"Remote size {size} does not match local size {self.file_size}")
+            local = self._local_digests(mode) if self.verify else None
+            if local is not None:
+                await verify_upload(self.cfg, self.dest_dir, self.part_name, local, self.progress)
+            await commit_part_file(self.cfg, self.dest_dir, self.part_name, self.dest_filename)
+        except UploadVerificationError:
+            await remove_remote_file_quietly(self.cfg, self.dest_dir, self.part_name)
+            raise
+        return {"mode": mode, "segments": self.segments, "connections": self.connections}
+
+
+class FTPUploadQuery(BaseModel):
+    config: FTPConfig
+    dest_dir: str = "/"
+    filename: Optional[str] = None
+
+
+def upload_connections(cfg: FTPConfig, connection_limit: Optional[int] = None) -> int:
+    """Connections an upload may open: what `cfg` asks for, bounded by the pool's per-host
+    cap and by `connection_limit`, the share of it one transfer may hold. Auto-tuning
+    finds its own count, so only the server-side limits apply."""
+    return min(FTP_MAX_CONNECTIONS if cfg.auto_tune else cfg.max_connections,
+               FTP_MAX_CONNECTIONS, ftp_pool.max_per_host, connection_limit or ftp_pool.max_per_host)
+
+
+async def upload_spooled_file(cfg: FTPConfig, dest_dir: str, dest_filename: str, source: SharedFileSource,
+                              progress: "TransferProgress", resume: Optional[ResumableUpload] = None,
+                              connection_limit: Optional[int] = None) -> Dict[str, Any]:
+    transfer_id = progress.transfer_id
+    file_size = source.size
+    max_connections = upload_connections(cfg, connection_limit)
+
+    if file_size < FTP_RESUME_MIN_SIZE and resume is None:
+        # Small files go over one connection; a failed attempt continues from whatever
+        # the server already has. They are staged under the part name as well, so a
+        # failed or cancelled upload never leaves a truncated file under the final name.
+        part_name = f"{dest_filename}{FTP_PART_SUFFIX}"
+        try:
+            digest = await new_upload_digest(cfg) if cfg.verify else None
+            await store_sequential(cfg, dest_dir, part_name, source, 0, progress, digest)
+            if digest is not None:
+                await verify_upload(cfg, dest_dir, part_name, digest.digests(), progress)
+            await commit_part_file(cfg, dest_dir, part_name, dest_filename)
+        except UploadVerificationError as e:
+            await remove_remote_file_quietly(cfg, dest_dir, part_name)
+            progress.fail(f"Upload failed: {str(e)}")
+            raise
+        except Exception as e:
+            # Small uploads are re-sent rather than resumed
+            await remove_remote_file_quietly(cfg, dest_dir, part_name)
+            progress.fail(f"Upload failed after {FTP_SEGMENT_RETRIES} attempts: {str(e)}")
+            raise
 
+        # Mark as complete
+        progress.complete()
+        listing_cache.invalidate(cfg, dest_dir)
 
-@api_router.post("/ftp/list")
-async def ftp_list(body: FTPPath):
-    def _list():
-        ftp = connect_ftp(body.config)
+        # Log successful transfer
+        logging.info(f"File transfer completed: {dest_filename}")
+
+        return {"ok": True, "path": f"{dest_dir}/{dest_filename}", "transfer_id": transfer_id,
+                "verification": progress.verification}
+
+    # Segments are written straight into one remote part file, which survives a
+    # failure so the client can resume by transfer_id
+    upload = SegmentedUpload(cfg, dest_dir, dest_filename, source, progress, max_connections,
+                             resume_from=source.base, sequential=resume.sequential if resume else False)
+    try:
+        result = await upload.run()
+    except BaseException as e:
+        if isinstance(e, UploadVerificationError):
+            resumable_uploads.discard(transfer_id)
+        else:
+            resumable_uploads.put(upload.resume_state(transfer_id))
+        progress.fail(f"Upload failed: {str(e)}")
+        raise
+    resumable_uploads.discard(transfer_id)
+    progress.complete()
+    listing_cache.invalidate(cfg, dest_dir)
+
+    # Log successful transfer
+    logging.info(f"File transfer completed: {dest_filename} ({result['mode']}, {result['segments']} segments"
+                 f"{f', resumed at {source.base}' if source.base else ''})")
+
+    return {
+        "ok": True,
+        "path": f"{dest_dir}/{dest_filename}",
+        "transfer_id": transfer_id,
+        "parallel": result["mode"] == "rest",
+        "chunks": result["segments"],
+        "connections": result["connections"],
+        "resumed_from": source.base,
+        "verification": progress.verification,
+    }
+
+
+# -----------------------------
+# Transfer jobs: queued uploads on a fixed set of workers
+# -----------------------------
+FTP_JOB_WORKERS = int(os.environ.get("FTP_JOB_WORKERS", 4))
+FTP_JOB_PER_HOST = int(os.environ.get("FTP_JOB_PER_HOST", 2))
+FTP_JOB_HISTORY = 200  # Finished jobs kept for /ftp/jobs
+
+
+class TransferJob:
+    """One queued upload; owns the spooled request file until the job ends."""
+
+    def __init__(self, transfer_id: str, cfg: FTPConfig, dest_dir: str, filename: str, spooled,
+                 source: SharedFileSource, resume: Optional[ResumableUpload], priority: int):
+        self.transfer_id = transfer_id
+        self.cfg = cfg
+        self.host_key = (cfg.host, cfg.port)
+        self.dest_dir = dest_dir
+        self.filename = filename
+        self.spooled = spooled
+        self.source = source
+        self.resume = resume
+        self.priority = priority
+        self.connections: Optional[int] = None  # What it may open once the queue's share is applied
+        self.status = "queued"  # queued, running, completed, failed, cancelled
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.exception: Optional[BaseException] = None
+        self.submitted_at = time.time()
+        self.task: Optional[asyncio.Task] = None
+        self.finished = asyncio.Event()
+
+    def release_file(self):
+        self.source.close()
+        try:
+            self.spooled.close()
+        except Exception:
+            pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "transfer_id": self.transfer_id,
+            "status": self.status,
+            "priority": self.priority,
+            "host": f"{self.cfg.host}:{self.cfg.port}",
+            "path": f"{self.dest_dir}/{self.filename}",
+            "size": self.source.size,
+            "connections": self.connections,
+            "requested_connections": None if self.cfg.auto_tune else self.cfg.max_connections,
+            "submitted_at": datetime.utcfromtimestamp(self.submitted_at).isoformat() + "Z",
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class TransferJobQueue:
+    """Runs transfer jobs on `workers` worker tasks, at most `per_host` at a time per FTP server.
+
+    Jobs start in priority order (higher first, FIFO within a priority). A
+    worker takes the first waiting job whose server still has room, so one
+    slow server cannot occupy every worker. Transfers that cannot be queued
+    (sync batches, streamed bodies) take the same per-host slots through
+    `host_slot`. Each transfer opens at most `connection_share()` sessions,
+    so `per_host` of them fit in `ftp_pool`'s per-host cap together instead
+    of timing out on acquire.
+    """
+
+    def __init__(self, workers: int = FTP_JOB_WORKERS, per_host: int = FTP_JOB_PER_HOST):
+        self.workers = max(1, workers)
+        self.per_host = max(1, min(per_host, ftp_pool.max_per_host))
+        self.cond = asyncio.Condition()
+        self._waiting: List[tuple] = []  # (-priority, seq, job), kept sorted
+        self._seq = 0
+        self._running: Dict[tuple, int] = {}
+        self._direct = 0  # Of the running transfers, those holding a slot through host_slot
+        self._tasks: List[asyncio.Task] = []
+        self.jobs: "OrderedDict[str, TransferJob]" = OrderedDict()
+
+    def start(self):
+        if not self._tasks:
+            # Bound to the running loop from here on
+            self.cond = asyncio.Condition()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        running = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in running + self._tasks:
+            task.cancel()
+        await asyncio.gather(*running, *self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in list(self.jobs.values()):
+            if job.status == "queued":
+                self._finish(job, "cancelled", error="Server shutting down")
+
+    async def submit(self, job: TransferJob) -> int:
+        """Queue a job; returns how many jobs are ahead of it."""
+        job.connections = upload_connections(job.cfg, self.connection_share())
+        async with self.cond:
+            self._seq += 1
+            bisect.insort(self._waiting, (-job.priority, self._seq, job))
+            self.jobs[job.transfer_id] = job
+            self._trim_history()
+            self.cond.notify_all()
+            return self.position(job)
+
+    def position(self, job: TransferJob) -> Optional[int]:
+        for i, (_, _, waiting) in enumerate(self._waiting):
+            if waiting is job:
+                return i
+        return None
+
+    def _trim_history(self):
+        finished = [tid for tid, job in self.jobs.items() if job.finished.is_set()]
+        for tid in finished[:max(0, len(finished) - FTP_JOB_HISTORY)]:
+            del self.jobs[tid]
+
+    def connection_share(self) -> int:
+        """FTP sessions one transfer may hold while `per_host` transfers run on its server."""
+        return max(1, ftp_pool.max_per_host // self.per_host)
+
+    @contextlib.asynccontextmanager
+    async def host_slot(self, cfg: FTPConfig):
+        """Hold one of the server's `per_host` slots for a transfer that runs outside the queue."""
+        host_key = (cfg.host, cfg.port)
+        async with self.cond:
+            while self._running.get(host_key, 0) >= self.per_host:
+                await self.cond.wait()
+            self._running[host_key] = self._running.get(host_key, 0) + 1
+            self._direct += 1
         try:
-            ftp.cwd(body.path)
-            lines: List[str] = []
-            ftp.retrlines('LIST', lines.append)
-            return {"entries": lines}
+            yield self.connection_share()
         finally:
+            async with self.cond:
+                self._running[host_key] -= 1
+                self._direct -= 1
+                self.cond.notify_all()
+
+    async def _next_job(self) -> TransferJob:
+        async with self.cond:
+            while True:
+                for i, (_, _, job) in enumerate(self._waiting):
+                    if self._running.get(job.host_key, 0) < self.per_host:
+                        del self._waiting[i]
+                        self._running[job.host_key] = self._running.get(job.host_key, 0) + 1
+                        return job
+                await self.cond.wait()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
             try:
-                ftp.quit()
-            except Exception:
-                pass
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _list)
+                job.task = asyncio.create_task(self._run(job))
+                await asyncio.wait([job.task])
+            finally:
+                async with self.cond:
+                    self._running[job.host_key] -= 1
+                    self.cond.notify_all()
 
+    async def _run(self, job: TransferJob):
+        job.status = "running"
+        progress = transfer_registry.get(job.transfer_id)
+        if progress is not None:
+            progress.start()
+        try:
+            result = await upload_spooled_file(job.cfg, job.dest_dir, job.filename, job.source, progress, job.resume,
+                                               connection_limit=self.connection_share())
+        except asyncio.CancelledError:
+            # A cancelled job is abandoned, not paused: drop its part file too
+            resumable_uploads.discard(job.transfer_id)
+            await remove_remote_file_quietly(job.cfg, job.dest_dir, f"{job.filename}{FTP_PART_SUFFIX}")
+            self._finish(job, "cancelled", error="Cancelled by client")
+        except Exception as e:
+            logging.error(f"File transfer error: {str(e)}")
+            job.exception = e
+            self._finish(job, "failed", error=e.detail if isinstance(e, HTTPException) else str(e))
+        else:
+            self._finish(job, "completed", result=result)
 
-class FTPUploadQuery(BaseModel):
-    config: FTPConfig
-    dest_dir: str = "/"
-    filename: Optional[str] = None
+    def _finish(self, job: TransferJob, status: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[str] = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        progress = transfer_registry.get(job.transfer_id)
+        if progress is not None and status == "cancelled":
+            progress.cancel(error)
+        job.release_file()
+        job.finished.set()
 
+    async def cancel(self, transfer_id: str) -> Optional[TransferJob]:
+        job = self.jobs.get(transfer_id)
+        if job is None:
+            return None
+        async with self.cond:
+            if job.status == "queued":
+                self._waiting = [item for item in self._waiting if item[2] is not job]
+                self._finish(job, "cancelled", error="Cancelled by client")
+                return job
+        if job.status == "running" and job.task is not None:
+            job.task.cancel()
+            await job.finished.wait()
+        return job
 
-@api_router.post("/ftp/upload")
-async def ftp_upload(config: str, dest_dir: str = "/", file: UploadFile = File(...), filename: Optional[str] = None, background_tasks: BackgroundTasks = None):
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "per_host": self.per_host,
+            "queued": len(self._waiting),
+            "running": sum(self._running.values()),
+            "direct": self._direct,
+            "connections_per_transfer": self.connection_share(),
+            "running_per_host": {f"{h}:{p}": n for (h, p), n in self._running.items() if n > 0},
+        }
+
+
+transfer_jobs = TransferJobQueue()
+
+
+@app.on_event("startup")
+async def _start_transfer_jobs():
+    transfer_jobs.start()
+
+
+@app.on_event("shutdown")
+async def _stop_transfer_jobs():
+    await transfer_jobs.stop()
+
+
+async def _submit_upload(config: str, dest_dir: str, file: UploadFile, filename: Optional[str],
+                         transfer_id: Optional[str], offset: int, priority: int) -> tuple:
     # config is JSON string due to multipart; parse
     try:
         cfg_dict = json.loads(config)
@@ -321,304 +4230,1002 @@ async def ftp_upload(config: str, dest_dir: str = "/", file: UploadFile = File(.
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid config: {e}")
 
-    # Create a custom buffered reader for efficient file reading
-    class BufferedFileReader:
-        def __init__(self, file_obj, buffer_size=8*1024*1024, progress_tracker=None):
-            self.file_obj = file_obj
-            self.buffer_size = buffer_size
-            self.progress_tracker = progress_tracker
-            
-        def read(self, size=None):
-            # If size is None or larger than buffer_size, use buffer_size
-            chunk_size = min(size, self.buffer_size) if size is not None else self.buffer_size
-            data = self.file_obj.read(chunk_size)
-            if data and self.progress_tracker:
-                self.progress_tracker.update(len(data))
-            return data
-
-    # Function to split file into chunks for parallel upload
-    async def split_file_for_parallel_upload(file_obj, chunk_size, num_chunks):
-        # Save original position
-        original_position = file_obj.tell()
-        
-        # Get file size
-        file_obj.seek(0, 2)  # Seek to end
-        file_size = file_obj.tell()
-        file_obj.seek(original_position)  # Restore position
-        
-        chunks = []
-        chunk_positions = []
-        
-        # Calculate optimal chunk size based on file size and desired number of chunks
-        actual_chunk_size = max(chunk_size, file_size // num_chunks)
-        
-        # Create chunks
-        for i in range(0, file_size, actual_chunk_size):
-            end_pos = min(i + actual_chunk_size, file_size)
-            chunk_positions.append((i, end_pos - i))
-        
-        return file_size, chunk_positions
-
-    # Function to upload a single chunk
-    async def upload_chunk(ftp_config, dest_dir, file_obj, chunk_start, chunk_size, dest_filename, chunk_index, progress_tracker):
-        try:
-            # Connect to FTP for this chunk
-            ftp = connect_ftp(ftp_config)
-            
-            # Set socket optimizations
-            buffer_size = 8 * 1024 * 1024
-            ftp.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
-            ftp.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
-            ftp.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            ftp.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            ftp.sock.settimeout(60)
-            
-            # Navigate to destination directory
-            ftp.cwd(dest_dir)
-            
-            # Memory-optimized approach: stream directly from file without loading entire chunk into memory
-            class ChunkedFileReader:
-                def __init__(self, file_obj, start_pos, chunk_size, progress_tracker=None):
-                    self.file_obj = file_obj
-                    self.start_pos = start_pos
-                    self.end_pos = start_pos + chunk_size
-                    self.current_pos = start_pos
-                    self.progress_tracker = progress_tracker
-                    # Position file at start
-                    self.file_obj.seek(self.start_pos)
-                
-                def read(self, size=None):
-                    # Calculate how much we can read
-                    remaining = self.end_pos - self.current_pos
-                    if remaining <= 0:
-                        return b''
-                    
-                    # Determine read size (don't exceed chunk boundary)
-                    read_size = min(size or remaining, remaining)
-                    
-                    # Read data
-                    data = self.file_obj.read(read_size)
-                    
-                    # Update position and progress
-                    self.current_pos += len(data)
-                    if data and self.progress_tracker:
-                        self.progress_tracker.update(len(data))
-                    
-                    return data
-            
-            # Create memory-efficient reader that streams directly from file
-            chunked_reader = ChunkedFileReader(file_obj, chunk_start, chunk_size, progress_tracker)
-            
-            # For multi-chunk uploads, use temporary filenames for all but the last chunk
-            temp_filename = f"{dest_filename}.part{chunk_index}"
-            
-            # Upload the chunk with optimized buffer size
-            ftp.storbinary(f"STOR {temp_filename}", chunked_reader, blocksize=buffer_size)
-            
-            return {
-                "chunk_index": chunk_index,
-                "temp_filename": temp_filename,
-                "chunk_size": chunk_size
-            }
+    # Determine filename
+    dest_filename = filename or file.filename
+    if not dest_filename:
+        raise HTTPException(status_code=400, detail="Missing filename")
+
+    transfer_id, resume = await resolve_resume(transfer_id, offset, cfg, dest_dir, dest_filename)
+    if priority:
+        bandwidth.configure(transfer_id, priority=priority)
+
+    # Positional access to the spooled upload; also gives the size for progress tracking
+    source = SharedFileSource(file.file, base=offset)
+    if resume is not None and resume.size is not None and source.size != resume.size:
+        source.close()
+        raise HTTPException(status_code=400,
+                            detail=f"Resumed file would be {source.size} bytes, expected {resume.size}")
+
+    # The job outlives this request: take the spooled file so the form cleanup does not close it
+    spooled, file.file = file.file, io.BytesIO()
+    job = TransferJob(transfer_id, cfg, dest_dir, dest_filename, spooled, source, resume, priority)
+
+    # Create progress tracker
+    progress = TransferProgress(source.size, transfer_id, host=f"{cfg.host}:{cfg.port}", offset=offset)
+    progress.status = "queued"
+    transfer_registry.register(progress)
+
+    position = await transfer_jobs.submit(job)
+    return job, position
+
+
+@api_router.post("/ftp/upload")
+async def ftp_upload(config: str, dest_dir: str = "/", file: UploadFile = File(...), filename: Optional[str] = None,
+                     transfer_id: Optional[str] = None, offset: int = 0, priority: int = 0):
+    """Upload a multipart file to the FTP server and wait for the transfer to finish.
+
+    The transfer runs as a job like /ftp/jobs does, with the same cap on
+    connections. To continue a failed
+    upload, send the same `transfer_id` with `offset` from
+    /ftp/upload-resume/{transfer_id} and only the bytes from that offset on
+    as `file`.
+    """
+    job, _ = await _submit_upload(config, dest_dir, file, filename, transfer_id, offset, priority)
+    await job.finished.wait()
+    if isinstance(job.exception, HTTPException):
+        raise job.exception
+    if job.status != "completed":
+        raise HTTPException(status_code=500, detail=f"Upload failed: {job.error}",
+                            headers={"X-Transfer-Id": job.transfer_id})
+    return job.result
+
+
+@api_router.post("/ftp/jobs", status_code=202)
+async def submit_ftp_job(config: str, dest_dir: str = "/", file: UploadFile = File(...), filename: Optional[str] = None,
+                         transfer_id: Optional[str] = None, offset: int = 0, priority: int = 0):
+    """Queue an upload and return at once; follow it with /ftp/transfer-status or /ftp/jobs/{id}.
+
+    A job opens at most FTP_POOL_MAX_PER_HOST // FTP_JOB_PER_HOST connections,
+    whatever `max_connections` asks for, so the jobs sharing a server fit in
+    its pool. `connections` in the reply and in the job status is the count
+    it will use.
+    """
+    job, position = await _submit_upload(config, dest_dir, file, filename, transfer_id, offset, priority)
+    return {"transfer_id": job.transfer_id, "status": job.status, "position": position,
+            "connections": job.connections}
+
+
+@api_router.get("/ftp/jobs")
+async def list_ftp_jobs():
+    """Queued, running and recently finished jobs"""
+    return {"jobs": [job.describe() for job in transfer_jobs.jobs.values()], "stats": transfer_jobs.stats()}
+
+
+@api_router.get("/ftp/jobs/{transfer_id}")
+async def get_ftp_job(transfer_id: str):
+    job = transfer_jobs.jobs.get(transfer_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {**job.describe(), "position": transfer_jobs.position(job)}
+
+
+@api_router.delete("/ftp/jobs/{transfer_id}")
+async def cancel_ftp_job(transfer_id: str):
+    """Cancel a queued or running job; a running transfer is aborted and its part file removed."""
+    job = transfer_jobs.jobs.get(transfer_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.finished.is_set():
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    await transfer_jobs.cancel(transfer_id)
+    return job.describe()
+
+
+@api_router.get("/ftp/upload-resume/{transfer_id}")
+async def get_upload_resume(transfer_id: str):
+    """Where an unfinished upload can be continued from."""
+    upload = resumable_uploads.get(transfer_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="No resumable upload for this transfer_id")
+    return {
+        "transfer_id": transfer_id,
+        "dest_dir": upload.dest_dir,
+        "filename": upload.filename,
+        "size": upload.size,
+        "offset": await upload.offset(),
+    }
+
+
+# -----------------------------
+# Batch uploads: sync many files into a remote tree
+# -----------------------------
+FTP_SYNC_CONNECTIONS = int(os.environ.get("FTP_SYNC_CONNECTIONS", 4))
+FTP_SYNC_MAX_FILES = int(os.environ.get("FTP_SYNC_MAX_FILES", 10000))
+FTP_SYNC_MTIME_SLACK = 2.0  # FAT and some servers only keep even seconds
+
+
+class SyncFileEntry(BaseModel):
+    path: str  # Relative to dest_dir, "/"-separated
+    size: int = Field(..., ge=0)
+    mtime: Optional[float] = None  # Local modification time, Unix seconds
+
+
+class FTPSyncPlanRequest(BaseModel):
+    config: FTPConfig
+    dest_dir: str = "/"
+    files: List[SyncFileEntry]
+    skip_unchanged: bool = True
+
+
+def sync_relative_path(path: str) -> str:
+    """Normalise a manifest path; it has to stay inside the destination directory."""
+    rel = posixpath.normpath(path.replace("\\", "/").lstrip("/"))
+    if rel in ("", ".", "..") or rel.startswith("../"):
+        raise HTTPException(status_code=400, detail=f"Invalid path in manifest: {path!r}")
+    return rel
+
+
+def _mlsd_time(mtime: Optional[str]) -> Optional[float]:
+    # Only MLSD times are exact UTC ("...Z"); LIST times are local and often rounded to the minute
+    if not mtime or not mtime.endswith("Z"):
+        return None
+    return datetime.strptime(mtime, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+
+
+class SyncPlan:
+    """What a sync has to do: files to send, files already on the server, directories to create."""
+
+    def __init__(self):
+        self.upload: List[SyncFileEntry] = []
+        self.skip: List[SyncFileEntry] = []
+        self.create_dirs: List[str] = []  # Relative to dest_dir, parents first
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "upload": [entry.path for entry in self.upload],
+            "skip": [entry.path for entry in self.skip],
+            "create_dirs": self.create_dirs,
+            "upload_bytes": sum(entry.size for entry in self.upload),
+        }
+
+
+async def _unchanged(conn: PooledFTP, entry: SyncFileEntry, remote: Optional[Dict[str, Any]]) -> bool:
+    """Same size, and the remote copy is at least as new as the local file."""
+    if remote is None or remote["type"] != "file" or remote["size"] != entry.size:
+        return False
+    if entry.mtime is None:
+        return True
+    remote_mtime = _mlsd_time(remote["mtime"])
+    if remote_mtime is None and ftp_host_caps.get(conn.host_key, {}).get("mdtm", True):
+        try:
+            remote_mtime = await conn.ftp.mdtm(remote["name"])
+        except error_perm as e:
+            if e.args[0].startswith(("500", "502")):
+                set_ftp_capability(conn.host_key, "mdtm", False)
+    return remote_mtime is not None and remote_mtime + FTP_SYNC_MTIME_SLACK >= entry.mtime
+
+
+async def plan_sync(cfg: FTPConfig, dest_dir: str, entries: List[SyncFileEntry], skip_unchanged: bool = True,
+                    connections: int = FTP_SYNC_CONNECTIONS) -> SyncPlan:
+    """Compare a manifest with the remote tree using one listing per directory.
+
+    Directories are scanned concurrently over up to `connections` pooled
+    sessions. With MLSD, size and modification time come from the listing;
+    otherwise MDTM is only sent for files whose size already matches.
+    """
+    by_dir: Dict[str, List[SyncFileEntry]] = {}
+    for entry in entries:
+        by_dir.setdefault(posixpath.dirname(entry.path), []).append(entry)
+    plan = SyncPlan()
+    existing, missing = set(), set()
+    limit = asyncio.Semaphore(max(1, connections))
+
+    async def scan(rel_dir: str, files: List[SyncFileEntry]):
+        remote_dir = posixpath.join(dest_dir, rel_dir)
+        async with limit, ftp_pool.connection(cfg) as conn:
+            try:
+                await conn.chdir(remote_dir)
+            except error_perm:
+                missing.add(rel_dir)
+                plan.upload.extend(files)
+                return
+            existing.add(rel_dir)
+            if not skip_unchanged:
+                plan.upload.extend(files)
+                return
+            async with contextlib.aclosing(iter_directory(conn)) as listing:
+                listed = [item async for item in listing]
+            listing_cache.put(ListingCache.key_for(cfg, remote_dir), listed)
+            by_name = {item["name"]: item for item in listed}
+            for entry in files:
+                unchanged = await _unchanged(conn, entry, by_name.get(posixpath.basename(entry.path)))
+                (plan.skip if unchanged else plan.upload).append(entry)
+
+    await asyncio.gather(*(scan(rel_dir, files) for rel_dir, files in by_dir.items()))
+
+    # Missing directories and whichever of their parents are not known to exist
+    for rel_dir in list(existing):
+        while rel_dir:
+            rel_dir = posixpath.dirname(rel_dir)
+            existing.add(rel_dir)
+    needed = set()
+    for rel_dir in missing:
+        while rel_dir not in existing and rel_dir not in needed:
+            needed.add(rel_dir)
+            if not rel_dir:
+                break
+            rel_dir = posixpath.dirname(rel_dir)
+    plan.create_dirs = sorted(needed, key=lambda d: (d.count("/") + bool(d), d))
+    plan.upload.sort(key=lambda entry: entry.path)
+    plan.skip.sort(key=lambda entry: entry.path)
+    return plan
+
+
+class SyncUpload:
+    """Sends the files of a SyncPlan over a few long-lived sessions.
+
+    Each worker holds one pooled session for the whole batch and takes the
+    next file from a shared queue, so small files go out back to back with
+    just a data connection (and a CWD when the directory changes) per file.
+    The queue is sorted by path, which keeps workers in one directory for
+    long runs. A dropped session is replaced and its file sent again.
+    """
+
+    def __init__(self, cfg: FTPConfig, dest_dir: str, plan: SyncPlan, sources: Dict[str, SharedFileSource],
+                 progress: TransferProgress, connections: int = FTP_SYNC_CONNECTIONS):
+        self.cfg = cfg
+        self.dest_dir = dest_dir
+        self.plan = plan
+        self.sources = sources
+        self.progress = progress
+        self.connections = max(1, connections)
+        self._queue: deque = deque(plan.upload)
+        self._attempts: Dict[str, int] = {}
+        self.uploaded: List[str] = []
+        self.failed: Dict[str, str] = {}
+        self.created_dirs: List[str] = []
+        self.algorithm: Optional[str] = None  # Set when files are hashed and checked (cfg.verify)
+        self.verified = 0
+        self.unverified = 0
+
+    async def _make_dirs(self):
+        if not self.plan.create_dirs:
+            return
+        async with ftp_pool.connection(self.cfg) as conn:
+            for rel_dir in self.plan.create_dirs:
+                try:
+                    await conn.ftp.mkd(posixpath.normpath(posixpath.join(conn.home, self.dest_dir, rel_dir)))
+                    self.created_dirs.append(rel_dir)
+                except error_perm:
+                    # Already there, or not allowed; the files inside will report the latter
+                    pass
+
+    async def _send(self, conn: PooledFTP, entry: SyncFileEntry):
+        name = posixpath.basename(entry.path)
+        digest = UploadDigest(self.algorithm) if self.algorithm else None
+        reader = PositionalFileReader(self.sources[entry.path], 0, entry.size, self.progress, digest=digest)
+        record = None
+        try:
+            await conn.chdir(posixpath.join(self.dest_dir, posixpath.dirname(entry.path)))
+            await conn.ftp.stor(name, reader)
+            if digest is not None:
+                record = await check_remote_digest(conn, name, digest.digests())
+                if record["verified"] is False:
+                    await conn.ftp.delete(name)
+        except error_perm as e:
+            # Refused by the server; the session is fine for the next file
+            self.progress.bytes_transferred -= reader.bytes_read
+            self.failed[entry.path] = str(e)
+            return
         except Exception as e:
-            if progress_tracker:
-                progress_tracker.fail(f"Chunk {chunk_index} failed: {str(e)}")
+            self.progress.bytes_transferred -= reader.bytes_read
+            attempts = self._attempts[entry.path] = self._attempts.get(entry.path, 0) + 1
+            if attempts < FTP_SEGMENT_RETRIES:
+                self._queue.appendleft(entry)
+            else:
+                self.failed[entry.path] = str(e)
             raise
+        if record is not None:
+            if record["verified"] is False:
+                algorithm = record["algorithm"]
+                self.failed[entry.path] = (f"{algorithm} mismatch: sent {record['local'][algorithm]}, "
+                                           f"server has {record['remote']}")
+                return
+            if record["verified"]:
+                self.verified += 1
+            else:
+                self.unverified += 1
+        self.uploaded.append(entry.path)
+
+    async def _worker(self):
+        retry_delay = 1
+        while self._queue:
+            try:
+                async with ftp_pool.connection(self.cfg) as conn:
+                    while self._queue:
+                        await self._send(conn, self._queue.popleft())
+                        retry_delay = 1
+            except HTTPException as e:
+                # No session to be had (login refused, pool exhausted); the other workers see the same
+                while self._queue:
+                    self.failed[self._queue.popleft().path] = e.detail
+            except Exception as e:
+                logging.warning(f"Sync session failed: {str(e)}. Reconnecting in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2
+
+    async def run(self) -> Dict[str, Any]:
+        if self.cfg.verify and self._queue:
+            self.algorithm = (await new_upload_digest(self.cfg)).algorithm
+        await self._make_dirs()
+        workers = min(self.connections, len(self._queue))
+        try:
+            await asyncio.gather(*(self._worker() for _ in range(workers)))
+        finally:
+            changed = {posixpath.dirname(path) for path in self.uploaded}
+            changed.update(posixpath.dirname(rel_dir) for rel_dir in self.created_dirs if rel_dir)
+            for rel_dir in changed:
+                listing_cache.invalidate(self.cfg, posixpath.join(self.dest_dir, rel_dir))
+        if self.algorithm:
+            self.progress.verification = {"algorithm": self.algorithm, "verified": self.verified,
+                                          "unverified": self.unverified}
+        return {
+            "uploaded": self.uploaded,
+            "skipped": [entry.path for entry in self.plan.skip],
+            "failed": self.failed,
+            "created_dirs": self.created_dirs,
+            "connections": workers,
+            "verification": self.progress.verification,
+        }
+
+
+@api_router.post("/ftp/sync/plan")
+async def ftp_sync_plan(body: FTPSyncPlanRequest):
+    """What /ftp/sync would do with a manifest, so a client only needs to send the changed files."""
+    entries = [entry.model_copy(update={"path": sync_relative_path(entry.path)}) for entry in body.files]
+    if len({entry.path for entry in entries}) != len(entries):
+        raise HTTPException(status_code=400, detail="Duplicate paths in manifest")
+    plan = await plan_sync(body.config, body.dest_dir, entries, body.skip_unchanged)
+    return plan.as_dict()
+
+
+@api_router.post("/ftp/sync")
+async def ftp_sync(request: Request, config: str, dest_dir: str = "/", skip_unchanged: bool = True,
+                   connections: int = FTP_SYNC_CONNECTIONS, transfer_id: Optional[str] = None):
+    """Upload many files in one multipart request, skipping the ones the server already has.
+
+    Each `files` part is one file whose filename is its path relative to
+    `dest_dir`; missing subdirectories are created. An optional `manifest`
+    field, a JSON list of {"path", "mtime"}, gives local modification times
+    (Unix seconds); without it files are compared by size only. Progress of
+    the whole batch is reported under `transfer_id`.
+    """
+    try:
+        cfg = FTPConfig(**json.loads(config))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid config: {e}")
+    transfer_id = transfer_id or str(uuid.uuid4())
+    connections = max(1, min(connections, ftp_pool.max_per_host))
+
+    async with request.form(max_files=FTP_SYNC_MAX_FILES, max_fields=FTP_SYNC_MAX_FILES + 16) as form:
+        try:
+            mtimes = {sync_relative_path(item["path"]): item.get("mtime")
+                      for item in json.loads(form.get("manifest") or "[]")}
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid manifest: {e}")
+        sources: Dict[str, SharedFileSource] = {}
+        try:
+            for part in form.getlist("files"):
+                if isinstance(part, str):
+                    continue
+                path = sync_relative_path(part.filename or "")
+                if path in sources:
+                    raise HTTPException(status_code=400, detail=f"Duplicate path: {path}")
+                sources[path] = SharedFileSource(part.file)
+            if not sources:
+                raise HTTPException(status_code=400, detail="No files to sync")
+
+            entries = [SyncFileEntry(path=path, size=source.size, mtime=mtimes.get(path))
+                       for path, source in sources.items()]
+            # A batch counts as one of the server's transfers, like a queued job
+            async with transfer_jobs.host_slot(cfg) as share:
+                connections = min(connections, share)
+                plan = await plan_sync(cfg, dest_dir, entries, skip_unchanged, connections)
+                progress = TransferProgress(sum(entry.size for entry in plan.upload), transfer_id,
+                                            host=f"{cfg.host}:{cfg.port}")
+                transfer_registry.register(progress)
+                sync = SyncUpload(cfg, dest_dir, plan, sources, progress, connections)
+                try:
+                    result = await sync.run()
+                except BaseException as e:
+                    progress.fail(f"Sync failed: {str(e)}")
+                    raise
         finally:
+            for source in sources.values():
+                source.close()
+
+    if sync.failed:
+        progress.fail(f"{len(sync.failed)} of {len(plan.upload)} files failed")
+    else:
+        progress.complete()
+    logging.info(f"Sync to {dest_dir} finished: {len(sync.uploaded)} uploaded, {len(plan.skip)} skipped, "
+                 f"{len(sync.failed)} failed")
+    return {"ok": not sync.failed, "transfer_id": transfer_id, "dest_dir": dest_dir,
+            "bytes": progress.bytes_transferred, **result}
+
+
+# -----------------------------
+# FTP download: streaming response, HTTP Range, optional parallel ranges
+# -----------------------------
+FTP_DOWNLOAD_PIECE_SIZE = int(os.environ.get("FTP_DOWNLOAD_PIECE_SIZE", 4 * 1024 * 1024))
+
+
+def parse_http_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """Parse a single `bytes=` range into (start, end_exclusive).
+
+    Returns None when the header is absent or not something we serve (multiple
+    ranges), in which case the whole file is sent; raises 416 when the range
+    cannot be satisfied.
+    """
+    if not header:
+        return None
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) + 1 if m.group(2) else size
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(m.group(2)))
+        end = size
+    end = min(end, size)
+    if start >= size or start >= end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+class OrderedRangeFetcher:
+    """Fetches [start, end) of a remote file over several pooled connections, in order.
+
+    The range is cut into pieces handed out in file order; each connection
+    RETRs its piece with REST and aborts at the piece end. Finished pieces
+    wait in a reorder buffer that never holds more than `window` pieces past
+    the one the client is waiting for, so memory stays bounded however far
+    ahead the fast connections get.
+    """
+
+    def __init__(self, cfg: FTPConfig, remote_dir: str, name: str, start: int, end: int, file_size: int,
+                 connections: int, piece_size: int = FTP_DOWNLOAD_PIECE_SIZE, window: Optional[int] = None):
+        self.cfg = cfg
+        self.remote_dir = remote_dir
+        self.name = name
+        self.file_size = file_size
+        self.pieces = [(pos, min(piece_size, end - pos)) for pos in range(start, end, piece_size)]
+        self.connections = max(1, min(connections, len(self.pieces)))
+        self.window = window or self.connections * 2
+        self._cond = asyncio.Condition()
+        self._buffer: Dict[int, bytes] = {}
+        self._next_dispatch = 0
+        self._next_emit = 0
+        self._error: Optional[BaseException] = None
+
+    async def _fetch(self, start: int, length: int) -> bytes:
+        retry_delay = 1
+        for attempt in range(FTP_SEGMENT_RETRIES):
+            buf = bytearray()
             try:
-                ftp.quit()
-            except Exception:
-                pass
+                async with ftp_pool.connection(self.cfg) as conn:
+                    await conn.chdir(self.remote_dir)
+                    # Pieces that end at EOF finish normally instead of needing an ABOR
+                    limit = None if start + length >= self.file_size else length
+                    async with contextlib.aclosing(conn.ftp.iter_retr(self.name, start, limit)) as blocks:
+                        async for block in blocks:
+                            buf += block
+                if len(buf) != length:
+                    raise Exception(f"Short read at {start}: {len(buf)} of {length} bytes")
+                return bytes(buf)
+            except Exception as e:
+                if attempt == FTP_SEGMENT_RETRIES - 1 or isinstance(e, error_perm):
+                    raise
+                logging.warning(f"Download piece at {start} attempt {attempt+1} failed: {str(e)}. Retrying in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2
 
-    # Function to merge chunks on the FTP server (if needed)
-    async def merge_chunks(ftp_config, dest_dir, dest_filename, chunk_info, progress_tracker):
+    async def _worker(self):
         try:
-            # If only one chunk, just rename it
-            if len(chunk_info) == 1 and chunk_info[0]["temp_filename"] != dest_filename:
-                ftp = connect_ftp(ftp_config)
-                ftp.cwd(dest_dir)
-                ftp.rename(chunk_info[0]["temp_filename"], dest_filename)
-                ftp.quit()
-                return
-                
-            # For multiple chunks, we'd need server-side commands to concatenate
-            # This is typically not available in standard FTP, so we'd need to
-            # implement a different strategy for multi-part uploads
-            
-            # Mark as complete
-            if progress_tracker:
-                progress_tracker.complete()
-                
+            while True:
+                async with self._cond:
+                    while (self._next_dispatch < len(self.pieces)
+                           and self._next_dispatch >= self._next_emit + self.window):
+                        await self._cond.wait()
+                    if self._next_dispatch >= len(self.pieces):
+                        return
+                    index = self._next_dispatch
+                    self._next_dispatch += 1
+                data = await self._fetch(*self.pieces[index])
+                async with self._cond:
+                    self._buffer[index] = data
+                    self._cond.notify_all()
         except Exception as e:
-            if progress_tracker:
-                progress_tracker.fail(f"Merge failed: {str(e)}")
+            async with self._cond:
+                self._error = self._error or e
+                self._cond.notify_all()
+
+    async def iter_blocks(self) -> AsyncIterator[bytes]:
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.connections)]
+        try:
+            for index in range(len(self.pieces)):
+                async with self._cond:
+                    while index not in self._buffer and self._error is None:
+                        await self._cond.wait()
+                    if index not in self._buffer:
+                        raise self._error
+                    data = self._buffer.pop(index)
+                    self._next_emit = index + 1
+                    self._cond.notify_all()
+                yield data
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def _paced(block: bytes, progress: "TransferProgress") -> AsyncIterator[bytes]:
+    """Hand a downloaded block to the client in bandwidth-scheduler grants."""
+    view = memoryview(block)
+    while view:
+        n = await bandwidth.acquire(progress.transfer_id, len(view))
+        progress.update(n)
+        yield block if n == len(block) else bytes(view[:n])
+        view = view[n:]
+
+
+async def _iter_download(cfg: FTPConfig, remote_dir: str, name: str, start: int, end: int, file_size: int,
+                         connections: int, progress: "TransferProgress") -> AsyncIterator[bytes]:
+    try:
+        if connections > 1 and end - start > FTP_DOWNLOAD_PIECE_SIZE:
+            fetcher = OrderedRangeFetcher(cfg, remote_dir, name, start, end, file_size, connections)
+            async with contextlib.aclosing(fetcher.iter_blocks()) as blocks:
+                async for block in blocks:
+                    async for chunk in _paced(block, progress):
+                        yield chunk
+        else:
+            async with ftp_pool.connection(cfg) as conn:
+                await conn.chdir(remote_dir)
+                limit = None if end >= file_size else end - start
+                async with contextlib.aclosing(conn.ftp.iter_retr(name, start, limit)) as blocks:
+                    async for block in blocks:
+                        async for chunk in _paced(block, progress):
+                            yield chunk
+        progress.complete()
+        logging.info(f"File download completed: {name}")
+    except BaseException as e:
+        if isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+            progress.fail("Download cancelled by client")
+        else:
+            progress.fail(f"Download failed: {str(e)}")
+            logging.error(f"File download error: {str(e)}")
+        raise
+
+
+@api_router.get("/ftp/download")
+async def ftp_download(request: Request, config: str, path: str, connections: int = 1):
+    """Stream a remote file to the client, honouring a single HTTP Range.
+
+    With `connections` > 1 large ranges are fetched in parallel over pooled
+    connections and reassembled in order. The transfer id is returned in the
+    X-Transfer-Id header for /ftp/transfer-status.
+    """
+    try:
+        cfg = FTPConfig(**json.loads(config))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid config: {e}")
+    remote_dir, name = posixpath.split(path)
+    if not name:
+        raise HTTPException(status_code=400, detail="path must name a file")
+    remote_dir = remote_dir or "."
+
+    try:
+        file_size = await remote_file_size(cfg, remote_dir, name)
+    except error_perm as e:
+        raise HTTPException(status_code=404, detail=f"Remote file not available: {e}")
+    if file_size is None:
+        raise HTTPException(status_code=502, detail="Server did not report the file size")
+
+    byte_range = parse_http_range(request.headers.get("range"), file_size)
+    start, end = byte_range or (0, file_size)
+    connections = max(1, min(connections, FTP_MAX_CONNECTIONS, ftp_pool.max_per_host))
+
+    transfer_id = str(uuid.uuid4())
+    progress = TransferProgress(end - start, transfer_id, host=f"{cfg.host}:{cfg.port}")
+    transfer_registry.register(progress)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start),
+        "Content-Disposition": f"attachment; filename*=UTF-8''{urllib.parse.quote(name)}",
+        "X-Transfer-Id": transfer_id,
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{file_size}"
+    return StreamingResponse(
+        _iter_download(cfg, remote_dir, name, start, end, file_size, connections, progress),
+        status_code=206 if byte_range else 200,
+        media_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+        headers=headers,
+    )
+
+
+# -----------------------------
+# Streaming upload: request body -> ring buffer -> STOR
+# -----------------------------
+FTP_STREAM_BUFFER_SIZE = int(os.environ.get("FTP_STREAM_BUFFER_SIZE", 8 * 1024 * 1024))
+FTP_STREAM_BUFFER_MAX = int(os.environ.get("FTP_STREAM_BUFFER_MAX", 64 * 1024 * 1024))
+
+
+class StreamRingBuffer:
+    """Fixed-capacity byte ring between the request body and the STOR data connection.
+
+    `write` waits while the ring is full, so the request body stops being read
+    and TCP flow control pushes back on the browser; memory use never exceeds
+    `capacity`. Both sides run on the event loop.
+    """
+
+    def __init__(self, capacity: int, progress_tracker=None):
+        self._buf = bytearray(capacity)
+        self._capacity = capacity
+        self._start = 0
+        self._size = 0
+        self._eof = False
+        self._error: Optional[BaseException] = None
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self.progress_tracker = progress_tracker
+        self.bytes_in = 0
+        self.digest: Optional[UploadDigest] = None  # Hashes what goes out when set
+
+    def _put(self, view: memoryview) -> int:
+        n = min(len(view), self._capacity - self._size)
+        end = (self._start + self._size) % self._capacity
+        first = min(n, self._capacity - end)
+        self._buf[end:end + first] = view[:first]
+        if n > first:
+            self._buf[:n - first] = view[first:n]
+        self._size += n
+        return n
+
+    async def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            if self._error is not None:
+                raise self._error
+            n = self._put(view)
+            if n:
+                self._readable.set()
+            self.bytes_in += n
+            view = view[n:]
+            if view:
+                self._writable.clear()
+                await self._writable.wait()
+
+    async def read(self, size: Optional[int] = None) -> bytes:
+        while self._size == 0 and not self._eof and self._error is None:
+            self._readable.clear()
+            await self._readable.wait()
+        if self._error is not None:
+            raise self._error
+        if self._size == 0:
+            return b''
+        n = min(size or self._size, self._size)
+        first = min(n, self._capacity - self._start)
+        data = bytes(self._buf[self._start:self._start + first])
+        if n > first:
+            data += bytes(self._buf[:n - first])
+        self._start = (self._start + n) % self._capacity
+        self._size -= n
+        self._writable.set()
+        if self.progress_tracker:
+            self.progress_tracker.update(len(data))
+        return data
+
+    async def send_to(self, writer: asyncio.StreamWriter, blocksize: int = 1024 * 1024):
+        flow = self.progress_tracker.transfer_id if self.progress_tracker else None
+        while True:
+            data = await self.read(bandwidth.burst_for(flow, blocksize))
+            if not data:
+                return
+            await bandwidth.acquire(flow, len(data), partial=False)
+            if self.digest is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.digest.update, data)
+            writer.write(data)
+            await writer.drain()
+
+    def close(self):
+        self._eof = True
+        self._readable.set()
+
+    def abort(self, error: BaseException):
+        if self._error is None:
+            self._error = error
+        self._readable.set()
+        self._writable.set()
+
+
+@api_router.post("/ftp/upload-stream")
+async def ftp_upload_stream(request: Request, config: str, filename: str, dest_dir: str = "/", buffer_size: Optional[int] = None,
+                            transfer_id: Optional[str] = None, offset: int = 0):
+    """Upload the raw request body (application/octet-stream) while it is still arriving.
+
+    Nothing is spooled to disk: the body is piped through a ring buffer of
+    `buffer_size` bytes (default FTP_STREAM_BUFFER_SIZE, capped at
+    FTP_STREAM_BUFFER_MAX) into a single STOR. If the stream breaks, the
+    part file is kept; send the rest of the body with the same
+    `transfer_id` and the `offset` from /ftp/upload-resume/{transfer_id}.
+    """
+    try:
+        cfg = FTPConfig(**json.loads(config))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid config: {e}")
+    capacity = min(max(buffer_size or FTP_STREAM_BUFFER_SIZE, 64 * 1024), FTP_STREAM_BUFFER_MAX)
+    try:
+        expected_size = int(request.headers.get("content-length", ""))
+    except ValueError:
+        expected_size = None
+
+    transfer_id, resume = await resolve_resume(transfer_id, offset, cfg, dest_dir, filename)
+    total_size = offset + expected_size if expected_size is not None else None
+    if resume is not None and resume.size is not None and total_size not in (None, resume.size):
+        raise HTTPException(status_code=400, detail=f"Resumed file would be {total_size} bytes, expected {resume.size}")
+
+    progress = TransferProgress(total_size or 0, transfer_id, host=f"{cfg.host}:{cfg.port}", offset=offset)
+    transfer_registry.register(progress)
+
+    ring = StreamRingBuffer(capacity, progress)
+    if cfg.verify and not offset:
+        ring.digest = await new_upload_digest(cfg)
+    part_name = f"{filename}{FTP_PART_SUFFIX}"
+
+    async def _send():
+        try:
+            async with ftp_pool.connection(cfg) as conn:
+                await conn.chdir(dest_dir)
+                if not offset:
+                    await conn.ftp.stor(part_name, ring)
+                elif (await get_ftp_features(conn)).get("rest_stor"):
+                    await conn.ftp.stor(part_name, ring, offset)
+                else:
+                    await conn.ftp.appe(part_name, ring)
+        except BaseException as e:
+            ring.abort(e)
             raise
 
-    async def _upload_parallel():
-        try:
-            # Generate a unique transfer ID
-            transfer_id = str(uuid.uuid4())
-            
-            # Get file size for progress tracking
-            file.file.seek(0, 2)  # Seek to end
-            file_size = file.file.tell()
-            file.file.seek(0)  # Reset to beginning
-            
-            # Create progress tracker
-            progress = TransferProgress(file_size, transfer_id)
-            active_transfers[transfer_id] = progress
-            
-            # Determine filename
-            dest_filename = filename or file.filename
-            if not dest_filename:
-                raise Exception("Missing filename")
-            
-            # Determine optimal number of chunks based on file size and max connections
-            max_connections = min(cfg.max_connections, 3)  # Limit to 3 connections max
-            
-            # For small files, use single connection
-            if file_size < 10 * 1024 * 1024:  # Less than 10MB
-                max_connections = 1
-            
-            # Split file into chunks
-            _, chunk_positions = await split_file_for_parallel_upload(
-                file.file, 
-                8 * 1024 * 1024,  # 8MB minimum chunk size
-                max_connections
-            )
-            
-            # Reset file position
-            file.file.seek(0)
-            
-            # Upload chunks in parallel
-            chunk_results = []
-            if max_connections == 1:
-                # Single connection mode - simpler and more efficient for smaller files
-                # Implement retry mechanism for single connection
-                max_retries = 3
-                retry_delay = 2  # seconds
-                
-                for attempt in range(max_retries):
-                    try:
-                        ftp = connect_ftp(cfg)
-                        try:
-                            # Set socket optimizations
-                            buffer_size = 8 * 1024 * 1024
-                            ftp.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
-                            ftp.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
-                            ftp.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                            ftp.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                            ftp.sock.settimeout(60)
-                            
-                            # Navigate to destination directory
-                            ftp.cwd(dest_dir)
-                            
-                            # Create memory-efficient reader with progress tracking
-                            chunked_reader = ChunkedFileReader(file.file, 0, file_size, progress)
-                            
-                            # Upload directly
-                            ftp.storbinary(f"STOR {dest_filename}", chunked_reader, blocksize=buffer_size)
-                            
-                            # Mark as complete
-                            progress.complete()
-                            
-                            # Log successful transfer
-                            logging.info(f"File transfer completed: {dest_filename}")
-                            
-                            return {"ok": True, "path": f"{dest_dir}/{dest_filename}", "transfer_id": transfer_id}
-                        finally:
-                            try:
-                                ftp.quit()
-                            except Exception:
-                                pass
-                    except Exception as e:
-                        if attempt < max_retries - 1:
-                            # Log retry attempt
-                            logging.warning(f"Transfer attempt {attempt+1} failed: {str(e)}. Retrying in {retry_delay} seconds...")
-                            # Reset file position for retry
-                            file.file.seek(0)
-                            # Wait before retry
-                            await asyncio.sleep(retry_delay)
-                            # Increase delay for next retry (exponential backoff)
-                            retry_delay *= 2
-                        else:
-                            # Last attempt failed
-                            progress.fail(f"Upload failed after {max_retries} attempts: {str(e)}")
-                            raise
+    # The stream counts as one of the server's transfers, like a queued job; it holds one session
+    async with transfer_jobs.host_slot(cfg):
+        sender = asyncio.create_task(_send())
+        try:
+            try:
+                async for chunk in request.stream():
+                    if chunk:
+                        await ring.write(chunk)
+            except BaseException as e:
+                ring.abort(e)
+                raise
+            ring.close()
+            await sender
+            if expected_size is not None and ring.bytes_in != expected_size:
+                raise Exception(f"Received {ring.bytes_in} of {expected_size} bytes")
+            size = await remote_file_size(cfg, dest_dir, part_name)
+            if size != offset + ring.bytes_in:
+                raise UploadVerificationError(f"Remote size {size} does not match received size {offset + ring.bytes_in}")
+            if ring.digest is not None:
+                await verify_upload(cfg, dest_dir, part_name, ring.digest.digests(), progress)
+            await commit_part_file(cfg, dest_dir, part_name, filename)
+        except BaseException as e:
+            sender.cancel()
+            await asyncio.wait([sender])
+            if not sender.cancelled():
+                sender.exception()
+            if isinstance(e, UploadVerificationError):
+                resumable_uploads.discard(transfer_id)
+                await remove_remote_file_quietly(cfg, dest_dir, part_name)
             else:
-                # Multi-connection mode for larger files with retry mechanism
-                max_chunk_retries = 3
-                
-                # Execute uploads in parallel with retries for each chunk
-                with concurrent.futures.ThreadPoolExecutor(max_workers=max_connections) as executor:
-                    loop = asyncio.get_event_loop()
-                    
-                    # Function to handle chunk upload with retries
-                    async def upload_chunk_with_retry(chunk_index, start_pos, chunk_size):
-                        retry_delay = 1
-                        for attempt in range(max_chunk_retries):
-                            try:
-                                return await upload_chunk(
-                                    cfg, dest_dir, file.file, start_pos, chunk_size, 
-                                    dest_filename, chunk_index, progress
-                                )
-                            except Exception as e:
-                                if attempt < max_chunk_retries - 1:
-                                    logging.warning(f"Chunk {chunk_index} upload attempt {attempt+1} failed: {str(e)}. Retrying in {retry_delay} seconds...")
-                                    await asyncio.sleep(retry_delay)
-                                    retry_delay *= 2
-                                else:
-                                    logging.error(f"Chunk {chunk_index} failed after {max_chunk_retries} attempts: {str(e)}")
-                                    raise
-                    
-                    # Create tasks with retry mechanism
-                    futures = []
-                    for i, (start, size) in enumerate(chunk_positions):
-                        task = upload_chunk_with_retry(i, start, size)
-                        futures.append(loop.run_in_executor(executor, lambda t=task: asyncio.run(t)))
-                    
-                    chunk_results = await asyncio.gather(*futures, return_exceptions=True)
-                
-                # Check for errors
-                errors = [r for r in chunk_results if isinstance(r, Exception)]
-                if errors:
-                    progress.fail(f"Upload failed: {errors[0]}")
-                    raise errors[0]
-                
-                # Merge chunks if needed
-                await merge_chunks(cfg, dest_dir, dest_filename, chunk_results, progress)
-                
-                # Log successful transfer
-                logging.info(f"File transfer completed: {dest_filename}")
-                
-                return {
-                    "ok": True, 
-                    "path": f"{dest_dir}/{dest_filename}", 
-                    "transfer_id": transfer_id,
-                    "parallel": True,
-                    "chunks": len(chunk_positions)
-                }
-        except Exception as e:
-            logging.error(f"File transfer error: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
-    
-    # Start the upload process
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(None, lambda: asyncio.run(_upload_parallel()))
-    
-    return result
+                # Whatever reached the part file is kept for a resumed request
+                resumable_uploads.put(ResumableUpload(transfer_id, cfg, dest_dir, filename,
+                                                      resume.size if resume else total_size, sequential=True))
+            progress.fail(f"Upload failed: {str(e)}")
+            logging.error(f"Streaming transfer error: {str(e)}")
+            if isinstance(e, Exception) and not isinstance(e, HTTPException):
+                raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}",
+                                    headers={"X-Transfer-Id": transfer_id})
+            raise
+
+    resumable_uploads.discard(transfer_id)
+    progress.file_size = offset + ring.bytes_in
+    progress.complete()
+    listing_cache.invalidate(cfg, dest_dir)
+    logging.info(f"File transfer completed: {filename} (streamed{f', resumed at {offset}' if offset else ''})")
+    return {"ok": True, "path": f"{dest_dir}/{filename}", "transfer_id": transfer_id, "streamed": True,
+            "bytes": ring.bytes_in, "resumed_from": offset, "verification": progress.verification}
 
 
 @api_router.get("/ftp/transfer-status/{transfer_id}")
 async def get_transfer_status(transfer_id: str):
-    """Get the status of an active file transfer"""
-    if transfer_id not in active_transfers:
+    """Get the status of an active or recently finished file transfer"""
+    progress = transfer_registry.get(transfer_id)
+    if progress is None:
         raise HTTPException(status_code=404, detail="Transfer not found")
-    
-    progress = active_transfers[transfer_id]
+
     return progress.get_progress()
 
 
+@api_router.get("/ftp/transfer-stats")
+async def get_transfer_stats():
+    """Live/stalled counts and recent throughput percentiles per FTP host"""
+    return transfer_registry.host_summary()
+
+
+# -----------------------------
+# Progress push: one sampler, Server-Sent Events to any number of clients
+# -----------------------------
+FTP_PROGRESS_INTERVAL = float(os.environ.get("FTP_PROGRESS_INTERVAL", 0.25))
+FTP_PROGRESS_EWMA_ALPHA = 0.3
+FTP_PROGRESS_KEEPALIVE = 15.0
+_PROGRESS_TERMINAL = ("completed", "failed", "cancelled")
+
+
+class ProgressHub:
+    """Samples transfer progress on one timer and fans changes out to subscribers.
+
+    Every tick computes instantaneous and moving-average speed and an ETA
+    for transfers that are still going. Subscribers only ever see the
+    latest sample: one that is slow to read simply skips the ticks it
+    missed, so a fast transfer cannot build a backlog for a slow client.
+    The timer only runs while someone is subscribed. A transfer's samples
+    are dropped when the registry expires it, whether or not anyone is
+    listening, and subscribers drop their own state for it on their next
+    pass.
+    """
+
+    def __init__(self, interval: float = FTP_PROGRESS_INTERVAL):
+        self.interval = interval
+        self.subscribers = 0
+        self._samples: Dict[str, Dict[str, Any]] = {}
+        self._versions: Dict[str, int] = {}
+        self._rates: Dict[str, tuple] = {}  # transfer_id -> (bytes, monotonic time, instant, ewma)
+        self._version = 0
+        self._tick: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _sample(self):
+        now = time.monotonic()
+        records = transfer_registry.records()
+        for progress in records:
+            transfer_id = progress.transfer_id
+            last = self._samples.get(transfer_id)
+            if last is not None and last["status"] in _PROGRESS_TERMINAL and progress.status == last["status"]:
+                continue
+            done = progress.bytes_transferred
+            rate = self._rates.get(transfer_id)
+            if rate is None:
+                instant, ewma = 0.0, None
+                self._rates[transfer_id] = (done, now, instant, ewma)
+            elif now - rate[1] >= self.interval / 2:
+                # Extra samples taken when someone subscribes keep the previous rates
+                prev_bytes, prev_time, _, ewma = rate
+                instant = max(0.0, (done - prev_bytes) / (now - prev_time))
+                ewma = instant if ewma is None else FTP_PROGRESS_EWMA_ALPHA * instant + (1 - FTP_PROGRESS_EWMA_ALPHA) * ewma
+                self._rates[transfer_id] = (done, now, instant, ewma)
+            else:
+                _, _, instant, ewma = rate
+            snapshot = progress.get_progress()
+            remaining = progress.file_size - done
+            snapshot.update({
+                "speed_instant_bytes_per_sec": round(instant, 2),
+                "speed_avg_bytes_per_sec": round(ewma or 0.0, 2),
+                "eta_seconds": round(remaining / ewma, 1) if ewma and remaining > 0 and progress.status == "in_progress" else None,
+            })
+            del snapshot["elapsed_seconds"]  # Changes every tick; clients can derive it
+            if snapshot != last:
+                self._version += 1
+                self._samples[transfer_id] = snapshot
+                self._versions[transfer_id] = self._version
+
+    def forget(self, transfer_id: str):
+        self._samples.pop(transfer_id, None)
+        self._versions.pop(transfer_id, None)
+        self._rates.pop(transfer_id, None)
+
+    async def _run(self):
+        try:
+            while self.subscribers:
+                self._sample()
+                tick, self._tick = self._tick, asyncio.Event()
+                if tick is not None:
+                    tick.set()
+                await asyncio.sleep(self.interval)
+        finally:
+            self._task = None
+
+    async def _wait_tick(self, timeout: float) -> bool:
+        if self._tick is None:
+            self._tick = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._tick.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def subscribe(self, transfer_ids: Optional[set] = None) -> AsyncIterator[Optional[List[Dict[str, Any]]]]:
+        """Yield lists of per-transfer deltas; None means nothing changed for a while (keepalive).
+
+        Each delta has `transfer_id` plus the fields that changed since this
+        subscriber's previous message. With explicit ids the stream ends once
+        all of them have finished.
+        """
+        self.subscribers += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        sent: Dict[str, Dict[str, Any]] = {}
+        seen: Dict[str, int] = {}
+        try:
+            self._sample()
+            while True:
+                deltas = []
+                for transfer_id, version in list(self._versions.items()):
+                    if (transfer_ids is not None and transfer_id not in transfer_ids) or seen.get(transfer_id) == version:
+                        continue
+                    seen[transfer_id] = version
+                    snapshot = self._samples[transfer_id]
+                    previous = sent.get(transfer_id, {})
+                    delta = {k: v for k, v in snapshot.items() if k not in previous or previous[k] != v}
+                    delta["transfer_id"] = transfer_id
+                    sent[transfer_id] = snapshot
+                    deltas.append(delta)
+                if len(seen) > len(self._versions):
+                    # Transfers the registry has expired since
+                    for transfer_id in [t for t in seen if t not in self._versions]:
+                        del seen[transfer_id], sent[transfer_id]
+                if deltas:
+                    yield deltas
+                if transfer_ids is not None and all(
+                        sent.get(t, {}).get("status") in _PROGRESS_TERMINAL or transfer_registry.get(t) is None
+                        for t in transfer_ids):
+                    return
+                if not await self._wait_tick(FTP_PROGRESS_KEEPALIVE):
+                    yield None
+        finally:
+            self.subscribers -= 1
+
+
+progress_hub = ProgressHub()
+transfer_registry.on_expire(progress_hub.forget)
+
+
+@api_router.get("/ftp/progress-stream")
+async def ftp_progress_stream(ids: Optional[str] = None):
+    """Server-Sent Events with progress deltas for the comma-separated transfer `ids` (all transfers if omitted).
+
+    Each `progress` event carries a JSON list of {"transfer_id", ...changed fields};
+    the first event for a transfer has every field.
+    """
+    transfer_ids = {t for t in ids.split(",") if t} if ids else None
+
+    async def events() -> AsyncIterator[bytes]:
+        yield f"retry: {int(FTP_PROGRESS_KEEPALIVE * 1000)}\n\n".encode()
+        async with contextlib.aclosing(progress_hub.subscribe(transfer_ids)) as updates:
+            async for deltas in updates:
+                if deltas is None:
+                    yield b": keepalive\n\n"
+                else:
+                    yield f"event: progress\ndata: {json.dumps(deltas, separators=(',', ':'))}\n\n".encode()
+        yield b"event: end\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # -----------------------------
 # Host info for LAN QR generation
 # -----------------------------
@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+
+import pytest
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+# Tests import the app module the way uvicorn does, from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+class SparseRestHandler(FTPHandler):
+    """Allows REST past the end of the file on STOR, as vsftpd and ProFTPD do."""
+
+    def ftp_STOR(self, file, mode="w"):
+        rest = self._restart_position
+        if rest:
+            if not os.path.exists(file):
+                open(file, "wb").close()
+            if rest > os.path.getsize(file):
+                with open(file, "r+b") as f:
+                    f.truncate(rest)
+        return super().ftp_STOR(file, mode)
+
+
+class FTPServerInfo:
+    def __init__(self, port: int, root):
+        self.port = port
+        self.root = root
+
+    def config(self, **overrides) -> server.FTPConfig:
+        return server.FTPConfig(**{"host": "127.0.0.1", "port": self.port, "user": "u", "password": "p", **overrides})
+
+
+def serve_ftp(root, handler=FTPHandler):
+    """Start a threaded pyftpdlib server on a free port; returns (server, thread, port)."""
+    authorizer = DummyAuthorizer()
+    authorizer.add_user("u", "p", str(root), perm="elradfmwMT")
+    handler = type("Handler", (handler,), {"authorizer": authorizer})
+    ftpd = ThreadedFTPServer(("127.0.0.1", 0), handler)
+    ftpd.max_cons = 256
+    thread = threading.Thread(target=ftpd.serve_forever, kwargs={"timeout": 0.1}, daemon=True)
+    thread.start()
+    return ftpd, thread, ftpd.address[1]
+
+
+@pytest.fixture(autouse=True)
+def fresh_ftp_pool(monkeypatch):
+    # Pooled sessions belong to the event loop that opened them; each test runs its own
+    monkeypatch.setattr(server, "ftp_pool", server.FTPConnectionPool())
+
+
+def _ftp_server(tmp_path, handler):
+    root = tmp_path / "ftp"
+    root.mkdir()
+    ftpd, thread, port = serve_ftp(root, handler)
+    yield FTPServerInfo(port, root)
+    ftpd.close_all()
+    thread.join(5)
+
+
+@pytest.fixture
+def ftp_server(tmp_path):
+    """Stock pyftpdlib: refuses REST past EOF, like many small servers."""
+    yield from _ftp_server(tmp_path, FTPHandler)
+
+
+@pytest.fixture
+def sparse_ftp_server(tmp_path):
+    """pyftpdlib that extends files on REST past EOF, so segmented uploads run in parallel."""
+    yield from _ftp_server(tmp_path, SparseRestHandler)
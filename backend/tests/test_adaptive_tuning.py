@@ -0,0 +1,70 @@
+"""Auto-tuned uploads: the tuner's hill climb and what host profiles remember."""
+import pytest
+
+import server
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+
+def _run(tuner, clock, rate_at, rounds=200, errors=lambda tick: 0):
+    """Feed the tuner what `rate_at(connections)` bytes/s would send; returns bytes sent."""
+    sent = 0.0
+    for tick in range(rounds):
+        clock.now += server.FTP_TUNE_INTERVAL
+        sent += rate_at(tuner.target) * server.FTP_TUNE_INTERVAL
+        tuner.observe(int(sent), errors(tick), spare=8)
+        if tuner.settled:
+            break
+    return int(sent)
+
+
+def test_tuner_climbs_to_where_more_connections_stop_paying(clock):
+    profile = server.HostProfile()
+    tuner = server.AdaptiveTuner(profile, cap=8)
+    assert tuner.target == 2  # New server
+    mb = 1024 * 1024
+    sent = _run(tuner, clock, lambda n: min(n, 4) * 10 * mb)
+    assert tuner.settled and tuner.target == 4
+    # 10 MB/s per connection: pieces take about FTP_TUNE_PIECE_SECONDS, blocks a quarter second
+    assert tuner.piece_size == 10 * mb * server.FTP_TUNE_PIECE_SECONDS
+    assert tuner.block_size == 10 * mb // 4
+
+    tuner.remember(sent, 20.0)
+    assert (profile.connections, profile.piece_size, profile.block_size) == (4, tuner.piece_size, tuner.block_size)
+    assert profile.throughput == pytest.approx(40 * mb)
+    assert server.AdaptiveTuner(profile, cap=8).target == 4
+    assert server.AdaptiveTuner(profile, cap=3).target == 3
+
+
+def test_failed_attempts_drop_a_connection(clock):
+    tuner = server.AdaptiveTuner(server.HostProfile(), cap=8)
+    _run(tuner, clock, lambda n: n * 1024 * 1024, errors=lambda tick: int(tick >= 3))
+    assert tuner.settled and tuner.target == 1
+
+
+def test_short_uploads_are_remembered_from_whole_transfer_samples(clock):
+    profile = server.HostProfile()
+    profile.record_sample(2, 10 * 1024 * 1024, 1.0)
+    profile.record_sample(3, 10 * 1024 * 1024, 1.0)  # No faster: the fewer wins the tie
+    profile.record_sample(1, 0, 1.0)  # Ignored
+    assert profile.best_sample() == 2 and profile.transfers == 2
+
+    tuner = server.AdaptiveTuner(profile, cap=8, size=10 * 1024 * 1024)
+    assert tuner.target == 2
+    tuner.remember(10 * 1024 * 1024, 1.0)  # Over before a window closed
+    # 10 MB/s over two connections: two seconds of one connection's 5 MB/s per piece
+    assert (profile.connections, profile.piece_size) == (2, 10 * 1024 * 1024)
+    assert profile.throughput == pytest.approx(10 * 1024 * 1024)
@@ -0,0 +1,67 @@
+"""Bandwidth scheduling: weighted shares of the global cap, pacing, and limits changed mid-transfer."""
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    scheduler = server.BandwidthScheduler(global_limit=None)
+    monkeypatch.setattr(server, "bandwidth", scheduler)
+    return scheduler
+
+
+def _rates(scheduler):
+    return {flow["transfer_id"]: flow["rate"] for flow in scheduler.stats()["flows"]}
+
+
+def test_global_cap_is_shared_by_priority_and_capped_flows_give_the_rest_back(scheduler):
+    async def run():
+        scheduler.set_global_limit(300_000)
+        scheduler.configure("a", priority=1)
+        for key in ("a", "b"):
+            await scheduler.acquire(key, 1)
+        assert _rates(scheduler) == {"a": 200_000, "b": 100_000}
+        scheduler.configure("b", limit=50_000)
+        assert _rates(scheduler) == {"a": 250_000, "b": 50_000}
+        scheduler.set_global_limit(None)
+        assert _rates(scheduler) == {"a": None, "b": 50_000}
+
+    asyncio.run(run())
+
+
+def test_acquire_paces_a_flow_to_its_limit(scheduler):
+    async def run():
+        scheduler.configure("paced", limit=2 * 1024 * 1024)
+        started = time.monotonic()
+        sent = 0
+        while sent < 1024 * 1024:
+            sent += await scheduler.acquire("paced", 256 * 1024)
+        return time.monotonic() - started
+
+    # One burst goes at once, the rest at 2 MB/s
+    assert 0.35 < asyncio.run(run()) < 1.5
+
+
+def test_lifting_a_limit_speeds_up_a_running_upload(ftp_server):
+    config = json.dumps(ftp_server.config().model_dump())
+    with TestClient(server.app) as client:
+        assert client.put("/api/ftp/bandwidth/slow", json={"limit": 64 * 1024}).status_code == 200
+        response = client.post("/api/ftp/jobs", params={"config": config, "transfer_id": "slow"},
+                               files={"file": ("slow.bin", b"s" * (4 * 1024 * 1024))})
+        assert response.status_code == 202
+        time.sleep(0.5)
+        assert client.get("/api/ftp/jobs/slow").json()["status"] == "running"
+        # At 64 KB/s this would take another minute
+        flows = client.put("/api/ftp/bandwidth/slow", json={"limit": None}).json()["flows"]
+        assert [(f["transfer_id"], f["limit"]) for f in flows] == [("slow", None)]
+        deadline = time.monotonic() + 5
+        while client.get("/api/ftp/jobs/slow").json()["status"] == "running" and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert client.get("/api/ftp/jobs/slow").json()["status"] == "completed"
+    assert (ftp_server.root / "slow.bin").stat().st_size == 4 * 1024 * 1024
@@ -0,0 +1,77 @@
+"""Batch sync uploads: one request, a few long-lived sessions, unchanged files skipped."""
+import json
+import time
+
+from fastapi.testclient import TestClient
+from pyftpdlib.handlers import FTPHandler
+
+import server
+from conftest import FTPServerInfo, serve_ftp
+
+
+class CountingHandler(FTPHandler):
+    sessions = 0
+
+    def on_connect(self):
+        CountingHandler.sessions += 1
+
+
+def _tree():
+    files = {f"photos/{year}/img{i:03}.jpg": f"{year}-{i}".encode() * 40 for year in (2023, 2024) for i in range(30)}
+    files["notes.txt"] = b"top level"
+    return files
+
+
+def _sync(client, ftp, files, mtime=None, **params):
+    manifest = json.dumps([{"path": path, "mtime": mtime} for path in files]) if mtime is not None else None
+    return client.post("/api/ftp/sync", params={"config": json.dumps(ftp.config().model_dump()), **params},
+                       data={"manifest": manifest} if manifest else None,
+                       files=[("files", (path, data)) for path, data in files.items()])
+
+
+def test_batch_lands_over_a_few_sessions_and_skips_unchanged_files(tmp_path):
+    root = tmp_path / "ftp"
+    root.mkdir()
+    (root / "photos").mkdir()
+    CountingHandler.sessions = 0
+    ftpd, thread, port = serve_ftp(root, CountingHandler)
+    ftp = FTPServerInfo(port, root)
+    files = _tree()
+    try:
+        with TestClient(server.app) as client:
+            result = _sync(client, ftp, files, connections=3).json()
+            assert result["ok"] and sorted(result["uploaded"]) == sorted(files)
+            assert result["created_dirs"] == ["photos/2023", "photos/2024"]
+            assert result["connections"] == 3
+            assert CountingHandler.sessions <= 3
+            for path, data in files.items():
+                assert (root / path).read_bytes() == data
+
+            # Older local copies of the same size are already on the server
+            again = _sync(client, ftp, files, mtime=time.time() - 3600).json()
+            assert again["uploaded"] == [] and sorted(again["skipped"]) == sorted(files)
+
+            files["photos/2024/img007.jpg"] = b"edited"
+            changed = _sync(client, ftp, files, mtime=time.time() - 3600).json()
+            assert changed["uploaded"] == ["photos/2024/img007.jpg"]
+            assert (root / "photos/2024/img007.jpg").read_bytes() == b"edited"
+    finally:
+        ftpd.close_all()
+        thread.join(5)
+
+
+def test_plan_reports_what_a_sync_would_do(ftp_server):
+    (ftp_server.root / "a").mkdir()
+    (ftp_server.root / "a" / "same.txt").write_bytes(b"12345")
+    (ftp_server.root / "a" / "grown.txt").write_bytes(b"1")
+    body = {"config": ftp_server.config().model_dump(), "files": [
+        {"path": "a/same.txt", "size": 5, "mtime": time.time() - 3600},
+        {"path": "a/grown.txt", "size": 2},
+        {"path": "/a/b/c/new.txt", "size": 3},
+    ]}
+    with TestClient(server.app) as client:
+        plan = client.post("/api/ftp/sync/plan", json=body).json()
+        assert plan == {"upload": ["a/b/c/new.txt", "a/grown.txt"], "skip": ["a/same.txt"],
+                        "create_dirs": ["a/b", "a/b/c"], "upload_bytes": 5}
+        body["files"].append({"path": "a/../../etc/passwd", "size": 1})
+        assert client.post("/api/ftp/sync/plan", json=body).status_code == 400
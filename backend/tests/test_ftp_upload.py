@@ -0,0 +1,154 @@
+"""Uploads against a real FTP server: round trips, retries and resume, CRC combining, jobs."""
+import json
+import os
+import random
+import time
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+from pyftpdlib.handlers import DTPHandler, FTPHandler
+
+import server
+from conftest import FTPServerInfo, SparseRestHandler, serve_ftp
+
+SIZE = server.FTP_RESUME_MIN_SIZE + 5 * 1024 * 1024 + 123  # Segmented, with a ragged last piece
+
+
+@pytest.fixture(scope="module")
+def payload():
+    return os.urandom(SIZE)
+
+
+def _upload(client, ftp, data, **params):
+    config = json.dumps(ftp.config(**params.pop("config", {})).model_dump())
+    return client.post("/api/ftp/upload", params={"config": config, **params}, files={"file": ("big.bin", data)})
+
+
+def test_segmented_upload_round_trip_is_byte_identical(sparse_ftp_server, payload):
+    with TestClient(server.app) as client:
+        response = _upload(client, sparse_ftp_server, payload, config={"max_connections": 4})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["parallel"] and result["connections"] == 4 and result["chunks"] > 2
+    assert [p.name for p in sparse_ftp_server.root.iterdir()] == ["big.bin"]
+    assert (sparse_ftp_server.root / "big.bin").read_bytes() == payload
+
+
+def test_upload_follows_the_seed_in_order_when_rest_past_eof_is_refused(ftp_server, payload):
+    with TestClient(server.app) as client:
+        response = _upload(client, ftp_server, payload, config={"max_connections": 4})
+    assert response.status_code == 200
+    assert not response.json()["parallel"]
+    assert [p.name for p in ftp_server.root.iterdir()] == ["big.bin"]
+    assert (ftp_server.root / "big.bin").read_bytes() == payload
+
+
+class QuotaHandler(SparseRestHandler):
+    """Refuses STOR with a permanent 550 once `quota["stors"]` of them have been accepted."""
+    quota = {"stors": None}
+
+    def ftp_STOR(self, file, mode="w"):
+        if self.quota["stors"] is not None:
+            if self.quota["stors"] <= 0:
+                self.respond("550 Quota exceeded.")
+                return
+            self.quota["stors"] -= 1
+        return super().ftp_STOR(file, mode)
+
+
+@pytest.fixture
+def quota_ftp_server(tmp_path):
+    root = tmp_path / "ftp"
+    root.mkdir()
+    ftpd, thread, port = serve_ftp(root, QuotaHandler)
+    yield FTPServerInfo(port, root)
+    QuotaHandler.quota["stors"] = None
+    ftpd.close_all()
+    thread.join(5)
+
+
+def test_partial_upload_resumes_from_the_reported_offset(quota_ftp_server, payload):
+    # Seed, tail probe and one piece get through; the next piece is refused
+    QuotaHandler.quota["stors"] = 3
+    with TestClient(server.app) as client:
+        failed = _upload(client, quota_ftp_server, payload, transfer_id="resume-me", config={"max_connections": 2})
+        assert failed.status_code == 500
+        assert failed.headers["X-Transfer-Id"] == "resume-me"
+        resume = client.get("/api/ftp/upload-resume/resume-me").json()
+        offset = resume["offset"]
+        assert resume["size"] == SIZE and server.FTP_SEED_SIZE <= offset < SIZE
+        assert [p.name for p in quota_ftp_server.root.iterdir()] == ["big.bin" + server.FTP_PART_SUFFIX]
+
+        stale = _upload(client, quota_ftp_server, payload[offset + 1:], transfer_id="resume-me", offset=offset + 1)
+        assert stale.status_code == 409 and stale.headers["X-Resume-Offset"] == str(offset)
+
+        QuotaHandler.quota["stors"] = None
+        resumed = _upload(client, quota_ftp_server, payload[offset:], transfer_id="resume-me", offset=offset,
+                          config={"max_connections": 2})
+        assert resumed.status_code == 200
+        assert resumed.json()["resumed_from"] == offset
+        assert client.get("/api/ftp/upload-resume/resume-me").status_code == 404
+    assert [p.name for p in quota_ftp_server.root.iterdir()] == ["big.bin"]
+    assert (quota_ftp_server.root / "big.bin").read_bytes() == payload
+
+
+class DroppingDTPHandler(DTPHandler):
+    """Aborts the first incoming transfer with a 426 once `drop_after` bytes have arrived."""
+    drop_after = None
+    received = 0
+
+    def handle_read(self):
+        before = self.tot_bytes_received
+        super().handle_read()
+        DroppingDTPHandler.received += self.tot_bytes_received - before
+        if self.drop_after is not None and self.tot_bytes_received >= self.drop_after:
+            DroppingDTPHandler.drop_after = None
+            self._resp = ("426 Connection reset; transfer aborted.", lambda msg: None)
+            self.close()
+
+    handle_read_event = handle_read
+
+
+def test_dropped_upload_continues_from_the_remote_size(tmp_path):
+    root = tmp_path / "ftp"
+    root.mkdir()
+    data = os.urandom(4 * 1024 * 1024)
+    DroppingDTPHandler.drop_after, DroppingDTPHandler.received = 3 * 1024 * 1024, 0
+    ftpd, thread, port = serve_ftp(root, type("DroppingHandler", (FTPHandler,), {"dtp_handler": DroppingDTPHandler}))
+    try:
+        with TestClient(server.app) as client:
+            response = _upload(client, FTPServerInfo(port, root), data)
+    finally:
+        ftpd.close_all()
+        thread.join(5)
+    assert response.status_code == 200
+    assert (root / "big.bin").read_bytes() == data
+    # The retry sent only what the server was missing
+    assert DroppingDTPHandler.received == len(data)
+
+
+@pytest.mark.parametrize("split", [0, 1, 7, 4096, 65537, 1 << 20])
+def test_crc32_combine_matches_crc32_of_the_concatenation(split):
+    rng = random.Random(split)
+    first = bytes(rng.getrandbits(8) for _ in range(split))
+    second = bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 70000)))
+    combined = server.crc32_combine(zlib.crc32(first), zlib.crc32(second), len(second))
+    assert combined == zlib.crc32(first + second)
+
+
+def test_segmented_job_is_accepted_then_cancelled(sparse_ftp_server, payload):
+    server.bandwidth.configure("big-cancel", limit=1024 * 1024)
+    config = json.dumps(sparse_ftp_server.config(max_connections=4).model_dump())
+    with TestClient(server.app) as client:
+        response = client.post("/api/ftp/jobs", params={"config": config, "transfer_id": "big-cancel"},
+                               files={"file": ("big.bin", payload)})
+        assert response.status_code == 202
+        assert response.json()["status"] in ("queued", "running")
+        while client.get("/api/ftp/transfer-status/big-cancel").json()["bytes_transferred"] <= server.FTP_SEED_SIZE:
+            time.sleep(0.05)
+        cancelled = client.delete("/api/ftp/jobs/big-cancel")
+        assert cancelled.json()["status"] == "cancelled"
+        assert client.delete("/api/ftp/jobs/big-cancel").status_code == 409
+        assert client.get("/api/ftp/upload-resume/big-cancel").status_code == 404
+    assert list(sparse_ftp_server.root.iterdir()) == []
@@ -0,0 +1,57 @@
+"""Recursive walks when the pool cannot give every worker a session."""
+import asyncio
+import contextlib
+import json
+
+from fastapi.testclient import TestClient
+
+import server
+
+
+def _make_tree(root, dirs: int = 10):
+    for i in range(dirs):
+        sub = root / f"d{i}"
+        sub.mkdir()
+        for j in range(3):
+            (sub / f"f{j}.bin").write_bytes(b"x" * (i + 1))
+
+
+def _walk(ftp_server, connections: int, held: int) -> dict:
+    server.ftp_pool.max_per_host = 8
+    server.ftp_pool.acquire_timeout = 0.3
+    cfg = ftp_server.config()
+
+    async def run():
+        async with contextlib.AsyncExitStack() as stack:
+            for _ in range(held):
+                await stack.enter_async_context(server.ftp_pool.connection(cfg))
+            walker = server.TreeWalker(server.FTPWalkQuery(config=cfg, entries=False, refresh=True), connections)
+            lines = [json.loads(line) for chunk in [c async for c in walker.stream()]
+                     for line in chunk.decode().splitlines()]
+        return lines[-1]
+
+    return asyncio.run(run())
+
+
+def test_workers_without_a_session_hand_their_directory_back(ftp_server):
+    _make_tree(ftp_server.root)
+    done = _walk(ftp_server, connections=8, held=6)
+    assert done["errors"] == 0
+    assert (done["files"], done["dirs"], done["listed_dirs"]) == (30, 10, 11)
+    assert done["bytes"] == sum(3 * (i + 1) for i in range(10))
+
+
+def test_walk_fails_only_when_no_worker_has_a_session(ftp_server):
+    _make_tree(ftp_server.root, dirs=2)
+    done = _walk(ftp_server, connections=2, held=8)
+    assert done["errors"] == done["listed_dirs"] == 1
+    assert done["files"] == 0
+
+
+def test_walk_connections_are_capped_at_the_pool_share(ftp_server):
+    _make_tree(ftp_server.root, dirs=2)
+    with TestClient(server.app) as client:
+        response = client.post("/api/ftp/walk", json={"config": ftp_server.config().model_dump(), "connections": 32})
+    done = json.loads(response.text.splitlines()[-1])
+    assert done["connections"] == server.transfer_jobs.connection_share() < 32
+    assert done["files"] == 6
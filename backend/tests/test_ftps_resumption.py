@@ -0,0 +1,88 @@
+"""FTPS data connections resume the control connection's TLS session."""
+import asyncio
+import datetime
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from pyftpdlib.handlers import TLS_FTPHandler
+
+import server
+from conftest import serve_ftp
+
+
+@pytest.fixture
+def ftps_server(tmp_path):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    pem = tmp_path / "server.pem"
+    pem.write_bytes(cert.public_bytes(serialization.Encoding.PEM) + key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    root = tmp_path / "root"
+    root.mkdir()
+
+    class Handler(TLS_FTPHandler):
+        certfile = str(pem)
+        tls_control_required = True
+        tls_data_required = True
+
+    ftpd, thread, port = serve_ftp(root, Handler)
+    yield port, root
+    ftpd.close_all()
+    thread.join(5)
+
+
+def test_data_connections_resume_control_session(ftps_server, monkeypatch):
+    port, root = ftps_server
+    monkeypatch.setattr(server, "ftp_tls", server.FTPTLSSessions())
+    cfg = server.FTPConfig(host="127.0.0.1", port=port, user="u", password="p", tls=True, tls_verify=False)
+    payload = b"x" * 100_000
+    (root / "a.bin").write_bytes(payload)
+
+    async def fetch_twice():
+        ftp = await server.connect_ftp(cfg)
+        reused = []
+        try:
+            for _ in range(2):
+                reader, writer = await ftp.transfercmd("RETR a.bin")
+                reused.append(writer.get_extra_info("ssl_object").session_reused)
+                data = b""
+                while block := await reader.read(65536):
+                    data += block
+                writer.close()
+                await ftp.voidresp()
+                assert data == payload
+        finally:
+            ftp.close()
+        return reused
+
+    assert asyncio.run(fetch_twice()) == [True, True]
+
+    stats = server.ftp_tls.stats()[f"127.0.0.1:{port}"]
+    assert stats["control"]["handshakes"] == 1
+    assert stats["control"]["resumed"] == 0
+    assert stats["data"]["handshakes"] == 2
+    assert stats["data"]["resumed"] == 2
+
+
+def test_new_control_connection_resumes_last_session(ftps_server, monkeypatch):
+    port, _ = ftps_server
+    monkeypatch.setattr(server, "ftp_tls", server.FTPTLSSessions())
+    cfg = server.FTPConfig(host="127.0.0.1", port=port, user="u", password="p", tls=True, tls_verify=False)
+
+    async def connect_twice():
+        for _ in range(2):
+            ftp = await server.connect_ftp(cfg)
+            ftp.close()
+
+    asyncio.run(connect_twice())
+    control = server.ftp_tls.stats()[f"127.0.0.1:{port}"]["control"]
+    assert control["handshakes"] == 2
+    assert control["resumed"] == 1
@@ -0,0 +1,111 @@
+"""Relay admission when two sockets present the same token at once."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+class GatedSocket:
+    """Just enough of a WebSocket for ws_relay; accept() waits until the test opens the gate."""
+
+    def __init__(self, gate: asyncio.Event, ip: str = "10.0.0.1"):
+        self.client = SimpleNamespace(host=ip)
+        self.gate = gate
+        self.accepted = False
+        self.close_code = None
+        self.sent = []
+        self.hangup = asyncio.Event()
+
+    async def accept(self):
+        await self.gate.wait()
+        self.accepted = True
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+        self.hangup.set()
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+    async def receive(self):
+        await self.hangup.wait()
+        return {"type": "websocket.disconnect"}
+
+
+@pytest.fixture
+def pair_session(monkeypatch):
+    monkeypatch.setattr(server, "relays", {})
+    monkeypatch.setattr(server, "relay_ips", {})
+    session = server.Session("relay-race")
+    session.clients = {"a": object(), "b": object()}
+    monkeypatch.setitem(server.sessions, "relay-race", session)
+    return "relay-race", server.relay_pair_id("a", "b")
+
+
+def test_same_token_twice_at_once_gets_one_end(pair_session):
+    session_id, relay_id = pair_session
+    token = server.relay_token(session_id, "a", "b")
+
+    async def run():
+        gate = asyncio.Event()
+        first, second = GatedSocket(gate), GatedSocket(gate)
+        tasks = [asyncio.create_task(server.ws_relay(ws, session_id, relay_id, "a", "b", token))
+                 for ws in (first, second)]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.sleep(0.05)
+        relay = server.relays[(session_id, relay_id)]
+        assert second.close_code == 1008 and not second.accepted
+        assert first.accepted and relay.members == {"a"} and len(relay.ends) == 1
+        assert server.relay_ips == {"10.0.0.1": 1}
+        first.hangup.set()
+        await asyncio.gather(*tasks)
+        assert server.relays == {} and server.relay_ips == {}
+
+    asyncio.run(run())
+
+
+def test_ip_cap_holds_for_concurrent_joins(pair_session, monkeypatch):
+    session_id, relay_id = pair_session
+    monkeypatch.setattr(server, "WS_RELAY_MAX_PER_IP", 1)
+
+    async def run():
+        gate = asyncio.Event()
+        a, b = GatedSocket(gate), GatedSocket(gate)
+        tasks = [asyncio.create_task(server.ws_relay(a, session_id, relay_id, "a", "b",
+                                                     server.relay_token(session_id, "a", "b"))),
+                 asyncio.create_task(server.ws_relay(b, session_id, relay_id, "b", "a",
+                                                     server.relay_token(session_id, "b", "a")))]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.sleep(0.05)
+        assert (a.close_code, b.close_code) == (None, 1008)
+        a.hangup.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+
+
+def test_pair_connects_both_ends_once():
+    async def run():
+        relay = server.Relay("s", server.relay_pair_id("a", "b"), "a", "b")
+        assert relay.reserve("a") and not relay.reserve("a") and not relay.reserve("c")
+        gate = asyncio.Event()
+        gate.set()
+        relay.attach(GatedSocket(gate), "a")
+        with pytest.raises(ValueError):
+            relay.attach(GatedSocket(gate), "a")  # Same member again
+        with pytest.raises(ValueError):
+            relay.attach(GatedSocket(gate), "b")  # Not reserved
+        assert relay.reserve("b")
+        relay.attach(GatedSocket(gate), "b")
+        assert relay.paired.is_set() and len(relay.pumps) == 2
+        with pytest.raises(ValueError):
+            relay.attach(GatedSocket(gate), "b")  # A third end
+        for task in relay.pumps:
+            task.cancel()
+        await asyncio.gather(*relay.pumps, return_exceptions=True)
+
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+"""Two workers' BrokerSessionBus instances routing through one SignalingBroker."""
+import asyncio
+import contextvars
+import json
+
+import server
+
+# Both buses share this process's `sessions`, so deliveries are recorded per
+# bus instead: each bus's reader task inherits `worker` from its start().
+worker = contextvars.ContextVar("worker")
+
+
+async def _wait_for(predicate, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out waiting for the broker"
+        await asyncio.sleep(0.01)
+
+
+def _frames(delivered, name):
+    return [(json.loads(text), to, exclude) for w, text, to, exclude in delivered if w == name]
+
+
+def test_broker_routes_between_workers_and_drops_a_closed_worker(monkeypatch):
+    delivered = []
+
+    def record(session_id, text, kind=server.FRAME_SIGNAL, to=None, exclude=None, sender=None):
+        delivered.append((worker.get(), text, to, exclude))
+
+    monkeypatch.setattr(server, "deliver_local", record)
+
+    async def scenario():
+        broker = server.SignalingBroker()
+        await broker.start("127.0.0.1", 0)
+        port = broker.server.sockets[0].getsockname()[1]
+        buses = {}
+        for name in ("a", "b"):
+            worker.set(name)
+            buses[name] = server.BrokerSessionBus(f"127.0.0.1:{port}")
+            await buses[name].start()
+        a, b = buses["a"], buses["b"]
+        worker.set("a")  # The calls below play worker a's request handlers
+        try:
+            await a.join("s", "alice", "sender")
+            await _wait_for(lambda: len(_frames(delivered, "a")) == 2)  # Roster, then alice's own join
+            delivered.clear()
+            await b.join("s", "bob", "receiver")
+            await _wait_for(lambda: _frames(delivered, "a") and _frames(delivered, "b"))
+
+            # The join reaches the other worker's members, and the joiner gets the roster
+            assert _frames(delivered, "a")[-1] == (
+                {"type": "peer-joined", "peer": "bob", "role": "receiver", "version": 2}, None, "bob")
+            snapshot, to, _ = _frames(delivered, "b")[0]
+            assert (snapshot["type"], sorted(snapshot["peers"]), to) == ("peers", ["alice", "bob"], "bob")
+
+            # Room-wide relay: the origin worker delivers locally, the broker forwards to the rest
+            delivered.clear()
+            a.relay("s", None, json.dumps({"type": "hello"}), sender="alice")
+            await _wait_for(lambda: _frames(delivered, "b"))
+            assert _frames(delivered, "b") == [({"type": "hello"}, None, "alice")]
+
+            # Direct relay to a client on the other worker
+            delivered.clear()
+            a.relay("s", "bob", json.dumps({"type": "sdp-offer", "from": "alice"}), sender="alice")
+            await _wait_for(lambda: _frames(delivered, "b"))
+            assert _frames(delivered, "b") == [({"type": "sdp-offer", "from": "alice"}, ["bob"], None)]
+
+            # Worker b goes away: its members leave and worker a hears about it
+            delivered.clear()
+            await b.close()
+            await _wait_for(lambda: "bob" not in broker.rosters["s"].members)
+            await _wait_for(lambda: _frames(delivered, "a"))
+            assert _frames(delivered, "a")[-1][0]["type"] == "peer-left"
+            assert _frames(delivered, "a")[-1][0]["peer"] == "bob"
+            assert list(broker.owners["s"]) == ["alice"]
+
+            await a.leave("s", "alice")
+            await _wait_for(lambda: "s" not in broker.rosters)
+            assert "s" not in broker.owners
+        finally:
+            await a.close()
+            await b.close()
+            await broker.close()
+
+    asyncio.run(scenario())
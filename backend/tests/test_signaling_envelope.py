@@ -0,0 +1,69 @@
+"""Relayed signaling frames: envelope-only reads, byte-identical forwarding, optional validation."""
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+def _join(ws, client_id):
+    ws.send_text(json.dumps({"type": "join", "clientId": client_id, "role": "peer"}))
+    return ws.receive_json()
+
+
+@pytest.mark.parametrize("frame, expected", [
+    ('{"type":"sdp-offer","to":"b","sdp":{}}', ("sdp-offer", "b")),
+    (' { "type" : "text" , "to" : "b\\u00e9", "text": 1}', ("text", "bé")),
+    ('{"type":"ping"}', ("ping", None)),
+    # Relayed without a leading string "to": parsed in full
+    ('{"type":"text","to":["b","c"]}', ("text", ["b", "c"])),
+    ('{"to":"b","type":"text"}', ("text", "b")),
+])
+def test_read_envelope(frame, expected):
+    assert server.read_envelope(frame, validate=False)[:2] == expected
+
+
+def test_envelope_scan_stops_before_the_body():
+    # Everything after "to" is left alone, however broken
+    assert server.scan_envelope('{"type":"text","to":"b","body":[}') == {"type": "text", "to": "b"}
+    assert server.scan_envelope('[{"type":"text"}]') is None
+
+
+@pytest.mark.parametrize("frame", [
+    '{"type":"text","to":"b","text":"cut',
+    '{"type":"text","to":"b","text":1}}',
+    '{"type":"text","to":5}',
+    '["type","text"]',
+])
+def test_validation_refuses_malformed_frames(frame):
+    with pytest.raises(ValueError):
+        server.read_envelope(frame, validate=True)
+
+
+def test_sdp_is_forwarded_byte_identical_with_from_spliced_in():
+    sdp = "v=0\r\n" + "a=candidate:1 1 udp 2122260223 192.168.1.2 54321 typ host generation 0\r\n" * 80
+    frame = json.dumps({"type": "sdp-offer", "to": "b", "sdp": {"type": "offer", "sdp": sdp}}, indent=1)
+    assert len(frame) > 4096
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws/session/envelope") as a, \
+                client.websocket_connect("/api/ws/session/envelope") as b:
+            _join(a, "a")
+            _join(b, "b")
+            a.receive_json()  # b joined
+            a.send_text(frame)
+            assert b.receive_text() == frame[:-1] + ',"from":"a"}'
+
+
+def test_malformed_frames_are_dropped_when_validating(monkeypatch):
+    monkeypatch.setattr(server, "WS_VALIDATE_ENVELOPE", True)
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws/session/validated") as a, \
+                client.websocket_connect("/api/ws/session/validated") as b:
+            _join(a, "a")
+            _join(b, "b")
+            a.receive_json()
+            a.send_text('{"type":"text","to":"b","text":"cut')
+            a.send_text('{"type":"text","to":5,"text":"no"}')
+            a.send_text('{"type":"text","to":"b","text":"ok"}')
+            assert b.receive_json() == {"type": "text", "to": "b", "text": "ok", "from": "a"}
@@ -0,0 +1,163 @@
+"""Signaling sessions: membership events, per-client outboxes, ICE batching and multicast, reaping."""
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import server
+
+
+def _join(ws, client_id, **extra):
+    ws.send_text(json.dumps({"type": "join", "clientId": client_id, "role": "peer", **extra}))
+    return ws.receive_json()
+
+
+def test_join_gets_a_snapshot_then_versioned_deltas(monkeypatch):
+    monkeypatch.setattr(server, "WS_SNAPSHOT_EVERY", 4)
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws/session/members") as a:
+            assert _join(a, "a") == {"type": "peers", "peers": ["a"], "version": 1}
+            with client.websocket_connect("/api/ws/session/members") as b:
+                assert _join(b, "b") == {"type": "peers", "peers": ["a", "b"], "version": 2}
+                assert a.receive_json() == {"type": "peer-joined", "peer": "b", "role": "peer", "version": 2}
+                with client.websocket_connect("/api/ws/session/members") as c:
+                    _join(c, "c")
+                    assert a.receive_json() == {"type": "peer-joined", "peer": "c", "role": "peer", "version": 3}
+                    assert b.receive_json()["version"] == 3
+                # c left: the fourth event goes out as a full snapshot instead of a delta
+                assert a.receive_json() == b.receive_json() == {"type": "peers", "peers": ["a", "b"], "version": 4}
+            assert a.receive_json() == {"type": "peer-left", "peer": "b", "role": "peer", "version": 5}
+
+
+class StalledSocket:
+    """A peer whose socket never finishes a send."""
+
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+        self.unblock = asyncio.Event()
+
+    async def send_text(self, text):
+        await self.unblock.wait()
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_outbox_never_blocks_and_sheds_ice_before_dropping_a_slow_peer(monkeypatch):
+    monkeypatch.setattr(server, "WS_OUTBOX_FRAMES", 4)
+
+    async def run():
+        session = server.get_or_create_session("outbox")
+        slow = server.WSClient(StalledSocket(), "slow", "peer")
+        await server.add_client(session, slow)
+        await asyncio.sleep(0)  # The writer takes the snapshot and stalls on it
+        for i in range(3):
+            assert server.send_to_client(session, slow, f'{{"n":{i}}}', server.FRAME_ICE)
+        assert server.send_to_client(session, slow, '{"sdp":1}')
+        # Full: whatever arrives pushes out the oldest queued candidate
+        assert server.send_to_client(session, slow, '{"sdp":2}')
+        assert server.send_to_client(session, slow, '{"n":3}', server.FRAME_ICE)
+        assert [text for _, text in slow.outbox] == ['{"n":2}', '{"sdp":1}', '{"sdp":2}', '{"n":3}']
+        assert slow.stats()["dropped_ice"] == 2 and slow.stats()["depth"] == 4
+
+        # A snapshot replaces queued membership frames rather than queueing behind them
+        slow.outbox.clear()
+        slow.send('{"type":"peer-joined"}', server.FRAME_MEMBERSHIP)
+        slow.send('{"sdp":3}')
+        slow.send('{"type":"peers"}', server.FRAME_SNAPSHOT)
+        assert [text for _, text in slow.outbox] == ['{"sdp":3}', '{"type":"peers"}']
+        assert slow.stats()["superseded"] == 1
+
+        # Only SDP queued and no candidate to shed: the persistently slow consumer is dropped
+        for i in range(2):
+            assert server.send_to_client(session, slow, f'{{"sdp":{4 + i}}}')
+        assert server.send_to_client(session, slow, '{"n":4}', server.FRAME_ICE)  # Shed on arrival
+        assert slow.stats()["dropped_ice"] == 3
+        assert not server.send_to_client(session, slow, '{"sdp":6}')
+        await asyncio.sleep(0.01)
+        assert slow.closed and slow.websocket.close_code == 1001
+        assert "outbox" not in server.sessions
+
+    asyncio.run(run())
+
+
+def test_ice_is_batched_only_for_clients_that_ask_for_it(monkeypatch):
+    # Long enough that only the SDP below can flush the batch
+    monkeypatch.setattr(server, "WS_ICE_BATCH_WINDOW", 5.0)
+    candidates = [json.dumps({"type": "ice-candidate", "to": ["a", "b"], "candidate": {"n": i}}) for i in range(3)]
+    relayed = [frame[:-1] + ',"from":"c"}' for frame in candidates]
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws/session/ice") as a, \
+                client.websocket_connect("/api/ws/session/ice") as b, \
+                client.websocket_connect("/api/ws/session/ice") as c:
+            _join(a, "a", features=["ice-batch"])
+            _join(b, "b")
+            _join(c, "c")
+            assert [a.receive_json()["peer"] for _ in range(2)] == ["b", "c"]
+            assert b.receive_json()["peer"] == "c"
+
+            for frame in candidates:
+                c.send_text(frame)
+            c.send_text('{"type":"sdp-offer","to":"*","sdp":{}}')
+            # One frame carrying the candidates verbatim, flushed ahead of the SDP that followed them
+            assert a.receive_text() == '{"type":"ice-batch","from":"c","candidates":[%s]}' % ",".join(relayed)
+            assert [b.receive_text() for _ in range(3)] == relayed
+            for ws in (a, b):
+                assert ws.receive_json() == {"type": "sdp-offer", "to": "*", "sdp": {}, "from": "c"}
+            stats = client.get("/api/ws/stats").json()["ice"]
+            assert (stats["a"]["batched_ice"], stats["b"]["batched_ice"]) == (3, 0)
+
+
+def test_socket_that_never_joins_is_closed_after_the_join_timeout(monkeypatch):
+    monkeypatch.setattr(server, "WS_JOIN_TIMEOUT", 0.1)
+    timeouts = server.ws_reaped["join_timeouts"]
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws/session/silent") as ws:
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_text()
+        assert closed.value.code == 1008
+        liveness = client.get("/api/ws/liveness").json()
+    assert liveness["reaped"]["join_timeouts"] == timeouts + 1
+    assert "silent" not in server.sessions
+
+
+def test_reaper_pings_live_clients_and_evicts_silent_ones(monkeypatch):
+    monkeypatch.setattr(server, "WS_PING_INTERVAL", 0.05)
+    dead = server.ws_reaped["dead_clients"]
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws/session/reap") as a, \
+                client.websocket_connect("/api/ws/session/reap") as b:
+            _join(a, "a")
+            _join(b, "b")
+            assert a.receive_json()["peer"] == "b"
+            assert b.receive_json() == {"type": "ping"}
+            server.sessions["reap"].clients["a"].last_seen = 0  # Missed every pong deadline
+            while (frame := b.receive_json())["type"] == "ping":
+                b.send_text('{"type":"pong"}')
+            assert frame == {"type": "peer-left", "peer": "a", "role": "peer", "version": 3}
+            with pytest.raises(WebSocketDisconnect):
+                while True:
+                    a.receive_text()
+            assert list(server.sessions["reap"].clients) == ["b"]
+    assert server.ws_reaped["dead_clients"] == dead + 1
+
+
+def test_full_session_refuses_another_peer(monkeypatch):
+    monkeypatch.setattr(server, "WS_MAX_PEERS", 1)
+    rejected = server.ws_reaped["rejected_peers"]
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws/session/full") as a, \
+                client.websocket_connect("/api/ws/session/full") as b:
+            _join(a, "a")
+            assert _join(b, "b") == {"type": "error", "error": "session is full"}
+            with pytest.raises(WebSocketDisconnect) as closed:
+                b.receive_text()
+            assert closed.value.code == 1013
+            # The same clientId reconnecting replaces its old socket rather than counting as a new peer
+            with client.websocket_connect("/api/ws/session/full") as again:
+                assert _join(again, "a")["type"] == "peers"
+    assert server.ws_reaped["rejected_peers"] == rejected + 1
@@ -0,0 +1,50 @@
+"""Queued uploads: what the job reports and what a cancelled job leaves on the server."""
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+import server
+
+
+def _wait_status(client, transfer_id, statuses, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/api/ftp/jobs/{transfer_id}").json()
+        if job["status"] in statuses or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def test_cancelled_small_upload_leaves_the_existing_file_alone(ftp_server):
+    (ftp_server.root / "small.bin").write_bytes(b"old contents")
+    server.bandwidth.configure("small-cancel", limit=64 * 1024)
+    config = json.dumps(ftp_server.config().model_dump())
+    with TestClient(server.app) as client:
+        response = client.post("/api/ftp/jobs", params={"config": config, "transfer_id": "small-cancel"},
+                               files={"file": ("small.bin", b"n" * (1024 * 1024))})
+        assert response.status_code == 202
+        assert _wait_status(client, "small-cancel", ("running",))["status"] == "running"
+        time.sleep(0.3)
+        assert client.delete("/api/ftp/jobs/small-cancel").json()["status"] == "cancelled"
+    assert sorted(p.name for p in ftp_server.root.iterdir()) == ["small.bin"]
+    assert (ftp_server.root / "small.bin").read_bytes() == b"old contents"
+
+
+def test_small_upload_lands_under_its_final_name(ftp_server):
+    config = json.dumps(ftp_server.config().model_dump())
+    with TestClient(server.app) as client:
+        response = client.post("/api/ftp/upload", params={"config": config}, files={"file": ("a.txt", b"hello")})
+    assert response.status_code == 200
+    assert [p.name for p in ftp_server.root.iterdir()] == ["a.txt"]
+    assert (ftp_server.root / "a.txt").read_bytes() == b"hello"
+
+
+def test_job_reports_the_connections_it_will_use(ftp_server):
+    config = json.dumps(ftp_server.config(max_connections=8).model_dump())
+    share = server.transfer_jobs.connection_share()
+    with TestClient(server.app) as client:
+        submitted = client.post("/api/ftp/jobs", params={"config": config}, files={"file": ("c.bin", b"c")}).json()
+        job = _wait_status(client, submitted["transfer_id"], ("completed", "failed"))
+    assert submitted["connections"] == job["connections"] == min(8, share)
+    assert job["requested_connections"] == 8
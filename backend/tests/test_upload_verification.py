@@ -0,0 +1,105 @@
+"""Uploads hashed while they are sent and checked with the server's HASH/XCRC."""
+import hashlib
+import json
+import os
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from conftest import FTPServerInfo, SparseRestHandler, serve_ftp
+
+
+class HashingHandler(SparseRestHandler):
+    """pyftpdlib with HASH (SHA-256 and CRC32, RFC draft-bryan-ftpext-hash) and XCRC."""
+    proto_cmds = {
+        **SparseRestHandler.proto_cmds,
+        "HASH": dict(perm="r", auth=True, arg=True, help="Syntax: HASH <SP> file-name (hash a file)."),
+        "XCRC": dict(perm="r", auth=True, arg=True, help="Syntax: XCRC <SP> file-name (CRC32 of a file)."),
+    }
+    corrupt = False  # Report a hash of something else
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._extra_feats.append("HASH SHA-256*;CRC32")
+        self._hash_algorithm = "SHA-256"
+
+    def ftp_OPTS(self, line):
+        cmd, _, arg = line.partition(" ")
+        if cmd.upper() != "HASH":
+            return super().ftp_OPTS(line)
+        if arg not in ("SHA-256", "CRC32"):
+            return self.respond("501 Unknown algorithm.")
+        self._hash_algorithm = arg
+        self.respond(f"200 {arg}")
+
+    def _digest(self, path: str, algorithm: str) -> str:
+        with open(path, "rb") as f:
+            data = f.read() + (b"x" if self.corrupt else b"")
+        if algorithm == "CRC32":
+            return f"{zlib.crc32(data):08x}"
+        return hashlib.sha256(data).hexdigest()
+
+    def ftp_HASH(self, path):
+        size = os.path.getsize(path)
+        digest = self._digest(path, self._hash_algorithm)
+        self.respond(f"213 {self._hash_algorithm} 0-{size} {digest} {os.path.basename(path)}")
+
+    def ftp_XCRC(self, path):
+        self.respond(f"250 {self._digest(path, 'CRC32').upper()}")
+
+
+@pytest.fixture
+def hashing_ftp_server(tmp_path):
+    root = tmp_path / "ftp"
+    root.mkdir()
+    ftpd, thread, port = serve_ftp(root, HashingHandler)
+    yield FTPServerInfo(port, root)
+    HashingHandler.corrupt = False
+    ftpd.close_all()
+    thread.join(5)
+
+
+def _upload(client, ftp, data, **overrides):
+    config = json.dumps(ftp.config(verify=True, **overrides).model_dump())
+    return client.post("/api/ftp/upload", params={"config": config}, files={"file": ("v.bin", data)})
+
+
+def test_single_stream_upload_is_checked_with_the_strongest_hash(hashing_ftp_server):
+    data = os.urandom(256 * 1024)
+    with TestClient(server.app) as client:
+        result = _upload(client, hashing_ftp_server, data).json()
+    verification = result["verification"]
+    assert (verification["method"], verification["algorithm"], verification["verified"]) == ("HASH", "SHA-256", True)
+    assert verification["local"]["SHA-256"] == hashlib.sha256(data).hexdigest()
+
+
+def test_segmented_upload_combines_piece_crcs(hashing_ftp_server):
+    data = os.urandom(server.FTP_RESUME_MIN_SIZE + 3 * 1024 * 1024 + 1)
+    with TestClient(server.app) as client:
+        result = _upload(client, hashing_ftp_server, data, max_connections=4).json()
+    assert result["parallel"]
+    verification = result["verification"]
+    assert (verification["algorithm"], verification["verified"]) == ("CRC32", True)
+    assert verification["local"]["CRC32"] == f"{zlib.crc32(data):08x}"
+
+
+def test_mismatch_fails_the_upload_and_removes_the_part_file(hashing_ftp_server):
+    HashingHandler.corrupt = True
+    with TestClient(server.app) as client:
+        response = _upload(client, hashing_ftp_server, b"payload")
+        assert response.status_code == 500
+        assert "SHA-256 mismatch" in response.json()["detail"]
+        status = client.get(f"/api/ftp/transfer-status/{response.headers['X-Transfer-Id']}").json()
+    assert status["status"] == "failed" and status["verification"]["verified"] is False
+    assert list(hashing_ftp_server.root.iterdir()) == []
+
+
+def test_server_without_hashing_leaves_the_upload_unverified(ftp_server):
+    with TestClient(server.app) as client:
+        result = _upload(client, ftp_server, b"payload").json()
+    # pyftpdlib answers XCRC with 500, which turns it off for the host
+    assert result["verification"]["verified"] is None
+    assert server.ftp_host_caps[("127.0.0.1", ftp_server.port)]["xcrc"] is False
+    assert (ftp_server.root / "v.bin").read_bytes() == b"payload"
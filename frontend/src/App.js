@@ -73,6 +73,77 @@ function wsUrlFor(path) {
 
 const PC_CONFIG = { iceServers: [{ urls: ["stun:stun.l.google.com:19302", "stun:global.stun.twilio.com:3478"] }] };
 
+// Server-relayed stand-in for an RTCDataChannel, used when WebRTC cannot connect
+// (client-isolated guest Wi-Fi, strict corporate networks). Frames go through
+// /api/ws/relay with credit-based flow control; the transfer code sees the same
+// send / bufferedAmount / bufferedamountlow / onmessage surface as a data channel.
+const RELAY_PREFIX = "RELAY:";
+const RELAY_FALLBACK_MS = 15000;
+
+class RelayChannel extends EventTarget {
+  constructor(url) {
+    super();
+    this.readyState = "connecting";
+    this.binaryType = "arraybuffer";
+    this.bufferedAmountLowThreshold = 0;
+    this.onopen = null; this.onmessage = null; this.onclose = null; this.onerror = null;
+    this.credit = 0;
+    this.pending = [];
+    this.pendingBytes = 0;
+    const ws = new WebSocket(url);
+    ws.binaryType = "arraybuffer";
+    this.ws = ws;
+    ws.onmessage = (ev) => {
+      if (typeof ev.data === "string" && ev.data.startsWith(RELAY_PREFIX)) {
+        const ctl = JSON.parse(ev.data.slice(RELAY_PREFIX.length));
+        if (ctl.type === "ready") { this.credit = ctl.credit; this.readyState = "open"; this.emit("open"); }
+        else if (ctl.type === "credit") { this.credit += ctl.n; }
+        else if (ctl.type === "peer-closed") { ws.close(); }
+        this.flush();
+        return;
+      }
+      this.emit("message", { data: ev.data });
+    };
+    ws.onerror = () => this.emit("error");
+    ws.onclose = () => {
+      if (this.readyState === "closed") return;
+      this.readyState = "closed";
+      this.pending = []; this.pendingBytes = 0;
+      this.emit("close");
+    };
+  }
+
+  // Only frames still waiting for credit; the server bounds what is in flight
+  get bufferedAmount() { return this.pendingBytes; }
+
+  send(data) {
+    if (this.readyState !== "open") throw new Error("Relay is not open");
+    this.pending.push(data);
+    this.pendingBytes += typeof data === "string" ? data.length : data.byteLength;
+    this.flush();
+  }
+
+  close() { this.ws.close(); }
+
+  flush() {
+    const wasAbove = this.pendingBytes > this.bufferedAmountLowThreshold;
+    while (this.credit > 0 && this.pending.length) {
+      const data = this.pending.shift();
+      this.pendingBytes -= typeof data === "string" ? data.length : data.byteLength;
+      this.credit -= 1;
+      this.ws.send(data);
+    }
+    if (wasAbove && this.pendingBytes <= this.bufferedAmountLowThreshold) this.emit("bufferedamountlow");
+  }
+
+  emit(type, init = {}) {
+    const ev = Object.assign(new Event(type), init);
+    const handler = this["on" + type];
+    if (handler) handler(ev);
+    this.dispatchEvent(ev);
+  }
+}
+
 function useDarkMode() {
   // Always use dark mode
   useEffect(() => { document.documentElement.classList.add('dark'); }, []);
@@ -167,6 +238,8 @@ function Session() {
   const wsReconnectAttemptsRef = useRef(0);
   const wsReconnectTimerRef = useRef(null);
   const wsKeepAliveTimerRef = useRef(null);
+  const peerSetRef = useRef(new Set());
+  const peersVersionRef = useRef(0);
 
   const pcRef = useRef(null);
   const dcRef = useRef(null);
@@ -177,6 +250,7 @@ function Session() {
   const makingOfferRef = useRef(false);
   const isSettingRemoteAnswerRef = useRef(false);
   const politeRef = useRef(false);
+  const relayTimerRef = useRef(null);
 
   // Sequential file transfer state
   const currentlySendingRef = useRef(false);
@@ -312,7 +386,8 @@ function Session() {
       console.log(`🔗 WebSocket connected as ${isHost ? "HOST" : "PEER"}`);
       setRole(isHost ? "host" : "peer");
       politeRef.current = !isHost; // callee is polite
-      ws.send(JSON.stringify({ type: "join", clientId, role: isHost ? "host" : "peer" }));
+      peersVersionRef.current = 0; // The server may have restarted the session's version count
+      ws.send(JSON.stringify({ type: "join", clientId, role: isHost ? "host" : "peer", features: ["ice-batch"] }));
       flushSignalQueue();
 
       // Reset reconnect attempts on successful open
@@ -327,12 +402,35 @@ function Session() {
 
     ws.onmessage = async (ev) => {
       const msg = JSON.parse(ev.data);
-      if (msg.type === "peers") {
-        const others = (msg.peers || []).filter((p) => p !== clientId);
+      if (msg.type === "ping") {
+        // Server liveness check; a socket that stops answering gets evicted
+        try { ws.send(JSON.stringify({ type: "pong" })); } catch {}
+        return;
+      }
+      if (msg.type === "error") {
+        console.warn("Signaling server refused the session:", msg.error);
+        return;
+      }
+      if (msg.type === "peers" || msg.type === "peer-joined" || msg.type === "peer-left") {
+        // Snapshots replace the set; deltas older than the last snapshot are stale
+        const version = msg.version || 0;
+        if (msg.type === "peers") {
+          if (version < peersVersionRef.current) return;
+          peerSetRef.current = new Set(msg.peers || []);
+          peersVersionRef.current = version;
+        } else {
+          if (version && version <= peersVersionRef.current) return;
+          if (msg.type === "peer-joined") peerSetRef.current.add(msg.peer);
+          else peerSetRef.current.delete(msg.peer);
+        }
+        const others = [...peerSetRef.current].filter((p) => p !== clientId);
         console.log(`👥 Peers updated: ${others.length} peer(s)`, others);
         setPeers(others);
         if (!remoteIdRef.current && others.length > 0) {
           remoteIdRef.current = others[0];
+          // If WebRTC has not produced an open data channel by then, use the server relay
+          if (relayTimerRef.current) clearTimeout(relayTimerRef.current);
+          relayTimerRef.current = setTimeout(() => { relayTimerRef.current = null; startRelayFallback(); }, RELAY_FALLBACK_MS);
           const isHost = sessionStorage.getItem(`hostFor:${sessionId}`) === "1";
           console.log(`🤝 Connecting to peer: ${others[0]} (I am ${isHost ? "HOST" : "PEER"})`);
           if (isHost) { 
@@ -345,6 +443,10 @@ function Session() {
           }
         }
       }
+      if (msg.type === "relay-offer") {
+        acceptRelayOffer(msg);
+        return;
+      }
       if (msg.type === "sdp-offer") {
         console.log("📥 Received SDP offer from", msg.from);
         await ensurePeerConnection(false);
@@ -394,15 +496,18 @@ function Session() {
           console.error("❌ Failed to set remote answer", e);
         }
       }
-      if (msg.type === "ice-candidate") {
+      if (msg.type === "ice-candidate" || msg.type === "ice-batch") {
+        // The server may coalesce trickled candidates into one ice-batch frame
+        const items = msg.type === "ice-batch" ? (msg.candidates || []) : [msg];
         const pc = pcRef.current;
-        if (pc && msg.candidate) {
-          try {
-            const candidate = msg.candidate;
-            await pc.addIceCandidate(candidate);
-            console.log("❄️ Added ICE candidate");
-          } catch(e) {
-            console.error("❌ addIceCandidate failed", e);
+        for (const item of items) {
+          if (pc && item.candidate) {
+            try {
+              await pc.addIceCandidate(item.candidate);
+              console.log("❄️ Added ICE candidate");
+            } catch(e) {
+              console.error("❌ addIceCandidate failed", e);
+            }
           }
         }
       }
@@ -501,8 +606,9 @@ function Session() {
             return updated;
           });
         }
-        // attempt restart after a short delay
-        setTimeout(() => attemptIceRestart(), 1500);
+        // attempt restart after a short delay; once restarts are exhausted, relay instead
+        if (iceState === "failed" && iceRestartAttemptsRef.current >= 3) startRelayFallback();
+        else setTimeout(() => attemptIceRestart(), 1500);
       }
     };
 
@@ -747,6 +853,27 @@ function Session() {
     };
   };
 
+  const startRelayFallback = () => {
+    const remote = remoteIdRef.current;
+    const dc = dcRef.current;
+    if (!remote) return;
+    if (dc && dc.readyState === "open") return; // WebRTC got through after all
+    if (dc instanceof RelayChannel && dc.readyState !== "closed") return; // Already relaying
+    // The server answers both of us with a relay-offer carrying the pair's token
+    console.warn("📡 Data channel unavailable, asking for a server relay");
+    sendSignal({ type: "relay-request", to: remote });
+  };
+
+  const acceptRelayOffer = (offer) => {
+    const dc = dcRef.current;
+    if (dc && dc.readyState === "open") return;
+    if (dc instanceof RelayChannel && dc.readyState !== "closed") return; // Already relaying
+    const query = `client=${encodeURIComponent(clientId)}&peer=${encodeURIComponent(offer.peer)}&token=${encodeURIComponent(offer.token)}`;
+    const path = `/api/ws/relay/${encodeURIComponent(sessionId)}/${encodeURIComponent(offer.relay)}?${query}`;
+    console.warn("📡 Using server relay with", offer.peer);
+    attachDataChannel(new RelayChannel(wsUrlFor(path)));
+  };
+
   const createOffer = useCallback(async () => {
     const pc = pcRef.current || (await ensurePeerConnection(true));
     try {
@@ -764,6 +891,7 @@ function Session() {
   useEffect(() => { initWebSocket(); return () => {
     try { if (wsRef.current) wsRef.current.close(); } catch {}
     try { if (wsKeepAliveTimerRef.current) clearInterval(wsKeepAliveTimerRef.current); } catch {}
+    try { if (relayTimerRef.current) clearTimeout(relayTimerRef.current); } catch {}
   }; }, [initWebSocket]);
 
   // Process next file in queue sequentially